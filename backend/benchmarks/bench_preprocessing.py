@@ -0,0 +1,99 @@
+"""
+Micro-benchmark del preprocesado de imágenes.
+
+Compara el camino original (decodificación completa, resize, img_to_array,
+división y reshape) con `backend.services.image_preprocessing` sobre fotos
+sintéticas del tamaño de una cámara de teléfono.
+
+Uso:
+    python -m backend.benchmarks.bench_preprocessing --sizes 4000x3000 1920x1080 --repeat 20
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from backend.services.image_preprocessing import preprocess_image, preprocess_batch
+
+
+def make_image(width, height, fmt="JPEG", seed=0):
+    """Genera una imagen sintética con textura para que el códec no la trivialice."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    img = Image.fromarray(base).resize((width, height), Image.BILINEAR)
+    buf = BytesIO()
+    img.save(buf, format=fmt, quality=90)
+    return buf.getvalue()
+
+
+def legacy_preprocess(image_bytes):
+    """Réplica del preprocesado original de skin_analysis_service."""
+    img = Image.open(BytesIO(image_bytes))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img_resized = img.resize((224, 224))
+    # Equivalente a tf.keras.preprocessing.image.img_to_array
+    img_array = np.asarray(img_resized, dtype=np.float32)
+    img_array = img_array / 255.0
+    return img_array.reshape((1, 224, 224, 3))
+
+
+def fast_preprocess(image_bytes):
+    return preprocess_image(image_bytes, reuse_buffer=True)
+
+
+def measure(fn, payload, repeat):
+    fn(payload)  # calentamiento
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(payload)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    tracemalloc.start()
+    fn(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "peak_kib": peak / 1024.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["4032x3024", "1920x1080", "640x480"])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=8, help="Tamaño de lote para preprocess_batch")
+    args = parser.parse_args()
+
+    header = f"{'imagen':<18}{'ruta':<10}{'media ms':>10}{'p50 ms':>10}{'min ms':>10}{'pico KiB':>12}"
+    print(header)
+    print("-" * len(header))
+    for size in args.sizes:
+        width, height = (int(v) for v in size.lower().split("x"))
+        for fmt in args.formats:
+            payload = make_image(width, height, fmt)
+            label = f"{size} {fmt}"
+            legacy = measure(legacy_preprocess, payload, args.repeat)
+            fast = measure(fast_preprocess, payload, args.repeat)
+            # Comprobar que ambos caminos producen tensores comparables
+            diff = float(np.abs(legacy_preprocess(payload) - fast_preprocess(payload)).max())
+            for name, r in (("original", legacy), ("rápida", fast)):
+                print(f"{label:<18}{name:<10}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['min_ms']:>10.2f}{r['peak_kib']:>12.1f}")
+            print(f"{'':<18}{'speedup':<10}{legacy['mean_ms'] / fast['mean_ms']:>10.2f}x  (max |diff| = {diff:.4f})")
+
+        payloads = [make_image(width, height, "JPEG", seed=i) for i in range(args.batch)]
+        out = np.empty((args.batch, 224, 224, 3), dtype=np.float32)
+        batch = measure(lambda p: preprocess_batch(p, out=out), payloads, args.repeat)
+        print(f"{size + ' x' + str(args.batch):<18}{'lote':<10}{batch['mean_ms']:>10.2f}{batch['p50_ms']:>10.2f}{batch['min_ms']:>10.2f}{batch['peak_kib']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""
+Benchmark de carga y latencia extremo a extremo del backend FastAPI.
+
+Arranca `backend.main:app` en el propio proceso (transporte ASGI de httpx) o
+con uvicorn en un subproceso, y lanza peticiones concurrentes contra cada
+endpoint de /skin/api/* con imágenes sintéticas de varias resoluciones y
+formatos. Si no existen los .keras reales, genera modelos sustitutos pequeños
+y deterministas; los endpoints de OpenAI se apuntan a un stub local.
+
+Informa throughput, latencias p50/p95/p99, errores y pico de RSS, y puede
+guardar un informe JSON para comparar commits:
+
+    python -m backend.benchmarks.load_test --concurrency 1 8 32 --requests 200 --json bench.json
+    python -m backend.benchmarks.load_test --mode uvicorn --workers 2 --endpoints analyze-lunares analyze-all
+    python -m backend.benchmarks.load_test --compare base.json bench.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from backend.benchmarks.bench_preprocessing import make_image
+
+# Respuestas canónicas del stub de OpenAI
+_STUB_CONTENT = json.dumps({
+    "afeccion": "Acné",
+    "descripcion": "Respuesta simulada para el benchmark.",
+    "recomendaciones": ["Uno", "Dos", "Tres", "Cuatro", "Cinco"],
+})
+
+# Endpoint -> (método, ruta, tipo de cuerpo)
+ENDPOINTS = {
+    "upload": ("POST", "/skin/upload", "image"),
+    "analyze": ("POST", "/skin/api/analyze", "image"),
+    "analyze-lunares": ("POST", "/skin/api/analyze-lunares", "image"),
+    "analyze-acne": ("POST", "/skin/api/analyze-acne", "image"),
+    "analyze-rosacea": ("POST", "/skin/api/analyze-rosacea", "image"),
+    "analyze-all": ("POST", "/skin/api/analyze-all", "image"),
+    "analyze-batch": ("POST", "/skin/api/analyze-batch", "images"),
+    "condition": ("GET", "/skin/api/condition/acne", None),
+    "openai-analizar": ("POST", "/skin/openai-analizar", "image"),
+    "openai-recomendaciones": ("POST", "/skin/openai-recomendaciones", "json"),
+}
+DEFAULT_ENDPOINTS = ["analyze", "analyze-lunares", "analyze-acne", "analyze-rosacea", "analyze-all", "condition"]
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+# --- Modelos sustitutos y stub de OpenAI ---
+
+def build_stand_in_models(directory):
+    """
+    Crea modelos .keras pequeños y deterministas con la misma interfaz que los
+    reales (entrada 224x224x3; softmax de 7 clases o sigmoid de 1 salida).
+    """
+    from backend.config.model_config import get_tensorflow
+
+    tf = get_tensorflow()
+    paths = {}
+    for name, units, activation in (("lunares", 7, "softmax"), ("acne", 1, "sigmoid"), ("rosacea", 1, "sigmoid")):
+        tf.keras.utils.set_random_seed(0)
+        model = tf.keras.Sequential([
+            tf.keras.Input(shape=(224, 224, 3)),
+            tf.keras.layers.Conv2D(8, 3, strides=4, activation="relu"),
+            tf.keras.layers.GlobalAveragePooling2D(),
+            tf.keras.layers.Dense(units, activation=activation),
+        ])
+        path = os.path.join(directory, f"{name}.keras")
+        model.save(path)
+        paths[name] = path
+    return paths
+
+
+class _OpenAIStubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": _STUB_CONTENT}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_openai_stub(latency=0.0):
+    handler = type("Handler", (_OpenAIStubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def _real_models_available():
+    """Comprueba si existen los .keras reales sin importar la configuración (que importa TensorFlow)."""
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    defaults = {
+        "LUNARES_MODEL_PATH": os.path.join(backend_dir, "modelos", "ham10000", "lunares.keras"),
+        "ACNE_MODEL_PATH": os.path.join(backend_dir, "modelos", "acne", "acne.keras"),
+        "ROSACEA_MODEL_PATH": os.path.join(backend_dir, "modelos", "rosacea", "rosacea.keras"),
+    }
+    return all(os.path.exists(os.getenv(var, default)) for var, default in defaults.items())
+
+
+def prepare_environment(args, workdir):
+    """
+    Configura el entorno antes de importar el backend: la configuración lee las
+    rutas al importarse, así que las de los sustitutos se fijan antes de
+    construirlos (lo que ya importa la configuración).
+    """
+    env = {}
+    stand_in = args.stand_in_models or not _real_models_available()
+    if stand_in:
+        print("Usando modelos sustitutos deterministas.")
+        env.update({
+            "LUNARES_MODEL_PATH": os.path.join(workdir, "lunares.keras"),
+            "ACNE_MODEL_PATH": os.path.join(workdir, "acne.keras"),
+            "ROSACEA_MODEL_PATH": os.path.join(workdir, "rosacea.keras"),
+        })
+    stub, base_url = start_openai_stub(args.openai_latency)
+    env.update({"OPENAI_BASE_URL": base_url, "OPENAI_API_KEY": "sk-bench"})
+    # Cachés desactivadas por defecto: cada petición debe hacer el trabajo completo
+    if not args.keep_cache:
+        env["PREDICTION_CACHE_BACKEND"] = "none"
+        env["RECOMMENDATION_CACHE_BACKEND"] = "none"
+    os.environ.update(env)
+    if stand_in:
+        build_stand_in_models(workdir)
+    return stub, env
+
+
+# --- Generación de peticiones ---
+
+def build_payloads(resolutions, formats):
+    payloads = []
+    for resolution in resolutions:
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        for fmt in formats:
+            payloads.append((f"{resolution}.{fmt.lower()}", make_image(width, height, fmt), MIME_TYPES[fmt]))
+    return payloads
+
+
+def request_kwargs(kind, payload):
+    filename, data, mime = payload
+    if kind == "image":
+        return {"files": {"file": (filename, data, mime)}}
+    if kind == "images":
+        return {"files": [("files", (f"{i}-{filename}", data, mime)) for i in range(4)]}
+    if kind == "json":
+        return {"json": {"prediccion": "Con acné"}}
+    return {}
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def drive(client, endpoint, payloads, concurrency, total, duration):
+    method, path, kind = ENDPOINTS[endpoint]
+    latencies, statuses = [], {}
+    counter = itertools.count()
+    cycle = itertools.cycle(payloads)
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def _worker():
+        while True:
+            i = next(counter)
+            if (total and i >= total) or (deadline and time.perf_counter() >= deadline):
+                return
+            kwargs = request_kwargs(kind, next(cycle))
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                await response.aread()
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    ok = sum(n for status, n in statuses.items() if isinstance(status, int) and status < 400)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else 0.0,
+    }
+
+
+# --- Medición de memoria ---
+
+def _proc_kb(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(c) for c in f.read().split()]
+    except OSError:
+        return []
+
+
+class RSSSampler:
+    """Muestrea el RSS del servidor (y sus workers) para obtener el pico total."""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            pids = [self.pid] + _children(self.pid)
+            self.peak_kb = max(self.peak_kb, sum(_proc_kb(p, "VmRSS") for p in pids))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# --- Modos de arranque ---
+
+async def wait_until_ready(client, timeout, alive=lambda: True):
+    """
+    Espera a que /health/ready responda 200 (modelos cargados y calentados)
+    para que la carga y el calentamiento no entren en las latencias medidas.
+    """
+    import httpx
+
+    started = time.perf_counter()
+    while True:
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                break
+        except httpx.TransportError:
+            pass
+        if not alive() or time.perf_counter() - started > timeout:
+            raise SystemExit("El servidor no llegó a estar listo.")
+        await asyncio.sleep(0.2)
+    print(f"Servidor listo en {time.perf_counter() - started:.1f}s")
+
+
+async def run_in_process(args, payloads):
+    import httpx
+    from backend.main import app
+
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            # Con MODEL_WARMUP_MODE=background el lifespan vuelve antes de calentar los modelos
+            await wait_until_ready(client, args.startup_timeout)
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    result = await drive(client, endpoint, payloads, concurrency, args.requests, args.duration)
+                    results.append(result)
+                    print_result(result)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results, {"peak_rss_mb": peak_kb / 1024.0, "rss_scope": "proceso del benchmark (cliente + app)"}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_uvicorn(args, payloads, env):
+    import httpx
+
+    port = args.port or _free_port()
+    cmd = [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1",
+           "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"]
+    server = subprocess.Popen(cmd, env={**os.environ, **env})
+    base_url = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout,
+                                     limits=httpx.Limits(max_connections=max(args.concurrency) * 2)) as client:
+            await wait_until_ready(client, args.startup_timeout, alive=lambda: server.poll() is None)
+            with RSSSampler(server.pid) as sampler:
+                for endpoint in args.endpoints:
+                    for concurrency in args.concurrency:
+                        result = await drive(client, endpoint, payloads, concurrency, args.requests, args.duration)
+                        results.append(result)
+                        print_result(result)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return results, {"peak_rss_mb": sampler.peak_kb / 1024.0, "rss_scope": f"servidor uvicorn ({args.workers} workers)"}
+
+
+# --- Informe ---
+
+def print_result(r):
+    print(
+        f"{r['endpoint']:<24} c={r['concurrency']:<4} n={r['requests']:<6} err={r['errors']:<4} "
+        f"{r['throughput_rps']:>8.1f} req/s  p50 {r['p50_ms']:>8.1f}  p95 {r['p95_ms']:>8.1f}  p99 {r['p99_ms']:>8.1f} ms"
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = {(r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'endpoint':<24}{'c':>4}{'req/s':>18}{'p95 ms':>22}")
+    for r in new:
+        b = base.get((r["endpoint"], r["concurrency"]))
+        if not b:
+            continue
+        rps = (r["throughput_rps"] / b["throughput_rps"] - 1) * 100 if b["throughput_rps"] else 0.0
+        p95 = (r["p95_ms"] / b["p95_ms"] - 1) * 100 if b["p95_ms"] else 0.0
+        print(f"{r['endpoint']:<24}{r['concurrency']:>4}{r['throughput_rps']:>10.1f} ({rps:+5.1f}%){r['p95_ms']:>12.1f} ({p95:+5.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn (modo uvicorn)")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Peticiones por endpoint y nivel de concurrencia")
+    parser.add_argument("--duration", type=float, default=None, help="Alternativa a --requests: segundos por escenario")
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1920x1080", "4032x3024"])
+    parser.add_argument("--formats", nargs="+", choices=list(MIME_TYPES), default=["JPEG", "PNG"])
+    parser.add_argument("--stand-in-models", action="store_true", help="Forzar modelos sustitutos aunque existan los reales")
+    parser.add_argument("--keep-cache", action="store_true", help="No desactivar las cachés de predicciones y recomendaciones")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="Latencia simulada del stub de OpenAI (s)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--json", help="Guardar el informe en este fichero JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NUEVO"), help="Comparar dos informes JSON y salir")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.duration:
+        args.requests = 0
+
+    with tempfile.TemporaryDirectory(prefix="pielsana-bench-") as workdir:
+        stub, env = prepare_environment(args, workdir)
+        payloads = build_payloads(args.resolutions, args.formats)
+        try:
+            if args.mode == "uvicorn":
+                results, memory = asyncio.run(run_uvicorn(args, payloads, env))
+            else:
+                results, memory = asyncio.run(run_in_process(args, payloads))
+        finally:
+            stub.shutdown()
+
+    print(f"Pico de RSS: {memory['peak_rss_mb']:.0f} MB ({memory['rss_scope']})")
+    if args.json:
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+            "memory": memory,
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Informe guardado en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import json
+import math
+import os
+
+
+def _cgroup_v2_quota():
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return int(quota) / int(period)
+
+
+def _cgroup_v1_quota():
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return quota / period
+
+
+def cpu_quota():
+    """Cuota de CPU del contenedor (cgroup v2 o v1) en CPUs, o None si no hay límite."""
+    quota = _cgroup_v2_quota()
+    return quota if quota is not None else _cgroup_v1_quota()
+
+
+def available_cpus():
+    """
+    CPUs que el proceso puede usar realmente: el mínimo entre la afinidad del
+    proceso (cpusets, taskset) y la cuota CFS del contenedor, redondeando la
+    cuota hacia arriba (una cuota de 1.5 CPUs admite 2 hilos activos).
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+def derive_thread_config(cpus, workers=1):
+    """
+    Reparto por defecto de hilos de TensorFlow a partir de las CPUs disponibles
+    y del número de workers de uvicorn, sin sobresuscribir los núcleos: cada
+    worker recibe su parte para las operaciones internas (intra-op) y se deja
+    poco paralelismo entre operaciones (inter-op), que en modelos secuenciales
+    de visión apenas aporta.
+    """
+    workers = max(1, int(workers))
+    intra = max(1, cpus // workers)
+    inter = 1 if intra < 4 else 2
+    return {"intra_op_threads": intra, "inter_op_threads": inter, "workers": workers}
+
+
+def load_tuning(path):
+    """Lee la configuración recomendada por backend/tools/autotune.py, si existe."""
+    try:
+        with open(path) as f:
+            return json.load(f).get("recommended", {})
+    except (OSError, ValueError):
+        return {}
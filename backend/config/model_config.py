@@ -1,5 +1,7 @@
 import os
+import threading
 from dotenv import load_dotenv
+from backend.config.cpu_topology import available_cpus, derive_thread_config, load_tuning
 
 # Cargar variables de entorno
 load_dotenv()
@@ -7,6 +9,22 @@ load_dotenv()
 # Obtener el directorio base del proyecto
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Ajuste de hilos, workers y tamaño de lote según la CPU disponible.
+# Prioridad: variables de entorno > fichero generado por backend/tools/autotune.py
+# > valores derivados de la cuota de CPU del contenedor
+TUNING_CONFIG_PATH = os.getenv(
+    "TUNING_CONFIG_PATH",
+    os.path.join(BASE_DIR, "backend", "config", "tuning.json")
+)
+_TUNING = load_tuning(TUNING_CONFIG_PATH)
+AVAILABLE_CPUS = available_cpus()
+# Workers de uvicorn del proceso (uvicorn usa WEB_CONCURRENCY como --workers por defecto)
+UVICORN_WORKERS = int(os.getenv("WEB_CONCURRENCY", str(_TUNING.get("workers", 1))))
+_AUTO_THREADS = derive_thread_config(AVAILABLE_CPUS, UVICORN_WORKERS)
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", str(_TUNING.get("intra_op_threads", _AUTO_THREADS["intra_op_threads"]))))
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", str(_TUNING.get("inter_op_threads", _AUTO_THREADS["inter_op_threads"]))))
+_DEFAULT_BATCH_SIZE = str(_TUNING.get("batch_size", 16))
+
 # Configuración de modelos locales (puedes agregar más rutas aquí si tienes más modelos)
 LUNARES_MODEL_PATH = os.getenv(
     "LUNARES_MODEL_PATH",
@@ -23,13 +41,226 @@ ROSACEA_MODEL_PATH = os.getenv(
     os.path.join(BASE_DIR, "backend", "modelos", "rosacea", "rosacea.keras")
 )
 
+# Modelo fusionado (backend/tools/fuse_models.py): un backbone compartido con
+# las cabezas de lunares, acné y rosácea. Con FUSED_MODEL_MODE=on se sirve en
+# lugar de los tres modelos si su verificación pasó y sigue correspondiendo a
+# los .keras actuales; si no, se usan los modelos por separado. El modelo
+# fusionado siempre se sirve con Keras: si algún *_INFERENCE_BACKEND es
+# "tflite", FUSED_MODEL_MODE=on no se activa (con un aviso al arrancar) y cada
+# modelo usa su backend configurado.
+FUSED_MODEL_MODE = os.getenv("FUSED_MODEL_MODE", "off")
+FUSED_MODEL_PATH = os.getenv(
+    "FUSED_MODEL_PATH",
+    os.path.join(BASE_DIR, "backend", "modelos", "fusionado", "piel_multihead.keras")
+)
+FUSED_MODEL_METADATA_PATH = os.getenv("FUSED_MODEL_METADATA_PATH", os.path.splitext(FUSED_MODEL_PATH)[0] + ".json")
+
+# Backend de inferencia por modelo: "keras" (modelo original) o "tflite"
+# (artefacto cuantizado generado con backend/tools/convert_tflite.py)
+LUNARES_INFERENCE_BACKEND = os.getenv("LUNARES_INFERENCE_BACKEND", "keras")
+ACNE_INFERENCE_BACKEND = os.getenv("ACNE_INFERENCE_BACKEND", "keras")
+ROSACEA_INFERENCE_BACKEND = os.getenv("ROSACEA_INFERENCE_BACKEND", "keras")
+
+LUNARES_TFLITE_PATH = os.getenv("LUNARES_TFLITE_PATH", os.path.splitext(LUNARES_MODEL_PATH)[0] + ".tflite")
+ACNE_TFLITE_PATH = os.getenv("ACNE_TFLITE_PATH", os.path.splitext(ACNE_MODEL_PATH)[0] + ".tflite")
+ROSACEA_TFLITE_PATH = os.getenv("ROSACEA_TFLITE_PATH", os.path.splitext(ROSACEA_MODEL_PATH)[0] + ".tflite")
+
+# Hilos del intérprete TFLite (por defecto, los mismos que intra-op de TensorFlow)
+TFLITE_NUM_THREADS = int(os.getenv("TFLITE_NUM_THREADS", str(TF_INTRA_OP_THREADS)))
+
+# Configuración del micro-batching por modelo: tamaño máximo de lote y espera
+# máxima (en milisegundos) para juntar peticiones concurrentes
+LUNARES_BATCH_MAX_SIZE = int(os.getenv("LUNARES_BATCH_MAX_SIZE", _DEFAULT_BATCH_SIZE))
+LUNARES_BATCH_MAX_WAIT_MS = float(os.getenv("LUNARES_BATCH_MAX_WAIT_MS", "5"))
+
+ACNE_BATCH_MAX_SIZE = int(os.getenv("ACNE_BATCH_MAX_SIZE", _DEFAULT_BATCH_SIZE))
+ACNE_BATCH_MAX_WAIT_MS = float(os.getenv("ACNE_BATCH_MAX_WAIT_MS", "5"))
+
+ROSACEA_BATCH_MAX_SIZE = int(os.getenv("ROSACEA_BATCH_MAX_SIZE", _DEFAULT_BATCH_SIZE))
+ROSACEA_BATCH_MAX_WAIT_MS = float(os.getenv("ROSACEA_BATCH_MAX_WAIT_MS", "5"))
+
+FUSED_BATCH_MAX_SIZE = int(os.getenv("FUSED_BATCH_MAX_SIZE", _DEFAULT_BATCH_SIZE))
+FUSED_BATCH_MAX_WAIT_MS = float(os.getenv("FUSED_BATCH_MAX_WAIT_MS", "5"))
+
+# Executor de inferencia: "thread" (por defecto) o "process", y tamaño del pool
+INFERENCE_EXECUTOR_KIND = os.getenv("INFERENCE_EXECUTOR_KIND", "thread")
+INFERENCE_EXECUTOR_WORKERS = int(os.getenv("INFERENCE_EXECUTOR_WORKERS", str(min(16, AVAILABLE_CPUS))))
+
+# Inferencia con tf.function compilado (por defecto) o llamando al modelo directamente
+INFERENCE_USE_TF_FUNCTION = os.getenv("INFERENCE_USE_TF_FUNCTION", "true").lower() in ("1", "true", "yes")
+
+# Tamaños de lote usados para calentar los modelos al arranque
+WARMUP_BATCH_SIZES = [int(v) for v in os.getenv("WARMUP_BATCH_SIZES", "1,4,16").split(",") if v.strip()]
+
+# Recarga en caliente: cada cuántos segundos se comprueban los ficheros de los
+# modelos (0 la desactiva). Un fichero nuevo se carga cuando lleva un intervalo
+# sin cambiar; conviene copiarlo con un rename atómico.
+MODEL_WATCH_INTERVAL_SECONDS = float(os.getenv("MODEL_WATCH_INTERVAL_SECONDS", "10"))
+
+# Residencia de modelos en memoria. Con un presupuesto (0 = sin límite) se
+# descargan los modelos ociosos menos usados recientemente cuando la huella
+# estimada de los cargados lo supera; un modelo descargado se recarga en la
+# siguiente petición que lo necesite.
+MODEL_MEMORY_BUDGET_BYTES = int(os.getenv("MODEL_MEMORY_BUDGET_BYTES", "0"))
+# Descargar también los modelos sin uso durante este tiempo aunque quepan (0 lo desactiva)
+MODEL_IDLE_EVICT_SECONDS = float(os.getenv("MODEL_IDLE_EVICT_SECONDS", "0"))
+# Un modelo usado hace menos de esto no se descarga por presupuesto (evita recargas en bucle)
+MODEL_EVICT_MIN_IDLE_SECONDS = float(os.getenv("MODEL_EVICT_MIN_IDLE_SECONDS", "30"))
+# Precarga: recargar un modelo descargado si, según el histórico por hora de
+# los últimos días, se esperan al menos estas peticiones en la hora actual (0 la desactiva)
+MODEL_PREWARM_MIN_REQUESTS = float(os.getenv("MODEL_PREWARM_MIN_REQUESTS", "0"))
+MODEL_RESIDENCY_CHECK_SECONDS = float(os.getenv("MODEL_RESIDENCY_CHECK_SECONDS", "30"))
+
+# Servidor de inferencia fuera de proceso, compartido por todos los workers de
+# uvicorn del host (python -m backend.services.inference_server). Con "client"
+# los workers le envían los tensores y, si no está disponible, infieren en
+# proceso; con "off" (por defecto) siempre infieren en proceso.
+INFERENCE_SERVER_MODE = os.getenv("INFERENCE_SERVER_MODE", "off")
+# El socket se crea dentro de un directorio privado (0700) del usuario que
+# arranca el servidor. La clave de autenticación protege el canal (los mensajes
+# se deserializan con pickle): si no se configura, el servidor genera una
+# aleatoria en cada arranque en INFERENCE_SERVER_AUTHKEY_FILE (0600, por
+# defecto junto al socket), que los workers del mismo usuario leen al conectar.
+INFERENCE_SERVER_SOCKET = os.getenv(
+    "INFERENCE_SERVER_SOCKET", os.path.join("/tmp", f"pielsana-inference-{os.getuid()}", "inference.sock")
+)
+INFERENCE_SERVER_AUTHKEY = os.getenv("INFERENCE_SERVER_AUTHKEY", "").encode("utf-8")
+INFERENCE_SERVER_AUTHKEY_FILE = os.getenv("INFERENCE_SERVER_AUTHKEY_FILE", "")
+INFERENCE_SERVER_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_SERVER_TIMEOUT_SECONDS", "30"))
+# Tras un fallo de conexión, segundos sin volver a intentarlo (se infiere en proceso)
+INFERENCE_SERVER_RETRY_SECONDS = float(os.getenv("INFERENCE_SERVER_RETRY_SECONDS", "5"))
+
+# Cola de trabajos asíncronos (POST /skin/api/jobs): trabajos en espera como
+# máximo por proceso (con la cola llena se responde 429 con Retry-After),
+# workers que la atienden y cada cuánto se envía un keep-alive por SSE
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "64"))
+JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", str(INFERENCE_EXECUTOR_WORKERS)))
+JOB_SSE_KEEPALIVE_SECONDS = float(os.getenv("JOB_SSE_KEEPALIVE_SECONDS", "15"))
+
+# Control de admisión de los endpoints de análisis síncronos: peticiones en
+# inferencia a la vez por modelo (ADMISSION_MODEL_LIMITS="lunares=8,acne=4"
+# para fijarlo por modelo) y plazo por petición, ajustable por el cliente con
+# la cabecera ADMISSION_DEADLINE_HEADER (milisegundos) hasta el máximo.
+ADMISSION_DEFAULT_LIMIT = int(os.getenv("ADMISSION_DEFAULT_LIMIT", str(INFERENCE_EXECUTOR_WORKERS)))
+ADMISSION_MODEL_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (item.partition("=") for item in os.getenv("ADMISSION_MODEL_LIMITS", "").split(","))
+    if name.strip() and limit.strip()
+}
+ADMISSION_DEFAULT_DEADLINE_MS = float(os.getenv("ADMISSION_DEFAULT_DEADLINE_MS", "30000"))
+ADMISSION_MAX_DEADLINE_MS = float(os.getenv("ADMISSION_MAX_DEADLINE_MS", "120000"))
+ADMISSION_DEADLINE_HEADER = os.getenv("ADMISSION_DEADLINE_HEADER", "X-Request-Deadline-Ms")
+
+# Perfilado bajo demanda de peticiones de análisis: se activa en una petición
+# con la cabecera PROFILING_HEADER y el token de administración (que también
+# protege /admin/profiles; sin token no hay perfilado a petición ni endpoints)
+# o para un porcentaje de peticiones al azar. Cada captura (cProfile y, si se
+# pide, la traza del profiler de TensorFlow del forward pass) se guarda en
+# PROFILING_DIR y se conservan las PROFILING_MAX_RETAINED más recientes.
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILING_HEADER = os.getenv("PROFILING_HEADER", "X-Profile")
+PROFILING_SAMPLE_PERCENT = float(os.getenv("PROFILING_SAMPLE_PERCENT", "0"))
+# Traza de TensorFlow también en las peticiones muestreadas (en las pedidas con
+# token se controla con "X-Profile: tf")
+PROFILING_SAMPLED_TF_TRACE = os.getenv("PROFILING_SAMPLED_TF_TRACE", "false").lower() in ("1", "true", "yes")
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(BASE_DIR, "backend", "cache", "profiles"))
+PROFILING_MAX_RETAINED = int(os.getenv("PROFILING_MAX_RETAINED", "20"))
+
+# Caché de predicciones: "memory" (por proceso), "sqlite" (compartida entre workers) o "none"
+PREDICTION_CACHE_BACKEND = os.getenv("PREDICTION_CACHE_BACKEND", "memory")
+PREDICTION_CACHE_PATH = os.getenv(
+    "PREDICTION_CACHE_PATH",
+    os.path.join(BASE_DIR, "backend", "cache", "predictions.sqlite3")
+)
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "4096"))
+PREDICTION_CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "3600"))
+
+# Almacén de resultados de análisis: "memory" (por proceso) o "sqlite" (compartido entre workers).
+# Sin fijarlo, con varios workers de uvicorn (WEB_CONCURRENCY o tuning.json)
+# se usa sqlite: con "memory" un GET /api/analyze-*/{id} o /api/jobs/{id} que
+# llegue a otro worker respondería 404. Con `uvicorn --workers N` hay que
+# fijar también WEB_CONCURRENCY o RESULT_STORE_BACKEND=sqlite.
+RESULT_STORE_BACKEND = os.getenv("RESULT_STORE_BACKEND") or ("sqlite" if UVICORN_WORKERS > 1 else "memory")
+RESULT_STORE_PATH = os.getenv(
+    "RESULT_STORE_PATH",
+    os.path.join(BASE_DIR, "backend", "cache", "results.sqlite3")
+)
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "10000"))
+RESULT_STORE_TTL_SECONDS = float(os.getenv("RESULT_STORE_TTL_SECONDS", "3600"))
+RESULT_STORE_EXPIRY_INTERVAL_SECONDS = float(os.getenv("RESULT_STORE_EXPIRY_INTERVAL_SECONDS", "60"))
+
+# Endpoint de análisis por lotes: imágenes por forward pass y tamaño máximo por imagen
+BATCH_ENDPOINT_MAX_BATCH_SIZE = int(os.getenv("BATCH_ENDPOINT_MAX_BATCH_SIZE", "32"))
+BATCH_ENDPOINT_MAX_IMAGE_BYTES = int(os.getenv("BATCH_ENDPOINT_MAX_IMAGE_BYTES", str(25 * 1024 * 1024)))
+# Tamaño máximo del cuerpo completo de una petición al endpoint por lotes
+BATCH_ENDPOINT_MAX_REQUEST_BYTES = int(os.getenv("BATCH_ENDPOINT_MAX_REQUEST_BYTES", str(512 * 1024 * 1024)))
+
+# Subida de imágenes individuales: tamaño máximo del archivo y del cuerpo de la
+# petición (se corta mientras llega) y resolución máxima según la cabecera de
+# la imagen, para rechazar bombas de descompresión antes de decodificarlas
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+REQUEST_MAX_BODY_BYTES = int(os.getenv("REQUEST_MAX_BODY_BYTES", str(UPLOAD_MAX_BYTES + 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", str(50_000_000)))
+
+# Imagen enviada a OpenAI: sin EXIF, reducida a un lado máximo y recodificada
+# ("jpeg" o "webp") con la calidad indicada
+OPENAI_IMAGE_MAX_EDGE = int(os.getenv("OPENAI_IMAGE_MAX_EDGE", "1024"))
+OPENAI_IMAGE_FORMAT = os.getenv("OPENAI_IMAGE_FORMAT", "jpeg").lower()
+OPENAI_IMAGE_QUALITY = int(os.getenv("OPENAI_IMAGE_QUALITY", "85"))
+
+# Cliente de OpenAI compartido. OPENAI_BASE_URL permite apuntar a un stub local.
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "500"))
+# Timeout total por intento y de conexión, en segundos
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+# Llamadas simultáneas a OpenAI por proceso y conexiones keep-alive del pool
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", str(OPENAI_MAX_CONCURRENCY)))
+# Reintentos ante errores transitorios (conexión, timeout, 429, 5xx) con backoff exponencial
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_RETRY_BACKOFF_SECONDS = float(os.getenv("OPENAI_RETRY_BACKOFF_SECONDS", "0.5"))
+
+# Caché persistente de recomendaciones de OpenAI por condición: "sqlite" o "none".
+# Pasado el TTL, la respuesta guardada se sigue sirviendo durante
+# RECOMMENDATION_CACHE_STALE_SECONDS mientras se refresca en segundo plano.
+RECOMMENDATION_CACHE_BACKEND = os.getenv("RECOMMENDATION_CACHE_BACKEND", "sqlite")
+RECOMMENDATION_CACHE_PATH = os.getenv(
+    "RECOMMENDATION_CACHE_PATH",
+    os.path.join(BASE_DIR, "backend", "cache", "recommendations.sqlite3")
+)
+RECOMMENDATION_CACHE_TTL_SECONDS = float(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RECOMMENDATION_CACHE_STALE_SECONDS = float(os.getenv("RECOMMENDATION_CACHE_STALE_SECONDS", str(30 * 24 * 3600)))
+
+# Carga de modelos al arranque: "background" (la app sirve rutas sin inferencia
+# de inmediato y carga/calienta los modelos en un hilo), "blocking" (no acepta
+# tráfico hasta que estén listos) o "lazy" (se cargan en la primera petición)
+MODEL_WARMUP_MODE = os.getenv("MODEL_WARMUP_MODE", "background")
+
 # Configuración de TensorFlow
-import tensorflow as tf
-tf.config.set_visible_devices([], 'GPU')  # Forzar uso de CPU
-tf.config.threading.set_inter_op_parallelism_threads(4)  # Ajustar según tu CPU
-tf.config.threading.set_intra_op_parallelism_threads(4)  # Ajustar según tu CPU
-
-# Crear directorios necesarios para modelos locales
-os.makedirs(os.path.dirname(LUNARES_MODEL_PATH), exist_ok=True) 
-os.makedirs(os.path.dirname(ACNE_MODEL_PATH), exist_ok=True)
-os.makedirs(os.path.dirname(ROSACEA_MODEL_PATH), exist_ok=True) 
\ No newline at end of file
+# Importar TensorFlow cuesta varios segundos, así que no se hace al importar
+# este módulo sino la primera vez que se necesita, a través de get_tensorflow()
+_TF_LOCK = threading.Lock()
+_TF = None
+
+def get_tensorflow():
+    """Importa y configura TensorFlow una sola vez (CPU, hilos) y devuelve el módulo."""
+    global _TF
+    if _TF is None:
+        with _TF_LOCK:
+            if _TF is None:
+                import tensorflow as tf
+                tf.config.set_visible_devices([], 'GPU')  # Forzar uso de CPU
+                tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+                tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+                _TF = tf
+    return _TF
+
+def ensure_model_dirs():
+    """Crear directorios necesarios para modelos locales."""
+    os.makedirs(os.path.dirname(LUNARES_MODEL_PATH), exist_ok=True)
+    os.makedirs(os.path.dirname(ACNE_MODEL_PATH), exist_ok=True)
+    os.makedirs(os.path.dirname(ROSACEA_MODEL_PATH), exist_ok=True)
@@ -0,0 +1,39 @@
+import asyncio
+
+from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi.responses import PlainTextResponse, Response
+
+from backend.services.profiling import request_profiler, ADMIN_TOKEN_HEADER
+
+router = APIRouter()
+
+def require_admin(request: Request):
+    """Exige el token de administración; sin token configurado los endpoints no existen."""
+    if not request_profiler.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not request_profiler.is_admin(request):
+        raise HTTPException(status_code=403, detail=f"Falta o no es válida la cabecera {ADMIN_TOKEN_HEADER}.")
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """Capturas de perfilado guardadas, de la más reciente a la más antigua."""
+    return {"profiles": await asyncio.to_thread(request_profiler.list)}
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    """Descarga la captura en un zip: perfil.prof, perfil.txt, captura.json y la traza de TensorFlow si la hay."""
+    content = await asyncio.to_thread(request_profiler.archive, profile_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return Response(
+        content, media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="perfil-{profile_id}.zip"'},
+    )
+
+@router.get("/profiles/{profile_id}/summary", dependencies=[Depends(require_admin)])
+async def profile_summary(profile_id: str):
+    """Resumen en texto del perfil (funciones por tiempo acumulado y propio)."""
+    summary = await asyncio.to_thread(request_profiler.summary, profile_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return PlainTextResponse(summary)
@@ -1,18 +1,35 @@
-from fastapi import APIRouter, Request, File, UploadFile, HTTPException
-from fastapi.responses import RedirectResponse
-from pathlib import Path
+from fastapi import APIRouter, Request, File, UploadFile, HTTPException, Query
+from fastapi.responses import StreamingResponse, Response
 import asyncio
-import uuid
-import openai
 import base64
-import os
-import re
 import json
+import zipfile
+from io import BytesIO
 from pydantic import BaseModel
+from typing import List, Optional
 
 # Importar el servicio de análisis de piel
-from backend.services.skin_analysis_service import predict_lunares_class, predict_acne_class, predict_rosacea_class
+from backend.services.skin_analysis_service import predict_lunares_class, predict_acne_class, predict_rosacea_class, analyze_all_resultados, analyze_batch, ANALYSIS_MODELS, get_batching_stats, get_residency_stats
+from backend.services.inference_executor import run_inference, inference_executor
+from backend.services.admission import admission, Overloaded, DeadlineExceeded
+from backend.services.profiling import request_profiler
+from backend.services.job_queue import job_queue, JobQueueFull, PRIORITIES, FINAL_STATES
+from backend.services.prediction_cache import prediction_cache
+from backend.services.result_store import result_store
+from backend.services.metrics import request_stage, UPLOAD_BYTES, UPLOAD_REJECTIONS, OPENAI_IMAGE_BYTES, OPENAI_REQUESTS
+from backend.services.upload_ingestion import read_image_upload, probe_image, UploadRejected
+from backend.services.image_preprocessing import encode_for_vision
+from backend.services.openai_client import (
+    openai_client, parse_json_response, OpenAIServiceError
+)
+from backend.services.disconnect import cancel_on_disconnect, ClientDisconnected
+from backend.services.recommendations import get_recommendations, recommendation_cache
 from backend.models.condition import ConditionInfo
+from backend.config.model_config import (
+    BATCH_ENDPOINT_MAX_BATCH_SIZE, BATCH_ENDPOINT_MAX_IMAGE_BYTES,
+    OPENAI_IMAGE_MAX_EDGE, OPENAI_IMAGE_FORMAT, OPENAI_IMAGE_QUALITY,
+    JOB_SSE_KEEPALIVE_SECONDS,
+)
 
 # Configurar el router
 router = APIRouter()
@@ -153,8 +170,54 @@ conditions_data = {
     ),
 }
 
-# Almacenamiento en memoria para resultados de lunares
-lunares_results = {}
+async def _read_upload(file: UploadFile, endpoint: str) -> bytes:
+    """
+    Lee la imagen subida midiendo el tiempo de lectura y el tamaño. Rechaza con
+    413/415 los archivos demasiado grandes, los que no son imágenes y las
+    bombas de descompresión antes de decodificarlos.
+    """
+    with request_stage(endpoint, "upload_read"):
+        try:
+            image_bytes = await read_image_upload(file)
+        except UploadRejected as e:
+            UPLOAD_REJECTIONS.inc(endpoint=endpoint, reason=e.reason)
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+    UPLOAD_BYTES.observe(len(image_bytes), endpoint=endpoint)
+    return image_bytes
+
+async def _get_stored_result(modelo: str, result_id: str):
+    """Recupera un resultado del almacén comprobando que corresponde al modelo pedido."""
+    # Con el backend sqlite es E/S de disco: fuera del event loop
+    result = await asyncio.to_thread(result_store.get, result_id)
+    if not result or result.pop("modelo", None) != modelo:
+        raise HTTPException(status_code=404, detail="Resultado no encontrado")
+    return result
+
+async def _run_admitted(request: Request, model: str, fn, *args):
+    """
+    Inferencia con control de admisión: 503 si la espera estimada supera el
+    plazo de la petición, 504 si vence antes de terminar y 499 si el cliente
+    se desconecta antes de empezar.
+    """
+    # Con X-Profile y el token de administración (o por muestreo) se perfila la inferencia
+    fn = request_profiler.wrap(request, fn)
+    try:
+        return await admission.run(request, model, fn, *args)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="El cliente cerró la conexión.")
+
+def _parse_models(models: Optional[str]):
+    """Lista de modelos de un parámetro "lunares,acne"; 400 si alguno no existe."""
+    selected = [m.strip().lower() for m in models.split(",") if m.strip()] if models else None
+    if selected:
+        unknown = [m for m in selected if m not in ANALYSIS_MODELS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Modelos desconocidos: {', '.join(unknown)}")
+    return selected
 
 class PrediccionRequest(BaseModel):
     prediccion: str
@@ -168,15 +231,16 @@ async def get_upload_page(request: Request):
 async def handle_image_upload(request: Request, file: UploadFile = File(...)):
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
+    image_bytes = await _read_upload(file, "upload")
     try:
-        image_bytes = await file.read()
-        pred_label, probabilities = predict_lunares_class(image_bytes)
+        with request_stage("upload", "inference"):
+            pred_label, probabilities, version = await _run_admitted(request, "lunares", predict_lunares_class, image_bytes)
         if pred_label is not None:
             print(f"Predicción para {file.filename}: {pred_label}")
         else:
             print(f"No se pudo predecir la clase para {file.filename}.")
             raise HTTPException(status_code=500, detail="Error al procesar la imagen: No se pudo predecir la clase.")
-        return {"filename": file.filename, "prediccion": pred_label, "probabilidades": probabilities}
+        return {"filename": file.filename, "prediccion": pred_label, "probabilidades": probabilities, "version_modelo": version}
     except HTTPException as http_exc:
         raise http_exc
     except Exception as e:
@@ -189,44 +253,52 @@ async def get_results_page(request: Request, image_name: str = None, analysis_st
     raise HTTPException(status_code=404, detail="No implementado: la vista HTML es manejada por el frontend.")
 
 @router.post("/api/analyze", tags=["Skin Analysis API"])
-async def api_analyze_skin(file: UploadFile = File(...)):
+async def api_analyze_skin(request: Request, file: UploadFile = File(...)):
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
+    image_bytes = await _read_upload(file, "analyze")
     try:
-        image_bytes = await file.read()
-        pred_label, probabilities = predict_lunares_class(image_bytes)
+        with request_stage("analyze", "inference"):
+            pred_label, probabilities, version = await _run_admitted(request, "lunares", predict_lunares_class, image_bytes)
         if pred_label is not None:
             return {
                 "filename": file.filename,
                 "content_type": file.content_type,
                 "prediccion": pred_label,
-                "probabilidades": probabilities
+                "probabilidades": probabilities,
+                "version_modelo": version
             }
         else:
             raise HTTPException(status_code=500, detail="No se pudo predecir la clase para la imagen.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error en API /api/analyze: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor al analizar la imagen: {str(e)}")
 
 @router.post("/api/analyze-lunares", tags=["Skin Analysis API"])
-async def api_analyze_lunares(file: UploadFile = File(...)):
+async def api_analyze_lunares(request: Request, file: UploadFile = File(...)):
     """Endpoint API para analizar una imagen solo con el modelo lunares.keras."""
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
+    image_bytes = await _read_upload(file, "analyze-lunares")
     try:
-        image_bytes = await file.read()
-        pred_label, probabilities = predict_lunares_class(image_bytes)
+        with request_stage("analyze-lunares", "inference"):
+            pred_label, probabilities, version = await _run_admitted(request, "lunares", predict_lunares_class, image_bytes)
         if pred_label is not None:
-            result_id = str(uuid.uuid4())
-            lunares_results[result_id] = {
+            result_id = await asyncio.to_thread(result_store.put, {
+                "modelo": "lunares",
                 "filename": file.filename,
                 "content_type": file.content_type,
                 "prediccion": pred_label,
-                "probabilidades": probabilities
-            }
+                "probabilidades": probabilities,
+                "version_modelo": version
+            })
             return {"id": result_id}
         else:
             raise HTTPException(status_code=500, detail="No se pudo predecir la clase para la imagen.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error en API /api/analyze-lunares: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor al analizar la imagen: {str(e)}")
@@ -234,10 +306,32 @@ async def api_analyze_lunares(file: UploadFile = File(...)):
 @router.get("/api/analyze-lunares/{result_id}", tags=["Skin Analysis API"])
 async def get_lunares_result(result_id: str):
     """Obtener el resultado del análisis de lunares por ID."""
-    result = lunares_results.get(result_id)
-    if not result:
-        raise HTTPException(status_code=404, detail="Resultado no encontrado")
-    return result
+    return await _get_stored_result("lunares", result_id)
+
+@router.get("/api/batching-stats", tags=["Skin Analysis API"])
+async def get_batching_stats_endpoint():
+    """Estadísticas de llenado de lotes del planificador de inferencia por modelo."""
+    return get_batching_stats()
+
+@router.get("/api/model-residency-stats", tags=["Skin Analysis API"])
+async def get_model_residency_stats():
+    """Modelos cargados en memoria en este proceso, su huella estimada, descargas y recargas."""
+    return get_residency_stats()
+
+@router.get("/api/inference-stats", tags=["Skin Analysis API"])
+async def get_inference_stats():
+    """Profundidad de cola y tiempos de espera del executor de inferencia."""
+    return inference_executor.stats()
+
+@router.get("/api/cache-stats", tags=["Skin Analysis API"])
+async def get_cache_stats():
+    """Aciertos, fallos y desalojos de la caché de predicciones."""
+    return prediction_cache.stats()
+
+@router.get("/api/recommendation-cache-stats", tags=["Skin Analysis API"])
+async def get_recommendation_cache_stats():
+    """Aciertos, respuestas servidas caducadas y llamadas a OpenAI de la caché de recomendaciones."""
+    return await asyncio.to_thread(recommendation_cache.stats)
 
 @router.get("/api/condition/{condition_name}", response_model=ConditionInfo, tags=["Skin Info"])
 async def get_condition_info(condition_name: str):
@@ -247,50 +341,307 @@ async def get_condition_info(condition_name: str):
     return condition
 
 @router.post("/api/analyze-acne", tags=["Skin Analysis API"])
-async def api_analyze_acne(file: UploadFile = File(...)):
+async def api_analyze_acne(request: Request, file: UploadFile = File(...)):
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
+    image_bytes = await _read_upload(file, "analyze-acne")
     try:
-        image_bytes = await file.read()
-        pred_label, probabilities = predict_acne_class(image_bytes)
+        with request_stage("analyze-acne", "inference"):
+            pred_label, probabilities, version = await _run_admitted(request, "acne", predict_acne_class, image_bytes)
         if pred_label is not None:
-            return {
+            result = {
                 "filename": file.filename,
                 "content_type": file.content_type,
                 "prediccion": pred_label,
-                "probabilidades": probabilities
+                "probabilidades": probabilities,
+                "version_modelo": version
             }
+            result_id = await asyncio.to_thread(result_store.put, {"modelo": "acne", **result})
+            return {"id": result_id, **result}
         else:
             raise HTTPException(status_code=500, detail="No se pudo predecir la clase para la imagen.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error en API /api/analyze-acne: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor al analizar la imagen: {str(e)}")
 
 @router.post("/api/analyze-rosacea", tags=["Skin Analysis API"])
-async def api_analyze_rosacea(file: UploadFile = File(...)):
+async def api_analyze_rosacea(request: Request, file: UploadFile = File(...)):
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
+    image_bytes = await _read_upload(file, "analyze-rosacea")
     try:
-        image_bytes = await file.read()
-        pred_label, probabilities = predict_rosacea_class(image_bytes)
+        with request_stage("analyze-rosacea", "inference"):
+            pred_label, probabilities, version = await _run_admitted(request, "rosacea", predict_rosacea_class, image_bytes)
         if pred_label is not None:
-            return {
+            result = {
                 "filename": file.filename,
                 "content_type": file.content_type,
                 "prediccion": pred_label,
-                "probabilidades": probabilities
+                "probabilidades": probabilities,
+                "version_modelo": version
             }
+            result_id = await asyncio.to_thread(result_store.put, {"modelo": "rosacea", **result})
+            return {"id": result_id, **result}
         else:
             raise HTTPException(status_code=500, detail="No se pudo predecir la clase para la imagen.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error en API /api/analyze-rosacea: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor al analizar la imagen: {str(e)}")
 
+@router.post("/api/analyze-all", tags=["Skin Analysis API"])
+async def api_analyze_all(
+    request: Request,
+    file: UploadFile = File(...),
+    models: Optional[str] = Query(None, description="Modelos separados por coma: lunares,acne,rosacea. Por defecto, todos."),
+):
+    """Analiza la imagen con varios modelos decodificándola y preprocesándola una sola vez."""
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
+    selected = _parse_models(models)
+    image_bytes = await _read_upload(file, "analyze-all")
+    try:
+        with request_stage("analyze-all", "inference"):
+            resultados = await run_inference(request_profiler.wrap(request, analyze_all_resultados), image_bytes, selected)
+    except Exception as e:
+        print(f"Error en API /api/analyze-all: {e}")
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor al analizar la imagen: {str(e)}")
+    if all("error" in result for result in resultados.values()):
+        raise HTTPException(status_code=500, detail="No se pudo predecir la clase para la imagen.")
+    return {
+        "filename": file.filename,
+        "content_type": file.content_type,
+        "resultados": resultados
+    }
+
+@router.post("/api/jobs", status_code=202, tags=["Skin Analysis Jobs"])
+async def submit_analysis_job(
+    response: Response,
+    file: UploadFile = File(...),
+    models: Optional[str] = Query(None, description="Modelos separados por coma: lunares,acne,rosacea. Por defecto, todos."),
+    priority: str = Query("normal", description="Prioridad en la cola: high, normal o low."),
+):
+    """
+    Encola el análisis de la imagen y responde de inmediato con 202 y el id del
+    trabajo. El resultado se obtiene con GET /api/jobs/{id} o en vivo con
+    GET /api/jobs/{id}/events (Server-Sent Events). Con la cola llena responde
+    429 con Retry-After.
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Prioridad desconocida: {priority}")
+    selected = _parse_models(models) or list(ANALYSIS_MODELS)
+    image_bytes = await _read_upload(file, "jobs")
+    try:
+        job = await job_queue.submit(
+            analyze_all_resultados, image_bytes, selected, priority,
+            filename=file.filename, content_type=file.content_type,
+        )
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    status_url = f"/skin/api/jobs/{job.id}"
+    response.headers["Location"] = status_url
+    return {
+        "id": job.id,
+        "estado": job.state,
+        "posicion": job_queue.position(job.id),
+        "status_url": status_url,
+        "events_url": f"{status_url}/events",
+    }
+
+@router.get("/api/jobs/{job_id}", tags=["Skin Analysis Jobs"])
+async def get_analysis_job(job_id: str):
+    """Estado del trabajo y, cuando termina, sus resultados."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+@router.get("/api/jobs/{job_id}/events", tags=["Skin Analysis Jobs"])
+async def stream_analysis_job(request: Request, job_id: str):
+    """Server-Sent Events con cada cambio de estado del trabajo; termina al completarse o fallar."""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    async def _events():
+        last = None
+        while True:
+            job = await job_queue.get(job_id)
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Trabajo no encontrado\"}\n\n"
+                return
+            if job != last:
+                yield f"event: {job['estado']}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                last = job
+            if job["estado"] in FINAL_STATES or await request.is_disconnected():
+                return
+            if not await job_queue.wait_for_change(job_id, JOB_SSE_KEEPALIVE_SECONDS):
+                # Comentario SSE para que los proxies no corten la conexión inactiva
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        _events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/api/job-queue-stats", tags=["Skin Analysis Jobs"])
+async def get_job_queue_stats():
+    """Ocupación de la cola de trabajos, rechazos y duración media de los trabajos."""
+    return job_queue.stats()
+
+@router.get("/api/admission-stats", tags=["Skin Analysis API"])
+async def get_admission_stats():
+    """Huecos ocupados, esperas y peticiones rechazadas o caducadas por modelo."""
+    return admission.stats()
+
+@router.get("/api/analyze-acne/{result_id}", tags=["Skin Analysis API"])
+async def get_acne_result(result_id: str):
+    """Obtener el resultado del análisis de acné por ID."""
+    return await _get_stored_result("acne", result_id)
+
+@router.get("/api/analyze-rosacea/{result_id}", tags=["Skin Analysis API"])
+async def get_rosacea_result(result_id: str):
+    """Obtener el resultado del análisis de rosácea por ID."""
+    return await _get_stored_result("rosacea", result_id)
+
+@router.get("/api/result-store-stats", tags=["Skin Analysis API"])
+async def get_result_store_stats():
+    """Ocupación, desalojos y caducidades del almacén de resultados."""
+    return await asyncio.to_thread(result_store.stats)
+
+def _is_zip_upload(filename, content_type):
+    return (content_type or "") in ("application/zip", "application/x-zip-compressed") or (filename or "").lower().endswith(".zip")
+
+def _checked_batch_image(name, data):
+    """Comprueba la cabecera de una imagen del lote antes de mandarla a decodificar."""
+    try:
+        probe_image(BytesIO(data))
+    except UploadRejected as e:
+        UPLOAD_REJECTIONS.inc(endpoint="analyze-batch", reason=e.reason)
+        return name, None, e.detail
+    return name, data, None
+
+def _iter_batch_uploads(sources):
+    """
+    Recorre los archivos subidos y los miembros de los zip uno a uno, sin cargar
+    el archivo completo en memoria. Produce (nombre, bytes, error).
+    """
+    for filename, content_type, fileobj in sources:
+        try:
+            if _is_zip_upload(filename, content_type):
+                try:
+                    archive = zipfile.ZipFile(fileobj)
+                except zipfile.BadZipFile:
+                    yield filename, None, "El archivo zip no es válido."
+                    continue
+                with archive:
+                    for info in archive.infolist():
+                        if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                            continue
+                        if info.file_size > BATCH_ENDPOINT_MAX_IMAGE_BYTES:
+                            yield info.filename, None, "La imagen supera el tamaño máximo permitido."
+                            continue
+                        try:
+                            data = archive.read(info)
+                        except Exception as e:
+                            yield info.filename, None, f"No se pudo extraer la imagen: {e}"
+                            continue
+                        yield _checked_batch_image(info.filename, data)
+            elif content_type and content_type.startswith("image/"):
+                data = fileobj.read(BATCH_ENDPOINT_MAX_IMAGE_BYTES + 1)
+                if len(data) > BATCH_ENDPOINT_MAX_IMAGE_BYTES:
+                    yield filename, None, "La imagen supera el tamaño máximo permitido."
+                else:
+                    yield _checked_batch_image(filename, data)
+            else:
+                yield filename, None, "El archivo debe ser una imagen o un zip."
+        finally:
+            fileobj.close()
+
+def _read_next_chunk(uploads):
+    """Lee el siguiente bloque de hasta BATCH_ENDPOINT_MAX_BATCH_SIZE imágenes."""
+    chunk = []
+    for item in uploads:
+        chunk.append(item)
+        if len(chunk) >= BATCH_ENDPOINT_MAX_BATCH_SIZE:
+            break
+    return chunk
+
+@router.post("/api/analyze-batch", tags=["Skin Analysis API"])
+async def api_analyze_batch(
+    files: List[UploadFile] = File(...),
+    models: Optional[str] = Query("lunares", description="Modelos separados por coma: lunares,acne,rosacea."),
+):
+    """
+    Analiza muchas imágenes (varios archivos o un zip) y devuelve una línea
+    NDJSON por imagen a medida que cada bloque termina. Los errores de una
+    imagen se reportan en su línea sin abortar el resto del lote.
+    """
+    selected = _parse_models(models)
+    # FastAPI cierra los UploadFile al terminar el handler, antes de que se
+    # consuma la respuesta en streaming: nos quedamos con los ficheros
+    # temporales y dejamos un buffer vacío en su lugar; los cierra el generador.
+    sources = []
+    for upload in files:
+        sources.append((upload.filename, upload.content_type, upload.file))
+        upload.file = BytesIO()
+    uploads = _iter_batch_uploads(sources)
+
+    async def _stream():
+        index = 0
+        try:
+            while True:
+                chunk = await asyncio.to_thread(_read_next_chunk, uploads)
+                if not chunk:
+                    break
+                valid = [(name, data) for name, data, error in chunk if error is None]
+                with request_stage("analyze-batch", "inference"):
+                    analyzed = iter(await run_inference(analyze_batch, valid, selected) if valid else ())
+                for name, _, error in chunk:
+                    result = next(analyzed) if error is None else {"filename": name, "error": error}
+                    yield json.dumps({"index": index, **result}, ensure_ascii=False) + "\n"
+                    index += 1
+        finally:
+            uploads.close()
+            for _, _, fileobj in sources:
+                fileobj.close()
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+async def _run_openai(request: Request, endpoint: str, coro):
+    """Espera una llamada a OpenAI cancelándola si el cliente se va y traduce sus errores a HTTP."""
+    with request_stage(endpoint, "openai"):
+        try:
+            return await cancel_on_disconnect(request, coro)
+        except OpenAIServiceError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except ClientDisconnected:
+            # 499: el cliente cerró la conexión; la llamada a OpenAI ya se canceló
+            OPENAI_REQUESTS.inc(outcome="cancelled")
+            raise HTTPException(status_code=499, detail="El cliente cerró la conexión.")
+
 @openai_router.post("/openai-analizar")
-async def analizar_imagen_openai(file: UploadFile = File(...)):
-    image_bytes = await file.read()
-    image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-    image_data_url = f"data:{file.content_type};base64,{image_base64}"
+async def analizar_imagen_openai(request: Request, response: Response, file: UploadFile = File(...)):
+    image_bytes = await _read_upload(file, "openai-analizar")
+    # Imagen reducida y sin EXIF: menos bytes que subir y menos tokens de visión
+    with request_stage("openai-analizar", "image_prep"):
+        try:
+            payload, mime, size = await asyncio.to_thread(
+                encode_for_vision, image_bytes, OPENAI_IMAGE_MAX_EDGE, OPENAI_IMAGE_FORMAT, OPENAI_IMAGE_QUALITY
+            )
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"No se pudo procesar la imagen: {e}")
+    OPENAI_IMAGE_BYTES.observe(len(image_bytes), stage="original")
+    OPENAI_IMAGE_BYTES.observe(len(payload), stage="sent")
+    print(f"Imagen para OpenAI: {len(image_bytes)} -> {len(payload)} bytes "
+          f"({len(image_bytes) - len(payload)} ahorrados, {size[0]}x{size[1]})")
+    response.headers["X-Image-Bytes-Saved"] = str(len(image_bytes) - len(payload))
+    image_data_url = f"data:{mime};base64,{base64.b64encode(payload).decode('ascii')}"
+    del image_bytes, payload
 
     prompt = (
         "Analiza la imagen de piel que te envío. "
@@ -300,64 +651,24 @@ async def analizar_imagen_openai(file: UploadFile = File(...)):
         "Responde en formato JSON con los campos 'afeccion', 'descripcion' y 'recomendaciones' (lista de strings)."
     )
 
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    print("API KEY:", openai_api_key)
-    print("Tamaño de la imagen:", len(image_bytes))
-    openai.api_key = openai_api_key
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "Eres un dermatólogo experto."},
-            {"role": "user", "content": [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": image_data_url}}
-            ]}
-        ],
-        max_tokens=500
-    )
-    print("Respuesta de OpenAI:", response.choices[0].message.content)
+    content = await _run_openai(request, "openai-analizar", openai_client.chat([
+        {"role": "system", "content": "Eres un dermatólogo experto."},
+        {"role": "user", "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": image_data_url}}
+        ]}
+    ]))
+    print("Respuesta de OpenAI:", content)
 
-    content = response.choices[0].message.content
-    # Limpia los bloques de código si existen
-    content = re.sub(r"^```json|^```|```$", "", content.strip(), flags=re.MULTILINE).strip()
-    try:
-        resultado = json.loads(content)
-    except Exception:
-        resultado = {
-            "afeccion": "No se pudo analizar",
-            "recomendaciones": ["Intenta con otra imagen o consulta a un dermatólogo."]
-        }
-    return resultado
+    return parse_json_response(content) or {
+        "afeccion": "No se pudo analizar",
+        "recomendaciones": ["Intenta con otra imagen o consulta a un dermatólogo."]
+    }
 
 @openai_router.post("/openai-recomendaciones")
-async def obtener_recomendaciones_openai(request: PrediccionRequest):
-    import openai
-    import os
-    import json
-    import re
-    prediccion = request.prediccion
-    openai_api_key = os.getenv("OPENAI_API_KEY")
-    openai.api_key = openai_api_key
-    prompt = (
-        f"Tengo un paciente con la siguiente condición dermatológica: '{prediccion}'. "
-        "Dame una breve descripción educativa de la condición detectada y 5 recomendaciones para el paciente. "
-        "Responde en formato JSON con los campos 'descripcion' (string) y 'recomendaciones' (lista de strings)."
-    )
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "Eres un dermatólogo experto."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=500
-    )
-    content = response.choices[0].message.content
-    content = re.sub(r"^```json|^```|```$", "", content.strip(), flags=re.MULTILINE).strip()
-    try:
-        resultado = json.loads(content)
-    except Exception:
-        resultado = {"descripcion": "No se pudo generar la descripción.", "recomendaciones": ["No se pudieron generar recomendaciones. Intenta nuevamente."]}
-    return resultado
+async def obtener_recomendaciones_openai(http_request: Request, request: PrediccionRequest):
+    # Las etiquetas de los modelos se sirven desde la caché persistente de recomendaciones
+    return await _run_openai(http_request, "openai-recomendaciones", get_recommendations(request.prediccion))
 
 # Registrar el router de OpenAI en el router principal
 router.include_router(openai_router) 
\ No newline at end of file
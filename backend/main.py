@@ -1,10 +1,31 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 import uvicorn
-from fastapi.responses import RedirectResponse
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Match
 from dotenv import load_dotenv
-import os
 from fastapi.middleware.cors import CORSMiddleware
-from backend.controllers import skin
+from backend.controllers import skin, admin
+from backend.config.model_config import (
+    MODEL_WARMUP_MODE, AVAILABLE_CPUS, UVICORN_WORKERS, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS,
+    REQUEST_MAX_BODY_BYTES, BATCH_ENDPOINT_MAX_REQUEST_BYTES, MODEL_WATCH_INTERVAL_SECONDS,
+    MODEL_RESIDENCY_CHECK_SECONDS,
+)
+from backend.services.inference_executor import inference_executor
+from backend.services.result_store import result_store
+from backend.services.prediction_cache import prediction_cache
+from backend.services.openai_client import openai_client
+from backend.services.job_queue import job_queue
+from backend.services.admission import admission
+from backend.services.profiling import request_profiler
+from backend.services.upload_ingestion import BodySizeLimitMiddleware
+from backend.services.metrics import (
+    REGISTRY, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_FLIGHT, render_metrics
+)
+from backend.services.skin_analysis_service import warmup_models, get_model_status, get_batching_stats, model_registry
 
 # Cargar variables de entorno del archivo .env
 # Es bueno hacerlo lo antes posible
@@ -13,11 +34,53 @@ load_dotenv()
 # Opcional: Verificar si el token se cargó (para depuración)
 # print(f"HF_TOKEN desde el entorno: {os.getenv('HF_TOKEN')}")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print(f"CPUs disponibles: {AVAILABLE_CPUS}, workers: {UVICORN_WORKERS}, "
+          f"hilos TensorFlow intra/inter: {TF_INTRA_OP_THREADS}/{TF_INTER_OP_THREADS}")
+    if UVICORN_WORKERS > 1 and result_store.backend == "memory":
+        print(f"AVISO: {UVICORN_WORKERS} workers con RESULT_STORE_BACKEND=memory: los resultados y "
+              "trabajos guardados en un worker no se encuentran desde los demás (404). "
+              "Usa RESULT_STORE_BACKEND=sqlite.")
+    if MODEL_WARMUP_MODE == "blocking":
+        # Cargar y calentar todos los modelos antes de aceptar tráfico
+        await asyncio.to_thread(warmup_models)
+    elif MODEL_WARMUP_MODE == "background":
+        # Servir ya las rutas sin inferencia; /health/ready indica cuándo están los modelos
+        threading.Thread(target=warmup_models, name="model-warmup", daemon=True).start()
+    result_store.start_expiry()
+    # Recargar en caliente los modelos cuyo fichero se sustituya en disco
+    model_registry.start_watching(MODEL_WATCH_INTERVAL_SECONDS)
+    # Descargar de memoria los modelos ociosos según el presupuesto configurado
+    model_registry.residency.start(MODEL_RESIDENCY_CHECK_SECONDS)
+    # Workers de la cola de análisis asíncronos (/skin/api/jobs)
+    await job_queue.start()
+    # Crear el cliente de OpenAI (y su pool de conexiones) sin retrasar el arranque
+    openai_start = asyncio.create_task(openai_client.start())
+    yield
+    openai_start.cancel()
+    await job_queue.stop()
+    await openai_client.close()
+    model_registry.stop_watching()
+    model_registry.residency.stop()
+    result_store.stop_expiry()
+    # Liberar los hilos/procesos del executor de inferencia
+    inference_executor.shutdown(wait=False)
+
 # Crear la instancia de la aplicación FastAPI
 app = FastAPI(
     title="PielSana IA",
     description="Sistema de análisis facial para clasificar condiciones cutáneas.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
+)
+
+# Cortar las subidas demasiado grandes mientras llegan, antes de volcarlas a disco
+# (se añade antes que CORS para que las respuestas 413 lleven sus cabeceras)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body_bytes=REQUEST_MAX_BODY_BYTES,
+    path_limits={"/skin/api/analyze-batch": BATCH_ENDPOINT_MAX_REQUEST_BYTES},
 )
 
 # Habilitar CORS para el frontend en desarrollo y producción
@@ -34,15 +97,92 @@ app.add_middleware(
 #       "https://pielsana-ia.vercel.app",
     
 
+def _route_label(request: Request) -> str:
+    # Etiquetar por plantilla de ruta (/skin/api/analyze-lunares/{result_id})
+    # y no por la URL concreta, para no disparar la cardinalidad de las métricas
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "other")
+    return "unmatched"
+
+@app.middleware("http")
+async def track_request_metrics(request: Request, call_next):
+    endpoint = _route_label(request)
+    start = time.perf_counter()
+    # El plazo del control de admisión cuenta desde aquí, subida incluida
+    request.state.received_at = time.monotonic()
+    status = 500
+    HTTP_REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        profile_id = getattr(request.state, "profile_id", None)
+        if profile_id and await asyncio.to_thread(request_profiler.exists, profile_id):
+            # Id de la captura para descargarla de /admin/profiles/{id}
+            response.headers["X-Profile-Id"] = profile_id
+        return response
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, endpoint=endpoint, method=request.method, status=status
+        )
+
+@REGISTRY.register_collector
+def _collect_runtime_stats():
+    # Exportar las estadísticas que ya mantienen el executor, los batchers, la caché y OpenAI
+    executor = inference_executor.stats()
+    samples = [
+        ("pielsana_executor_in_flight", "gauge", "Tareas en el executor de inferencia.", {}, executor["in_flight"]),
+        ("pielsana_executor_queue_depth", "gauge", "Tareas esperando un worker libre.", {}, executor["queue_depth"]),
+    ]
+    openai_stats = openai_client.stats()
+    samples.append(("pielsana_openai_in_flight", "gauge", "Llamadas a OpenAI en curso.", {}, openai_stats["in_flight"]))
+    samples.append(("pielsana_openai_waiting", "gauge", "Llamadas a OpenAI esperando el límite de concurrencia.", {}, openai_stats["waiting"]))
+    for model, stats in get_batching_stats().items():
+        samples.append(("pielsana_batcher_queued", "gauge", "Imágenes esperando lote.", {"model": model}, stats["queued"]))
+    cache = prediction_cache.stats()
+    for field in ("hits", "misses", "evictions"):
+        if field in cache:
+            samples.append((f"pielsana_prediction_cache_{field}_total", "counter", f"Caché de predicciones: {field}.", {}, cache[field]))
+    jobs = job_queue.stats()
+    samples.append(("pielsana_job_queue_depth", "gauge", "Trabajos asíncronos esperando en cola.", {}, jobs["queued"]))
+    samples.append(("pielsana_job_queue_running", "gauge", "Trabajos asíncronos en ejecución.", {}, jobs["running"]))
+    for model, gate in admission.stats().items():
+        samples.append(("pielsana_admission_active", "gauge", "Peticiones admitidas en inferencia por modelo.", {"model": model}, gate["active"]))
+        samples.append(("pielsana_admission_waiting", "gauge", "Peticiones esperando turno por modelo.", {"model": model}, gate["waiting"]))
+    return samples
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Endpoint de prueba
 @app.get("/")
 async def read_root():
     # Redirigir a la página de carga de la aplicación de piel
     return RedirectResponse(url="/skin/")
 
+@app.get("/health/live", tags=["Health"])
+async def health_live():
+    # El proceso responde; no depende de que los modelos estén cargados
+    return {"status": "ok"}
+
+@app.get("/health/ready", tags=["Health"])
+async def health_ready():
+    # Listo solo cuando todos los modelos están cargados y calentados
+    # (con el servidor de inferencia, el estado es el suyo: se consulta fuera del bucle)
+    ready, models = await asyncio.to_thread(get_model_status)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "models": models}
+    )
+
 # Registrar routers de los controladores
 app.include_router(skin.router, prefix="/skin", tags=["Skin Analysis Frontend"])
+app.include_router(admin.router, prefix="/admin", tags=["Admin"], include_in_schema=False)
 
 if __name__ == "__main__":
     # Esta sección es útil para desarrollo, pero para producción usarás 'run.py'
-    uvicorn.run(app, host="0.0.0.0", port=8080) 
\ No newline at end of file
+    # Con más de un worker uvicorn necesita la ruta de importación de la app
+    uvicorn.run("backend.main:app", host="0.0.0.0", port=8080, workers=UVICORN_WORKERS)
@@ -0,0 +1,204 @@
+import asyncio
+import collections
+import math
+import time
+
+from backend.config.model_config import (
+    ADMISSION_DEFAULT_LIMIT, ADMISSION_MODEL_LIMITS, ADMISSION_DEFAULT_DEADLINE_MS,
+    ADMISSION_MAX_DEADLINE_MS, ADMISSION_DEADLINE_HEADER,
+)
+from backend.services.inference_executor import run_inference
+from backend.services.metrics import ADMISSION_DECISIONS
+from backend.services.disconnect import cancel_on_disconnect, ClientDisconnected
+
+
+class Overloaded(Exception):
+    """La espera estimada supera el plazo de la petición; `retry_after` en segundos."""
+
+    def __init__(self, detail, retry_after):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """El plazo de la petición venció antes de empezar (o terminar) la inferencia."""
+
+
+def _run_before_deadline(deadline, fn, args):
+    # Se ejecuta ya en el worker del executor: si la tarea esperó en cola más
+    # que el plazo, no se empieza la inferencia
+    if time.time() >= deadline:
+        raise DeadlineExceeded("El plazo de la petición venció en la cola de inferencia.")
+    return fn(*args)
+
+
+class _ModelGate:
+    """Semáforo FIFO de un modelo con la duración media de su inferencia."""
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.active = 0
+        self.waiters = collections.deque()
+        self.avg_seconds = None
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.disconnected = 0
+
+    def estimated_wait(self):
+        """Segundos estimados hasta que una petición nueva obtenga hueco."""
+        if self.active < self.limit and not self.waiters:
+            return 0.0
+        # Rondas completas de `limit` peticiones por delante
+        rounds = math.ceil((len(self.waiters) + 1) / self.limit)
+        return rounds * (self.avg_seconds or 0.0)
+
+    def observe(self, seconds):
+        self.avg_seconds = seconds if self.avg_seconds is None else 0.9 * self.avg_seconds + 0.1 * seconds
+
+    async def acquire(self, timeout):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # El hueco ya se nos había pasado: devolverlo
+                self.release()
+            else:
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self):
+        # El hueco pasa directamente al primero en espera, sin bajar `active`
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionController:
+    """
+    Control de admisión para la inferencia de los endpoints síncronos.
+
+    Cada modelo tiene un límite de peticiones en inferencia a la vez; las
+    demás esperan en orden de llegada. Cada petición tiene un plazo (por
+    defecto o pedido por el cliente con una cabecera, en milisegundos): si la
+    espera estimada ya lo supera se rechaza de inmediato (503 con
+    Retry-After), y si el plazo vence o el cliente se desconecta antes de que
+    empiece la inferencia, el trabajo se cancela sin llegar al modelo.
+
+    Una inferencia ya en curso no se puede interrumpir: si el plazo vence a
+    mitad, la petición recibe 504 pero el hueco se libera al responder.
+    """
+
+    def __init__(self, default_limit=4, limits=None, default_deadline_ms=30000.0,
+                 max_deadline_ms=120000.0, deadline_header="X-Request-Deadline-Ms"):
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+        self.default_deadline = default_deadline_ms / 1000.0
+        self.max_deadline = max_deadline_ms / 1000.0
+        self.deadline_header = deadline_header
+        self._gates = {}
+
+    def _gate(self, model):
+        gate = self._gates.get(model)
+        if gate is None:
+            gate = self._gates[model] = _ModelGate(self.limits.get(model, self.default_limit))
+        return gate
+
+    def deadline_for(self, request):
+        """Instante (time.monotonic) en que vence el plazo de la petición."""
+        budget = self.default_deadline
+        raw = request.headers.get(self.deadline_header)
+        if raw:
+            try:
+                budget = min(max(float(raw) / 1000.0, 0.0), self.max_deadline)
+            except ValueError:
+                pass
+        # El plazo cuenta desde que llegó la petición, subida incluida
+        received_at = getattr(request.state, "received_at", None) or time.monotonic()
+        return received_at + budget
+
+    async def run(self, request, model, fn, *args):
+        """
+        Ejecuta `fn(*args)` en el executor de inferencia respetando el límite
+        de `model` y el plazo de `request`. Lanza `Overloaded`,
+        `DeadlineExceeded` o `ClientDisconnected`.
+        """
+        gate = self._gate(model)
+        deadline = self.deadline_for(request)
+        remaining = deadline - time.monotonic()
+        estimated = gate.estimated_wait()
+        if remaining <= 0 or estimated > remaining:
+            gate.rejected += 1
+            ADMISSION_DECISIONS.inc(model=model, outcome="overloaded")
+            raise Overloaded(
+                f"Servidor saturado: espera estimada {estimated:.1f} s para un plazo de {max(remaining, 0.0):.1f} s.",
+                max(1, math.ceil(estimated)),
+            )
+        try:
+            return await cancel_on_disconnect(request, self._admit_and_run(gate, model, deadline, fn, args))
+        except asyncio.TimeoutError:
+            gate.expired += 1
+            ADMISSION_DECISIONS.inc(model=model, outcome="deadline")
+            raise DeadlineExceeded("El plazo de la petición venció antes de completar la inferencia.")
+        except DeadlineExceeded:
+            gate.expired += 1
+            ADMISSION_DECISIONS.inc(model=model, outcome="deadline")
+            raise
+        except ClientDisconnected:
+            gate.disconnected += 1
+            ADMISSION_DECISIONS.inc(model=model, outcome="disconnected")
+            raise
+
+    async def _admit_and_run(self, gate, model, deadline, fn, args):
+        await gate.acquire(deadline - time.monotonic())
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("El plazo de la petición venció esperando turno.")
+            gate.admitted += 1
+            ADMISSION_DECISIONS.inc(model=model, outcome="admitted")
+            started = time.monotonic()
+            # Cancelar la espera cancela también la tarea si aún no salió de la cola del executor
+            result = await asyncio.wait_for(
+                run_inference(_run_before_deadline, time.time() + remaining, fn, args), remaining
+            )
+            gate.observe(time.monotonic() - started)
+            return result
+        finally:
+            gate.release()
+
+    def stats(self):
+        return {
+            model: {
+                "limit": gate.limit,
+                "active": gate.active,
+                "waiting": len(gate.waiters),
+                "avg_inference_ms": (gate.avg_seconds or 0.0) * 1000.0,
+                "estimated_wait_ms": gate.estimated_wait() * 1000.0,
+                "admitted": gate.admitted,
+                "rejected": gate.rejected,
+                "expired": gate.expired,
+                "disconnected": gate.disconnected,
+            }
+            for model, gate in self._gates.items()
+        }
+
+
+# Control de admisión del proceso para los endpoints de análisis síncronos
+admission = AdmissionController(
+    default_limit=ADMISSION_DEFAULT_LIMIT, limits=ADMISSION_MODEL_LIMITS,
+    default_deadline_ms=ADMISSION_DEFAULT_DEADLINE_MS, max_deadline_ms=ADMISSION_MAX_DEADLINE_MS,
+    deadline_header=ADMISSION_DEADLINE_HEADER,
+)
@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+import numpy as np
+
+from backend.services.metrics import INFERENCE_STAGE_SECONDS, BATCH_SIZE
+
+
+class _PendingItem:
+    """Una imagen preprocesada esperando ser incluida en un lote."""
+    __slots__ = ("array", "future", "enqueued_at")
+
+    def __init__(self, array):
+        self.array = array
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    Agrupa peticiones concurrentes de un mismo modelo en un único forward pass.
+
+    Cada llamada a `predict` encola un tensor de forma (1, H, W, C). Un hilo de
+    fondo junta hasta `max_batch_size` tensores o espera como máximo
+    `max_wait_ms` desde la llegada del primero, ejecuta `predict_fn` sobre el
+    lote completo y entrega a cada llamador su propia fila ya postprocesada.
+    """
+
+    def __init__(self, name, predict_fn, postprocess_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.name = name
+        self.predict_fn = predict_fn
+        self.postprocess_fn = postprocess_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._full_batches = 0
+        self._max_observed = 0
+        self._total_wait = 0.0
+        self._size_histogram = {}
+
+    def submit(self, img_array):
+        """Encola un tensor (1, H, W, C) y devuelve un Future con el resultado postprocesado."""
+        self._ensure_worker()
+        item = _PendingItem(img_array)
+        self._queue.put(item)
+        return item.future
+
+    def predict(self, img_array, timeout=None):
+        """Versión bloqueante de `submit`."""
+        return self.submit(img_array).result(timeout=timeout)
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f"batcher-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Aprovechar lo que ya esté en cola sin esperar más
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._process(batch)
+            # Soltar los tensores del lote antes de quedarse esperando el siguiente
+            del batch
+
+    def _process(self, batch):
+        started = time.monotonic()
+        for item in batch:
+            INFERENCE_STAGE_SECONDS.observe(started - item.enqueued_at, model=self.name, stage="queue_wait")
+        BATCH_SIZE.observe(len(batch), model=self.name)
+        try:
+            inputs = np.concatenate([item.array for item in batch], axis=0)
+            preds = self.predict_fn(inputs)
+            INFERENCE_STAGE_SECONDS.observe(time.monotonic() - started, model=self.name, stage="forward")
+        except Exception as e:
+            print(f"Error en el lote de {self.name} ({len(batch)} imágenes): {e}")
+            for item in batch:
+                item.future.set_exception(e)
+            self._record(batch, started)
+            return
+        for i, item in enumerate(batch):
+            try:
+                item.future.set_result(self.postprocess_fn(preds[i]))
+            except Exception as e:
+                item.future.set_exception(e)
+        self._record(batch, started)
+
+    def _record(self, batch, started):
+        size = len(batch)
+        wait = sum(started - item.enqueued_at for item in batch)
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._total_wait += wait
+            self._max_observed = max(self._max_observed, size)
+            if size >= self.max_batch_size:
+                self._full_batches += 1
+            self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
+
+    def stats(self):
+        """Estadísticas de llenado de lotes desde el arranque."""
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                "model": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": batches,
+                "items": items,
+                "queued": self._queue.qsize(),
+                "avg_batch_size": items / batches if batches else 0.0,
+                "avg_fill_ratio": items / (batches * self.max_batch_size) if batches else 0.0,
+                "full_batches": self._full_batches,
+                "max_observed_batch_size": self._max_observed,
+                "avg_queue_wait_ms": (self._total_wait / items) * 1000.0 if items else 0.0,
+                "batch_size_histogram": dict(sorted(self._size_histogram.items())),
+            }
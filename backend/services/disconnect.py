@@ -0,0 +1,28 @@
+import asyncio
+
+# Intervalo de sondeo de la desconexión del cliente HTTP
+_DISCONNECT_POLL_SECONDS = 0.25
+
+
+class ClientDisconnected(Exception):
+    """El cliente HTTP cerró la conexión antes de recibir la respuesta."""
+
+
+async def cancel_on_disconnect(request, coro):
+    """
+    Ejecuta `coro` y la cancela si el cliente HTTP se desconecta antes de que
+    termine (liberando, por ejemplo, la conexión a OpenAI y el hueco del
+    semáforo, o el trabajo de inferencia aún en cola).
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import threading
+from functools import partial
+
+from backend.services.model_registry import ModelSpec, file_version
+
+# Nombre del modelo fusionado en el registro
+FUSED_MODEL_NAME = "fusionado"
+
+# Ruta -> (versión por fecha y tamaño, SHA-256): el hash solo se recalcula
+# cuando cambia la versión, así el registro puede comprobarlo en cada vigilancia
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def source_digest(path):
+    """
+    SHA-256 del contenido de un .keras de origen. Se compara por contenido y
+    no por fecha: un despliegue que reescribe el fichero sin cambiarlo (git
+    checkout, scp, rsync sin -t...) no invalida el modelo fusionado.
+    """
+    version = file_version(path)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digests_lock:
+        _digests[path] = (version, digest)
+    return digest
+
+
+def read_fused_metadata(path):
+    """Metadatos escritos por backend/tools/fuse_models.py, o None si no existen."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fused_model_problems(metadata, heads):
+    """
+    Motivos por los que el modelo fusionado no puede sustituir a `heads` (las
+    `ModelSpec` de los modelos por separado). Lista vacía si puede.
+    """
+    if metadata is None:
+        return ["no hay metadatos del modelo fusionado"]
+    problems = []
+    if not metadata.get("verification", {}).get("passed"):
+        problems.append("la verificación contra los modelos por separado no pasó")
+    declared = [(h["name"], h["width"]) for h in metadata.get("heads", [])]
+    expected = [(spec.name, spec.output_width) for spec in heads]
+    if declared != expected:
+        problems.append(f"cabezas {declared}, se esperaban {expected}")
+    for spec in heads:
+        try:
+            current = source_digest(spec.path)
+        except OSError:
+            problems.append(f"no existe {spec.path}")
+            continue
+        if metadata.get("sources", {}).get(spec.name) != current:
+            problems.append(f"{spec.path} cambió desde la fusión")
+    return problems
+
+
+def fused_model_spec(path, metadata_path, heads, batch_max_size=16, batch_max_wait_ms=5.0):
+    """
+    `ModelSpec` multihead del modelo fusionado, o None (con un aviso) si no
+    existe, no está verificado, se generó a partir de otros .keras o alguna
+    cabeza tiene configurado un backend distinto de keras. Se
+    registra junto a `heads`, que atienden las peticiones si deja de ser válido.
+    """
+    # El modelo fusionado solo existe en .keras: no se activa si se pidió otro
+    # backend (p. ej. tflite) para alguna cabeza, para no ignorarlo en silencio
+    other_backends = [f"{head.name}={head.backend}" for head in heads if head.backend != "keras"]
+    if other_backends:
+        print(f"AVISO: FUSED_MODEL_MODE=on se ignora porque hay cabezas con otro backend de inferencia "
+              f"({', '.join(other_backends)}): se usan los modelos por separado.")
+        return None
+    if not os.path.exists(path):
+        print(f"Modelo fusionado no disponible ({path}): se usan los modelos por separado.")
+        return None
+    problems = fused_model_problems(read_fused_metadata(metadata_path), heads)
+    if problems:
+        print(f"Modelo fusionado descartado ({'; '.join(problems)}): se usan los modelos por separado.")
+        return None
+    return ModelSpec(
+        FUSED_MODEL_NAME, path, [], {}, output="multihead", input_size=heads[0].input_size,
+        backend="keras", batch_max_size=batch_max_size, batch_max_wait_ms=batch_max_wait_ms, heads=heads,
+        # El registro lo vuelve a comprobar al vigilar los ficheros: si se
+        # reentrena uno de los modelos, sus cabezas pasan a servirse por separado
+        validate=partial(_current_problems, metadata_path, heads),
+    )
+
+
+def _current_problems(metadata_path, heads):
+    return fused_model_problems(read_fused_metadata(metadata_path), heads)
@@ -0,0 +1,145 @@
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Tamaño de entrada de los modelos
+TARGET_SIZE = (224, 224)
+
+_thread_local = threading.local()
+
+
+def _open(source):
+    """Abre la imagen desde bytes o desde un objeto tipo archivo."""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        # BytesIO sobre bytes comparte el buffer: no se copia la subida
+        source = BytesIO(source)
+    return Image.open(source)
+
+
+def decode_image(source, target_size=TARGET_SIZE, timings=None):
+    """
+    Decodifica la imagen en RGB directamente al tamaño objetivo.
+
+    Para JPEG se usa el modo draft, que decodifica a 1/2, 1/4 o 1/8 de la
+    resolución con la escala más pequeña que siga cubriendo `target_size`, de
+    modo que una foto de 12 MP no se decodifica nunca a resolución completa.
+    Después se hace un único resize al tamaño final.
+
+    Si se pasa `timings` (dict), se rellenan "decode" y "resize" en segundos y
+    "pixels" con la resolución original de la imagen.
+    """
+    start = time.perf_counter()
+    img = _open(source)
+    if timings is not None:
+        timings["pixels"] = img.size[0] * img.size[1]
+    if img.format == "JPEG":
+        img.draft("RGB", target_size)
+    img.load()
+    decoded = time.perf_counter()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != tuple(target_size):
+        img = img.resize(target_size)
+    if timings is not None:
+        timings["decode"] = decoded - start
+        timings["resize"] = time.perf_counter() - decoded
+    return img
+
+
+def image_to_array(img, out=None):
+    """
+    Normaliza una imagen RGB uint8 a float32 en [0, 1] escribiendo en `out`.
+
+    `out` debe tener forma (H, W, 3) y dtype float32; si no se pasa se reserva
+    uno nuevo. La división se hace en una sola pasada uint8 -> float32 sin
+    arrays intermedios.
+    """
+    pixels = np.asarray(img, dtype=np.uint8)
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.float32)
+    np.divide(pixels, np.float32(255.0), out=out)
+    return out
+
+
+def _thread_buffer(target_size):
+    """Buffer (1, H, W, 3) reutilizable, uno por hilo."""
+    shape = (1, target_size[1], target_size[0], 3)
+    buffer = getattr(_thread_local, "buffer", None)
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, dtype=np.float32)
+        _thread_local.buffer = buffer
+    return buffer
+
+
+def preprocess_image(source, target_size=TARGET_SIZE, out=None, reuse_buffer=False, timings=None):
+    """
+    Convierte una imagen en un tensor (1, H, W, 3) float32 normalizado.
+
+    Con `reuse_buffer=True` se escribe en un buffer propio del hilo actual que
+    se reutiliza entre llamadas: el tensor devuelto solo es válido hasta la
+    siguiente llamada en el mismo hilo, así que el llamador debe consumirlo
+    (o copiarlo) antes de preprocesar otra imagen.
+
+    `timings` recibe los tiempos de `decode_image` más "normalize".
+    """
+    if out is None:
+        if reuse_buffer:
+            out = _thread_buffer(target_size)
+        else:
+            out = np.empty((1, target_size[1], target_size[0], 3), dtype=np.float32)
+    img = decode_image(source, target_size, timings)
+    start = time.perf_counter()
+    image_to_array(img, out=out[0])
+    if timings is not None:
+        timings["normalize"] = time.perf_counter() - start
+    return out
+
+
+def preprocess_batch(sources, target_size=TARGET_SIZE, out=None):
+    """
+    Preprocesa varias imágenes rellenando en su sitio un array (N, H, W, 3).
+
+    Si `out` tiene más filas que imágenes solo se escriben las primeras N y se
+    devuelve la vista correspondiente.
+    """
+    sources = list(sources)
+    n = len(sources)
+    if out is None:
+        out = np.empty((n, target_size[1], target_size[0], 3), dtype=np.float32)
+    elif out.shape[0] < n:
+        raise ValueError(f"El buffer tiene {out.shape[0]} filas y hay {n} imágenes")
+    for i, source in enumerate(sources):
+        image_to_array(decode_image(source, target_size), out=out[i])
+    return out[:n]
+
+
+_VISION_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+def encode_for_vision(source, max_edge=1024, fmt="jpeg", quality=85):
+    """
+    Prepara una imagen para un modelo de visión remoto: respeta la orientación
+    EXIF, descarta los metadatos, reduce el lado mayor a `max_edge` y la
+    recodifica en JPEG o WebP con la calidad indicada.
+
+    Usa la misma decodificación en modo draft que `decode_image`, de modo que
+    una foto JPEG grande se decodifica directamente a una escala cercana a
+    `max_edge`. Devuelve (bytes, tipo MIME, (ancho, alto) final).
+    """
+    pil_format, mime = _VISION_FORMATS[fmt]
+    img = _open(source)
+    if img.format == "JPEG":
+        img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_edge, max_edge))
+    out = BytesIO()
+    # Sin exif= ni icc_profile= el archivo resultante no lleva metadatos
+    img.save(out, format=pil_format, quality=quality, optimize=pil_format == "JPEG")
+    return out.getvalue(), mime, img.size
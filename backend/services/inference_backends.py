@@ -0,0 +1,124 @@
+import threading
+
+import numpy as np
+
+from backend.config.model_config import get_tensorflow
+
+
+class KerasBackend:
+    """
+    Backend por defecto: el modelo .keras original en precisión completa.
+
+    Con `use_tf_function` la llamada se compila en un tf.function con firma
+    fija (batch variable), que se traza una sola vez; si no, se llama al
+    modelo directamente. Ambas evitan el overhead por llamada de `model.predict`.
+    """
+
+    kind = "keras"
+
+    def __init__(self, model, input_size=(224, 224), use_tf_function=True):
+        tf = get_tensorflow()
+        self.model = model
+        self._tf = tf
+        signature = [tf.TensorSpec([None, input_size[1], input_size[0], 3], tf.float32)]
+        if use_tf_function:
+            self._infer = tf.function(lambda batch: model(batch, training=False), input_signature=signature)
+        else:
+            self._infer = lambda batch: model(batch, training=False)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        return cls(get_tensorflow().keras.models.load_model(path), **kwargs)
+
+    def predict(self, batch):
+        return self._infer(self._tf.convert_to_tensor(batch, dtype=self._tf.float32)).numpy()
+
+    def memory_bytes(self):
+        """Huella estimada: tamaño de los pesos (no incluye el grafo trazado ni activaciones)."""
+        # Keras 3 da el dtype como str y Keras 2 como tf.DType: ambos se pasan a numpy
+        return sum(
+            int(np.prod(w.shape)) * np.dtype(getattr(w.dtype, "as_numpy_dtype", w.dtype)).itemsize
+            for w in self.model.weights
+        )
+
+
+class TFLiteBackend:
+    """
+    Backend TFLite para modelos convertidos con `backend/tools/convert_tflite.py`
+    (cuantización de rango dinámico o int8).
+
+    Se usa el resolver de operaciones AUTO, que aplica el delegate XNNPACK por
+    defecto en CPU. El intérprete no es thread-safe, así que las llamadas se
+    serializan con un lock; con micro-batching solo hay un hilo por modelo
+    en el camino caliente.
+    """
+
+    kind = "tflite"
+
+    def __init__(self, path, num_threads=None):
+        tf = get_tensorflow()
+        self.path = path
+        self._lock = threading.Lock()
+        self._interpreter = tf.lite.Interpreter(
+            model_path=path,
+            num_threads=num_threads,
+            experimental_op_resolver_type=tf.lite.experimental.OpResolverType.AUTO,
+        )
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        return cls(path, **kwargs)
+
+    @property
+    def input_dtype(self):
+        return self._input["dtype"]
+
+    def _quantize(self, batch):
+        dtype = self._input["dtype"]
+        if dtype == np.float32:
+            return np.asarray(batch, dtype=np.float32)
+        scale, zero_point = self._input["quantization"]
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output):
+        if self._output["dtype"] == np.float32:
+            return output
+        scale, zero_point = self._output["quantization"]
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch):
+        n = batch.shape[0]
+        with self._lock:
+            if n != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input["index"], [n, *self._input["shape"][1:]])
+                self._interpreter.allocate_tensors()
+                self._input = self._interpreter.get_input_details()[0]
+                self._output = self._interpreter.get_output_details()[0]
+                self._batch_size = n
+            self._interpreter.set_tensor(self._input["index"], self._quantize(batch))
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(self._output["index"])
+        return self._dequantize(output)
+
+    def memory_bytes(self):
+        """Huella estimada: todos los tensores del intérprete (pesos y activaciones al lote actual)."""
+        with self._lock:
+            details = self._interpreter.get_tensor_details()
+        return sum(int(np.prod(d["shape"])) * np.dtype(d["dtype"]).itemsize for d in details)
+
+
+def load_backend(kind, keras_path, tflite_path=None, num_threads=None, use_tf_function=True, input_size=(224, 224)):
+    """
+    Carga el backend de inferencia configurado para un modelo. `input_size`
+    (ancho, alto) debe ser el mismo al que se redimensionan sus imágenes.
+    """
+    if kind == "keras":
+        return KerasBackend.load(keras_path, input_size=input_size, use_tf_function=use_tf_function)
+    if kind == "tflite":
+        return TFLiteBackend.load(tflite_path, num_threads=num_threads)
+    raise ValueError(f"Backend de inferencia no soportado: {kind}")
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from backend.config.model_config import INFERENCE_EXECUTOR_KIND, INFERENCE_EXECUTOR_WORKERS
+
+
+def _timed_call(fn, args, kwargs):
+    """Ejecuta `fn` en el worker y devuelve (inicio, fin, resultado) en tiempo de pared."""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return started, time.time(), result
+
+
+class InferenceExecutor:
+    """
+    Ejecuta el trabajo CPU-bound (decodificación, resize y model.predict) fuera
+    del event loop de uvicorn, en un pool acotado de hilos o de procesos.
+
+    Con `kind="process"` las funciones y sus argumentos deben poder serializarse
+    con pickle y cada proceso carga su propia copia de los modelos.
+    """
+
+    def __init__(self, max_workers=None, kind="thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Tipo de executor no soportado: {kind}")
+        self.kind = kind
+        self.max_workers = max(1, int(max_workers or os.cpu_count() or 1))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_workers, thread_name_prefix="inference"
+                        )
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        """Ejecuta `fn(*args, **kwargs)` en el pool y espera su resultado sin bloquear el loop."""
+        loop = asyncio.get_running_loop()
+        submitted_at = time.time()
+        with self._stats_lock:
+            self._submitted += 1
+        try:
+            started, finished, result = await loop.run_in_executor(
+                self._get_executor(), _timed_call, fn, args, kwargs
+            )
+        except BaseException:
+            with self._stats_lock:
+                self._failed += 1
+            raise
+        wait = max(0.0, started - submitted_at)
+        with self._stats_lock:
+            self._completed += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._total_run += finished - started
+        return result
+
+    def shutdown(self, wait=True):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def stats(self):
+        """Contadores de profundidad de cola y tiempos de espera para dimensionar el pool."""
+        with self._stats_lock:
+            completed = self._completed
+            in_flight = self._submitted - completed - self._failed
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "submitted": self._submitted,
+                "completed": completed,
+                "failed": self._failed,
+                "in_flight": in_flight,
+                "queue_depth": max(0, in_flight - self.max_workers),
+                "avg_wait_ms": (self._total_wait / completed) * 1000.0 if completed else 0.0,
+                "max_wait_ms": self._max_wait * 1000.0,
+                "avg_run_ms": (self._total_run / completed) * 1000.0 if completed else 0.0,
+            }
+
+
+# Executor compartido por todos los endpoints de análisis
+inference_executor = InferenceExecutor(
+    max_workers=INFERENCE_EXECUTOR_WORKERS, kind=INFERENCE_EXECUTOR_KIND
+)
+
+
+async def run_inference(fn, *args, **kwargs):
+    """Atajo para ejecutar una función de predicción en el executor compartido."""
+    return await inference_executor.run(fn, *args, **kwargs)
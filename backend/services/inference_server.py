@@ -0,0 +1,317 @@
+"""
+Servidor de inferencia compartido por todos los workers de uvicorn del host.
+
+Carga cada modelo una sola vez y atiende a los workers por un socket Unix.
+Los tensores preprocesados no viajan por el socket: cada hilo cliente escribe
+su tensor en un segmento de memoria compartida propio y envía solo el nombre
+del segmento y la forma. Las peticiones de una imagen de todos los workers
+entran en los mismos micro-batchers, así que se agrupan entre procesos.
+
+Arranque:
+    python -m backend.services.inference_server
+y en los workers HTTP: INFERENCE_SERVER_MODE=client.
+"""
+import argparse
+import atexit
+import os
+import secrets
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError, resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from backend.config.model_config import (
+    INFERENCE_SERVER_SOCKET, INFERENCE_SERVER_AUTHKEY, INFERENCE_SERVER_AUTHKEY_FILE,
+    INFERENCE_SERVER_TIMEOUT_SECONDS, INFERENCE_SERVER_RETRY_SECONDS,
+    MODEL_WATCH_INTERVAL_SECONDS, MODEL_RESIDENCY_CHECK_SECONDS,
+)
+
+# Timeout de las consultas de estado (health checks)
+_STATUS_TIMEOUT_SECONDS = 2.0
+
+
+class InferenceServerUnavailable(Exception):
+    """No se pudo hablar con el servidor de inferencia; el llamador debe inferir en proceso."""
+
+
+def _attach(name):
+    """Abre un segmento creado por un cliente sin que este proceso lo borre al salir."""
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: desregistrar del resource_tracker, el segmento es del cliente
+        shm = SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+def _authkey_path(socket_path):
+    return INFERENCE_SERVER_AUTHKEY_FILE or os.path.join(os.path.dirname(socket_path), "authkey")
+
+
+def _private_dir(path):
+    """Crea el directorio solo accesible por este usuario, o comprueba que lo es."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise RuntimeError(f"{path} no es un directorio propio: no se crea ahí el socket de inferencia.")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+
+
+def server_authkey(socket_path):
+    """Clave configurada o, si no hay, una aleatoria nueva guardada con permisos 0600."""
+    if INFERENCE_SERVER_AUTHKEY:
+        return INFERENCE_SERVER_AUTHKEY
+    path = _authkey_path(socket_path)
+    key = secrets.token_hex(32).encode("ascii")
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(tmp_path, path)
+    return key
+
+
+def client_authkey(socket_path):
+    """Clave configurada o la que generó el servidor al arrancar."""
+    if INFERENCE_SERVER_AUTHKEY:
+        return INFERENCE_SERVER_AUTHKEY
+    with open(_authkey_path(socket_path), "rb") as f:
+        return f.read().strip()
+
+
+# --- Servidor ---
+
+class InferenceServer:
+    """Atiende cada conexión en su propio hilo sobre un `ModelRegistry` compartido."""
+
+    def __init__(self, registry, socket_path=INFERENCE_SERVER_SOCKET, authkey=None,
+                 timeout=INFERENCE_SERVER_TIMEOUT_SECONDS):
+        self.registry = registry
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self.timeout = timeout
+
+    def serve_forever(self):
+        # El socket nace ya dentro de un directorio privado: ningún otro
+        # usuario puede conectar ni antes ni después de ajustar sus permisos
+        _private_dir(os.path.dirname(os.path.abspath(self.socket_path)))
+        if self.authkey is None:
+            self.authkey = server_authkey(self.socket_path)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        with Listener(self.socket_path, family="AF_UNIX", authkey=self.authkey) as listener:
+            os.chmod(self.socket_path, 0o600)
+            print(f"Servidor de inferencia escuchando en {self.socket_path}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    print(f"Conexión rechazada: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name="inference-conn", daemon=True).start()
+
+    def _handle(self, conn):
+        segments = {}
+        try:
+            while True:
+                message = conn.recv()
+                try:
+                    reply = self._dispatch(message, segments)
+                except Exception as e:
+                    reply = {"error": str(e)}
+                conn.send(reply)
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            for shm in segments.values():
+                try:
+                    shm.close()
+                except BufferError:
+                    pass
+
+    def _status(self):
+        return {
+            "ready": self.registry.ready(),
+            "models": self.registry.status,
+            "versions": {name: self.registry.version(name) for name in self.registry.routes},
+        }
+
+    def _dispatch(self, message, segments):
+        op = message.get("op")
+        if op == "status":
+            return self._status()
+        if op != "predict":
+            raise ValueError(f"Operación desconocida: {op}")
+        name = message["shm"]
+        shm = segments.get(name)
+        if shm is None:
+            # Un cliente que crece su segmento envía uno nuevo; el anterior ya no se usa
+            for old in segments.values():
+                try:
+                    old.close()
+                except BufferError:
+                    pass
+            segments.clear()
+            shm = segments[name] = _attach(name)
+        batch = np.ndarray(tuple(message["shape"]), dtype=np.float32, buffer=shm.buf)
+        models = message["models"]
+        unknown = [model for model in models if model not in self.registry.routes]
+        results = {model: {"error": f"Modelo desconocido: {model}"} for model in unknown}
+        models = [model for model in models if model not in unknown]
+        if batch.shape[0] == 1:
+            # Una imagen: pasa por los micro-batchers, compartidos por todos los workers
+            for model, future in self.registry.submit(models, batch).items():
+                try:
+                    results[model] = {"rows": [future.result(timeout=self.timeout)]}
+                except Exception as e:
+                    results[model] = {"error": str(e)}
+        else:
+            for model, rows in self.registry.predict_many(models, batch).items():
+                results[model] = {"error": str(rows)} if isinstance(rows, Exception) else {"rows": rows}
+        del batch
+        return {"results": results, "versions": {m: self.registry.version(m) for m in models}}
+
+
+# --- Cliente (workers HTTP) ---
+
+class InferenceClient:
+    """
+    Cliente del servidor de inferencia, seguro entre hilos: cada hilo tiene su
+    conexión y su segmento de memoria compartida. Tras un fallo de conexión se
+    marca el servidor como no disponible durante `retry_seconds` para que las
+    peticiones pasen directamente a la inferencia en proceso.
+    """
+
+    def __init__(self, socket_path=INFERENCE_SERVER_SOCKET, authkey=None,
+                 timeout=INFERENCE_SERVER_TIMEOUT_SECONDS, retry_seconds=INFERENCE_SERVER_RETRY_SECONDS):
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self.timeout = timeout
+        self.retry_seconds = retry_seconds
+        self.versions = {}
+        self._local = threading.local()
+        self._down_until = 0.0
+        self._segments_lock = threading.Lock()
+        self._segments = []
+        atexit.register(self.close)
+
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def _state(self):
+        # Un proceso hijo del executor hereda el estado del hilo que lo creó: no reutilizarlo
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.pid = os.getpid()
+            local.conn = None
+            local.shm = None
+        return local
+
+    def input_buffer(self, shape):
+        """Array float32 en la memoria compartida de este hilo, para preprocesar directamente en él."""
+        local = self._state()
+        nbytes = int(np.prod(shape)) * 4
+        if local.shm is None or local.shm.size < nbytes:
+            if local.shm is not None:
+                self._release(local.shm)
+            local.shm = SharedMemory(create=True, size=nbytes)
+            with self._segments_lock:
+                self._segments.append(local.shm)
+        return np.ndarray(shape, dtype=np.float32, buffer=local.shm.buf)
+
+    def _release(self, shm):
+        with self._segments_lock:
+            if shm in self._segments:
+                self._segments.remove(shm)
+        try:
+            shm.close()
+        except BufferError:
+            pass
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _call(self, message, timeout):
+        if not self.available():
+            raise InferenceServerUnavailable("Servidor de inferencia marcado como no disponible.")
+        local = self._state()
+        try:
+            if local.conn is None:
+                # La clave se relee en cada conexión: el servidor la regenera al reiniciarse
+                authkey = self.authkey or client_authkey(self.socket_path)
+                local.conn = Client(self.socket_path, family="AF_UNIX", authkey=authkey)
+            local.conn.send(message)
+            if not local.conn.poll(timeout):
+                raise TimeoutError("El servidor de inferencia no respondió a tiempo.")
+            reply = local.conn.recv()
+        except (OSError, EOFError, TimeoutError, AuthenticationError) as e:
+            if local.conn is not None:
+                local.conn.close()
+                local.conn = None
+            self._down_until = time.monotonic() + self.retry_seconds
+            print(f"Servidor de inferencia no disponible ({e}); se infiere en proceso.")
+            raise InferenceServerUnavailable(str(e)) from e
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        if "versions" in reply:
+            self.versions.update({k: v for k, v in reply["versions"].items() if v})
+        return reply
+
+    def predict(self, models, batch):
+        """
+        Infiere `batch` (devuelto por `input_buffer`, o una porción inicial suya)
+        con varios modelos. Devuelve nombre -> {"rows": [(etiqueta, probs, versión)]}
+        o {"error": mensaje}.
+        """
+        local = self._state()
+        message = {"op": "predict", "models": list(models), "shm": local.shm.name, "shape": batch.shape}
+        return self._call(message, self.timeout)["results"]
+
+    def status(self):
+        return self._call({"op": "status"}, _STATUS_TIMEOUT_SECONDS)
+
+    def close(self):
+        with self._segments_lock:
+            segments, self._segments = self._segments, []
+        for shm in segments:
+            try:
+                shm.close()
+            except BufferError:
+                pass
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=INFERENCE_SERVER_SOCKET)
+    parser.add_argument("--watch-interval", type=float, default=MODEL_WATCH_INTERVAL_SECONDS,
+                        help="Segundos entre comprobaciones de los ficheros de los modelos (0 desactiva)")
+    args = parser.parse_args()
+
+    from backend.config.model_config import ensure_model_dirs
+    from backend.services.skin_analysis_service import model_registry
+
+    ensure_model_dirs()
+    # Acepta conexiones ya; los clientes consultan "status" hasta que esté listo
+    threading.Thread(target=model_registry.warmup_all, name="model-warmup", daemon=True).start()
+    model_registry.start_watching(args.watch_interval)
+    model_registry.residency.start(MODEL_RESIDENCY_CHECK_SECONDS)
+    InferenceServer(model_registry, args.socket).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import asyncio
+import itertools
+import math
+import time
+import uuid
+
+from backend.config.model_config import JOB_QUEUE_MAX_SIZE, JOB_QUEUE_WORKERS
+from backend.services.inference_executor import run_inference
+from backend.services.metrics import JOBS, JOB_STAGE_SECONDS
+from backend.services.result_store import result_store
+
+# Prioridad pedida por el cliente -> orden en la cola (menor, antes)
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# Estados de un trabajo
+QUEUED, RUNNING, DONE, FAILED = "en_cola", "procesando", "completado", "error"
+FINAL_STATES = (DONE, FAILED)
+
+# Segundos que un trabajo terminado sigue en memoria para los suscriptores SSE;
+# después se sirve desde el almacén de resultados
+_FINISHED_GRACE_SECONDS = 60.0
+
+
+class JobQueueFull(Exception):
+    """La cola está llena; `retry_after` estima cuándo habrá hueco, en segundos."""
+
+    def __init__(self, retry_after):
+        super().__init__("La cola de trabajos está llena.")
+        self.retry_after = retry_after
+
+
+class Job:
+    """Un análisis encolado. La imagen se suelta en cuanto el trabajo termina."""
+
+    def __init__(self, fn, image_bytes, models, priority, filename=None, content_type=None):
+        self.id = str(uuid.uuid4())
+        self.fn = fn
+        self.image_bytes = image_bytes
+        self.models = models
+        self.priority = priority
+        self.filename = filename
+        self.content_type = content_type
+        self.state = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.changed = asyncio.Event()
+        # Serializa las escrituras en el almacén para que no se adelante una antigua
+        self.persist_lock = asyncio.Lock()
+
+    def snapshot(self):
+        record = {
+            "id": self.id,
+            "estado": self.state,
+            "prioridad": self.priority,
+            "modelos": self.models,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "creado": self.created_at,
+            "iniciado": self.started_at,
+            "terminado": self.finished_at,
+        }
+        if self.result is not None:
+            record["resultados"] = self.result
+        if self.error is not None:
+            record["error"] = self.error
+        return record
+
+    def _notify(self):
+        # Despierta a quien espera el cambio y prepara el evento del siguiente
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class JobQueue:
+    """
+    Cola de prioridad acotada de análisis atendida por un número fijo de workers
+    del event loop, que delegan la inferencia en el executor compartido.
+
+    Con la cola llena `submit` falla de inmediato con `JobQueueFull` en lugar de
+    acumular trabajo. Cada cambio de estado se guarda en el almacén de
+    resultados con el id del trabajo, así que con el backend sqlite cualquier
+    worker de uvicorn puede responder al sondeo; los eventos SSE en vivo se
+    sirven desde el proceso que aceptó el trabajo.
+    """
+
+    def __init__(self, max_size=64, workers=4):
+        self.max_size = max(1, int(max_size))
+        self.workers = max(1, int(workers))
+        self._queue = None
+        self._tasks = []
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self._avg_run_seconds = None
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def retry_after(self):
+        """
+        Segundos estimados hasta que se vacíe la cola actual. Es conservador a
+        propósito: repartir los reintentos evita que vuelvan a llenarla de golpe.
+        """
+        avg = self._avg_run_seconds or 1.0
+        waiting = self._queue.qsize() if self._queue is not None else 0
+        return max(1, math.ceil(waiting * avg / self.workers))
+
+    async def submit(self, fn, image_bytes, models, priority="normal", filename=None, content_type=None):
+        """Encola `fn(image_bytes, models)`. Devuelve el `Job` o lanza `JobQueueFull`."""
+        if self._queue is None:
+            raise RuntimeError("La cola de trabajos no está arrancada.")
+        job = Job(fn, image_bytes, models, priority, filename, content_type)
+        try:
+            self._queue.put_nowait((PRIORITIES[priority], next(self._sequence), job))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            JOBS.inc(outcome="rejected")
+            raise JobQueueFull(self.retry_after())
+        self._jobs[job.id] = job
+        await self._persist(job)
+        JOBS.inc(outcome="accepted")
+        return job
+
+    def position(self, job_id):
+        """Trabajos por delante en la cola (None si ya no está en cola en este proceso)."""
+        job = self._jobs.get(job_id)
+        if job is None or job.state != QUEUED:
+            return None
+        # La cola interna es un heap: se ordena una copia para calcular la posición
+        ahead = sorted(self._queue._queue)
+        for i, (_, _, other) in enumerate(ahead):
+            if other is job:
+                return i
+        return None
+
+    async def get(self, job_id):
+        """Estado del trabajo: del proceso actual si lo tiene, si no del almacén de resultados."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            record = job.snapshot()
+            if job.state == QUEUED:
+                record["posicion"] = self.position(job_id)
+            return record
+        record = await asyncio.to_thread(result_store.get, job_id)
+        if not record or record.pop("modelo", None) != "job":
+            return None
+        return record
+
+    async def wait_for_change(self, job_id, timeout):
+        """Espera un cambio de estado de un trabajo local (o `timeout` segundos). True si cambió."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            await asyncio.sleep(min(timeout, 1.0))
+            return False
+        try:
+            await asyncio.wait_for(job.changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _persist(self, job):
+        # Con el backend sqlite es E/S de disco: fuera del event loop. El
+        # estado se toma ya con el lock, así que la última escritura es la más reciente
+        try:
+            async with job.persist_lock:
+                await asyncio.to_thread(result_store.put, {"modelo": "job", **job.snapshot()}, job.id)
+        except Exception as e:
+            print(f"Error guardando el trabajo {job.id}: {e}")
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            self._running += 1
+            job.state = RUNNING
+            job.started_at = time.time()
+            JOB_STAGE_SECONDS.observe(job.started_at - job.created_at, stage="queue_wait")
+            await self._persist(job)
+            job._notify()
+            try:
+                job.result = await run_inference(job.fn, job.image_bytes, job.models)
+                job.state = DONE
+                self._completed += 1
+                JOBS.inc(outcome="done")
+            except Exception as e:
+                print(f"Error en el trabajo {job.id}: {e}")
+                job.error = f"No se pudo analizar la imagen: {e}"
+                job.state = FAILED
+                self._failed += 1
+                JOBS.inc(outcome="failed")
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+            job.finished_at = time.time()
+            run_seconds = job.finished_at - job.started_at
+            JOB_STAGE_SECONDS.observe(run_seconds, stage="run")
+            self._avg_run_seconds = run_seconds if self._avg_run_seconds is None else (
+                0.9 * self._avg_run_seconds + 0.1 * run_seconds
+            )
+            job.image_bytes = None
+            await self._persist(job)
+            job._notify()
+            self._forget_finished()
+
+    def _forget_finished(self):
+        now = time.time()
+        for job_id in [
+            job_id for job_id, job in self._jobs.items()
+            if job.state in FINAL_STATES and now - job.finished_at > _FINISHED_GRACE_SECONDS
+        ]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "avg_run_ms": (self._avg_run_seconds or 0.0) * 1000.0,
+            "retry_after_seconds": self.retry_after(),
+        }
+
+
+# Cola de trabajos del proceso, arrancada en el lifespan de la app
+job_queue = JobQueue(max_size=JOB_QUEUE_MAX_SIZE, workers=JOB_QUEUE_WORKERS)
@@ -0,0 +1,272 @@
+"""
+Métricas de latencia y uso en formato de texto de Prometheus.
+
+Implementación mínima sin dependencias: contadores, gauges e histogramas con
+etiquetas, seguros entre hilos y con un coste por observación de un
+`bisect` y un lock sin contención apreciable. Se exponen en `/metrics`.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Buckets de latencia (segundos) pensados para el rango 1 ms - 60 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Buckets de tamaño de subida (bytes): 16 KiB - 64 MiB
+BYTES_BUCKETS = tuple(16 * 1024 * 4 ** i for i in range(7))
+# Buckets de resolución de la imagen original (megapíxeles)
+MEGAPIXEL_BUCKETS = (0.1, 0.3, 1.0, 2.0, 4.0, 8.0, 12.0, 16.0, 24.0, 48.0)
+# Buckets de tamaño de lote
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def expose(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [conteos por bucket (+Inf al final), suma, total]
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def expose(self):
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._values.items()]
+        lines = self.header()
+        for key, counts, total_sum, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, fn):
+        """
+        Registra una función que devuelve [(nombre, tipo, ayuda, {etiquetas}, valor)]
+        evaluada en cada scrape; útil para exportar estadísticas que ya existen.
+        """
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def expose(self):
+        lines = []
+        for metric in list(self._metrics):
+            lines.extend(metric.expose())
+        seen = set()
+        for collector in list(self._collectors):
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Error en un colector de métricas: {e}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                if name not in seen:
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    seen.add(name)
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Latencia por etapa de cada petición HTTP (lectura del multipart, inferencia, OpenAI...)
+REQUEST_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pielsana_request_stage_seconds", "Duración de cada etapa de una petición por endpoint.", ("endpoint", "stage")
+))
+# Latencia total y peticiones en curso por endpoint (middleware HTTP)
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "pielsana_http_request_duration_seconds", "Duración total de las peticiones HTTP.", ("endpoint", "method", "status")
+))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "pielsana_http_requests_in_flight", "Peticiones HTTP en curso.", ("endpoint",)
+))
+# Latencia por etapa de inferencia (decodificación, resize, normalización, cola, forward)
+INFERENCE_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pielsana_inference_stage_seconds", "Duración de cada etapa de la inferencia por modelo.", ("model", "stage")
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "pielsana_batch_size", "Imágenes por forward pass.", ("model",), buckets=BATCH_SIZE_BUCKETS
+))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    "pielsana_model_load_seconds", "Tiempo de la última carga de cada modelo.", ("model",)
+))
+MODEL_LOADS = REGISTRY.register(Counter(
+    "pielsana_model_loads_total", "Cargas de modelos completadas.", ("model",)
+))
+MODEL_RESIDENT = REGISTRY.register(Gauge(
+    "pielsana_model_resident", "1 si el modelo está cargado en memoria en este proceso.", ("model",)
+))
+MODEL_MEMORY_BYTES = REGISTRY.register(Gauge(
+    "pielsana_model_memory_bytes", "Huella estimada en memoria de cada modelo cargado.", ("model",)
+))
+MODEL_EVICTIONS = REGISTRY.register(Counter(
+    "pielsana_model_evictions_total", "Modelos descargados de memoria por motivo.", ("model", "reason")
+))
+MODEL_RELOAD_SECONDS = REGISTRY.register(Histogram(
+    "pielsana_model_reload_seconds", "Duración de la recarga de un modelo descargado.", ("model", "trigger")
+))
+UPLOAD_BYTES = REGISTRY.register(Histogram(
+    "pielsana_upload_bytes", "Tamaño de las imágenes subidas.", ("endpoint",), buckets=BYTES_BUCKETS
+))
+UPLOAD_REJECTIONS = REGISTRY.register(Counter(
+    "pielsana_upload_rejections_total", "Subidas rechazadas antes de decodificar.", ("endpoint", "reason")
+))
+OPENAI_IMAGE_BYTES = REGISTRY.register(Histogram(
+    "pielsana_openai_image_bytes", "Tamaño de la imagen original y de la enviada a OpenAI.", ("stage",), buckets=BYTES_BUCKETS
+))
+OPENAI_REQUESTS = REGISTRY.register(Counter(
+    "pielsana_openai_requests_total", "Intentos de llamada a OpenAI por resultado.", ("outcome",)
+))
+JOBS = REGISTRY.register(Counter(
+    "pielsana_jobs_total", "Trabajos asíncronos por resultado (aceptado, rechazado, completado, error).", ("outcome",)
+))
+JOB_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pielsana_job_stage_seconds", "Espera en cola y ejecución de los trabajos asíncronos.", ("stage",)
+))
+ADMISSION_DECISIONS = REGISTRY.register(Counter(
+    "pielsana_admission_total", "Decisiones del control de admisión por modelo.", ("model", "outcome")
+))
+IMAGE_MEGAPIXELS = REGISTRY.register(Histogram(
+    "pielsana_image_megapixels", "Resolución original de las imágenes decodificadas.", (), buckets=MEGAPIXEL_BUCKETS
+))
+
+
+@contextmanager
+def request_stage(endpoint, stage):
+    """Mide una etapa de una petición: `with request_stage("analyze-acne", "upload_read"): ...`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REQUEST_STAGE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, stage=stage)
+
+
+def observe_preprocessing(model, timings):
+    """Registra los tiempos devueltos por `image_preprocessing.preprocess_image(timings=...)`."""
+    for stage in ("decode", "resize", "normalize"):
+        if stage in timings:
+            INFERENCE_STAGE_SECONDS.observe(timings[stage], model=model, stage=stage)
+    if "pixels" in timings:
+        IMAGE_MEGAPIXELS.observe(timings["pixels"] / 1e6)
+
+
+def render_metrics():
+    return REGISTRY.expose()
@@ -0,0 +1,506 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from backend.services.batching import MicroBatcher
+from backend.services.inference_backends import load_backend
+from backend.services.metrics import MODEL_LOAD_SECONDS, MODEL_LOADS
+from backend.services.model_residency import ResidencyManager
+
+
+class ModelSpec:
+    """
+    Descripción de un modelo de clasificación: de dónde se carga, cómo se
+    interpreta su salida y cómo se agrupan sus peticiones.
+
+    Con `output="softmax"` la salida es un vector de probabilidades por clase.
+    Con `output="sigmoid"` es un único valor: la probabilidad de
+    `class_names[1]` (la clase predicha es la 1 si supera 0.5).
+    Con `output="multihead"` el modelo calcula varias cabezas sobre un mismo
+    backbone y su salida es la concatenación de las de `heads` (otras
+    `ModelSpec`), en ese orden.
+
+    `validate` es opcional: una función sin argumentos que devuelve la lista de
+    motivos por los que el modelo no debe atender peticiones (vacía si puede).
+    El registro la comprueba en cada vigilancia de ficheros.
+    """
+
+    def __init__(self, name, path, class_names, labels, output="softmax", input_size=(224, 224),
+                 backend="keras", tflite_path=None, batch_max_size=16, batch_max_wait_ms=5.0, heads=None,
+                 validate=None):
+        if output not in ("softmax", "sigmoid", "multihead"):
+            raise ValueError(f"Tipo de salida no soportado: {output}")
+        if (output == "multihead") != bool(heads):
+            raise ValueError("Las cabezas solo se indican, y son obligatorias, con output='multihead'")
+        self.name = name
+        self.path = path
+        self.class_names = list(class_names)
+        self.labels = dict(labels)
+        self.output = output
+        self.input_size = tuple(input_size)
+        self.backend = backend
+        self.tflite_path = tflite_path
+        self.batch_max_size = batch_max_size
+        self.batch_max_wait_ms = batch_max_wait_ms
+        self.heads = list(heads or [])
+        self.validate = validate
+
+    @property
+    def output_width(self):
+        """Número de columnas de la salida del modelo para una imagen."""
+        if self.output == "multihead":
+            return sum(head.output_width for head in self.heads)
+        return len(self.class_names) if self.output == "softmax" else 1
+
+    @property
+    def artifact_path(self):
+        """Fichero que se carga realmente según el backend de inferencia."""
+        return self.tflite_path if self.backend == "tflite" else self.path
+
+    @property
+    def input_shape(self):
+        return (self.input_size[1], self.input_size[0], 3)
+
+    def postprocess(self, pred):
+        """
+        Convierte la salida del modelo para una imagen en (etiqueta, probabilidades),
+        o en cabeza -> (etiqueta, probabilidades) si es multihead.
+        """
+        if self.output == "multihead":
+            results = {}
+            offset = 0
+            for head in self.heads:
+                results[head.name] = head.postprocess(pred[offset:offset + head.output_width])
+                offset += head.output_width
+            return results
+        if self.output == "softmax":
+            pred_class = self.class_names[int(pred.argmax())]
+            probabilities = {self.labels[c]: float(pred[i]) for i, c in enumerate(self.class_names)}
+        else:
+            score = float(pred[0])
+            pred_class = self.class_names[int(score > 0.5)]
+            probabilities = {
+                self.labels[self.class_names[1]]: score,
+                self.labels[self.class_names[0]]: 1.0 - score,
+            }
+        return self.labels[pred_class], probabilities
+
+
+def file_version(path):
+    """Versión de un fichero de modelo a partir de su fecha de modificación y tamaño."""
+    st = os.stat(path)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+class ModelVersion:
+    """Una versión cargada y calentada de un modelo."""
+
+    def __init__(self, spec, backend, file_version, load_seconds):
+        self.spec = spec
+        self.backend = backend
+        self.file_version = file_version
+        self.version = f"{spec.backend}-{file_version}"
+        self.loaded_at = time.time()
+        self.load_seconds = load_seconds
+
+    def predict(self, batch):
+        return self.backend.predict(batch)
+
+
+class _HeadFuture:
+    """Future de una cabeza concreta sobre el Future del lote de un modelo multihead."""
+    __slots__ = ("future", "head")
+
+    def __init__(self, future, head):
+        self.future = future
+        self.head = head
+
+    def result(self, timeout=None):
+        return self.future.result(timeout=timeout)[self.head]
+
+
+class _VersionedOutput:
+    """Salida de un lote que recuerda qué versión del modelo la produjo."""
+    __slots__ = ("preds", "version")
+
+    def __init__(self, preds, version):
+        self.preds = preds
+        self.version = version
+
+    def __getitem__(self, i):
+        return self.preds[i], self.version
+
+
+class ModelRegistry:
+    """
+    Registro de modelos con recarga en caliente.
+
+    Cada modelo tiene una versión activa que se sustituye de forma atómica (una
+    asignación de referencia): una versión nueva se carga y se calienta en
+    segundo plano mientras la anterior sigue sirviendo, y los lotes que ya
+    estaban en curso terminan con la versión que tomaron al empezar. La
+    versión anterior se libera cuando ningún lote la usa.
+
+    Un hilo vigila los ficheros de los modelos por fecha y tamaño; un cambio
+    solo se carga cuando el fichero lleva un intervalo completo sin cambiar,
+    para no leer un .keras a medio copiar. Si la carga falla, sigue activa la
+    versión anterior.
+
+    `residency` (un `ResidencyManager`) decide qué modelos se descargan de
+    memoria; un modelo descargado se vuelve a cargar al pedirlo con `get`.
+
+    Las cabezas de un modelo multihead se piden por su propio nombre
+    (`get`, `version`, `submit`, `predict_many`): varias cabezas de una misma
+    imagen comparten un único forward pass. Si las cabezas también están
+    registradas como modelos propios, se sirven con el multihead mientras su
+    `validate` no ponga pegas y con los modelos por separado en cuanto las
+    ponga (por ejemplo, porque se reentrenó uno de ellos).
+    """
+
+    def __init__(self, specs, num_threads=None, use_tf_function=True, warmup_batch_sizes=(1,),
+                 memory_budget_bytes=0, idle_evict_seconds=0, evict_min_idle_seconds=30,
+                 prewarm_min_requests=0):
+        self.specs = {spec.name: spec for spec in specs}
+        # Modelos multihead retirados porque su `validate` puso pegas
+        self._disabled = set()
+        # Nombre pedido -> (modelo del registro, cabeza o None)
+        self.routes = self._build_routes()
+        self.num_threads = num_threads
+        self.use_tf_function = use_tf_function
+        self.warmup_batch_sizes = list(warmup_batch_sizes)
+        self.status = {}
+        self._active = {}
+        self._load_locks = {name: threading.Lock() for name in self.specs}
+        self._failed_versions = {}
+        self._evicted_versions = {}
+        self._warmed = set()
+        self._watch_thread = None
+        self._stop = threading.Event()
+        self.batchers = {
+            name: MicroBatcher(
+                name, self._batch_predict_fn(name), self._postprocess_fn(spec),
+                max_batch_size=spec.batch_max_size, max_wait_ms=spec.batch_max_wait_ms,
+            )
+            for name, spec in self.specs.items()
+        }
+        self.residency = ResidencyManager(
+            self, budget_bytes=memory_budget_bytes, idle_seconds=idle_evict_seconds,
+            min_idle_seconds=evict_min_idle_seconds, prewarm_min_requests=prewarm_min_requests,
+        )
+
+    def _build_routes(self):
+        routes = {name: (name, None) for name in self.specs}
+        for spec in self.specs.values():
+            if spec.name not in self._disabled:
+                for head in spec.heads:
+                    routes[head.name] = (spec.name, head.name)
+        return routes
+
+    def serving(self):
+        """Modelos del registro que atienden peticiones con las rutas actuales."""
+        return {model for model, _ in self.routes.values() if model not in self._disabled}
+
+    # --- Carga, calentamiento y sustitución ---
+
+    def _load_version(self, spec):
+        file_ver = file_version(spec.artifact_path)
+        start = time.perf_counter()
+        backend = load_backend(
+            spec.backend, spec.path, spec.tflite_path,
+            num_threads=self.num_threads, use_tf_function=self.use_tf_function, input_size=spec.input_size,
+        )
+        model = ModelVersion(spec, backend, file_ver, time.perf_counter() - start)
+        MODEL_LOAD_SECONDS.set(model.load_seconds, model=spec.name)
+        MODEL_LOADS.inc(model=spec.name)
+        return model
+
+    def _warmup(self, model, status):
+        start = time.perf_counter()
+        sizes = []
+        max_size = self.batchers[model.spec.name].max_batch_size
+        for size in self.warmup_batch_sizes:
+            size = min(int(size), max_size)
+            if size not in sizes:
+                model.predict(np.zeros((size, *model.spec.input_shape), dtype=np.float32))
+                sizes.append(size)
+        status["warmup_batch_sizes"] = sizes
+        status["warmup_seconds"] = round(time.perf_counter() - start, 3)
+
+    def load(self, name, warmup=True, trigger="demand"):
+        """
+        Carga (o recarga) el modelo desde su fichero, lo calienta y lo activa.
+        Devuelve la versión activa, que es la anterior si la carga falla.
+
+        `trigger` ("demand", "prewarm", "update" o "startup") solo se usa
+        para las métricas de recarga de modelos descargados.
+        """
+        spec = self.specs[name]
+        with self._load_locks[name]:
+            current = self._active.get(name)
+            if current is not None and trigger in ("demand", "prewarm"):
+                # Otro hilo lo cargó mientras se esperaba el lock
+                return current
+            status = dict(self.status.get(name) or {"loaded": False, "warmed": False, "error": None})
+            start = time.perf_counter()
+            try:
+                print(f"Cargando modelo {name} (backend {spec.backend}) desde {spec.artifact_path}...")
+                model = self._load_version(spec)
+                if warmup:
+                    self._warmup(model, status)
+            except Exception as e:
+                print(f"Error cargando el modelo {name}: {e}")
+                self._failed_versions[name] = self._current_file_version(spec)
+                status["error"] = str(e)
+                self.status[name] = status
+                return current
+            # Sustitución atómica: las peticiones nuevas ya usan la versión nueva
+            self._active[name] = model
+            self._failed_versions.pop(name, None)
+            self._evicted_versions.pop(name, None)
+            if warmup:
+                self._warmed.add(name)
+            status.update({
+                "loaded": True,
+                "resident": True,
+                "warmed": warmup,
+                "error": None,
+                "version": model.version,
+                "load_seconds": round(model.load_seconds, 3),
+                "loaded_at": model.loaded_at,
+            })
+            self.status[name] = status
+            status["memory_bytes"] = self.residency.on_loaded(
+                name, model, trigger=trigger, seconds=time.perf_counter() - start
+            )
+            if current is not None:
+                print(f"Modelo {name} actualizado: {current.version} -> {model.version}")
+            else:
+                print(f"Modelo {name} listo (versión {model.version}).")
+            return model
+
+    @staticmethod
+    def _current_file_version(spec):
+        # None si el fichero no existe: también cuenta como versión fallida
+        try:
+            return file_version(spec.artifact_path)
+        except OSError:
+            return None
+
+    def get(self, name):
+        """
+        Versión activa del modelo, cargándola si aún no se cargó o se descargó
+        (None si no se puede). Si la última carga falló, no se reintenta hasta
+        que el fichero cambie (o aparezca).
+        """
+        name = self.routes[name][0]
+        model = self._active.get(name)
+        if model is None:
+            if name in self._failed_versions and \
+                    self._failed_versions[name] == self._current_file_version(self.specs[name]):
+                return None
+            model = self.load(name, warmup=False)
+        return model
+
+    def version(self, name):
+        """Versión activa, o la última cargada si el modelo está descargado de memoria."""
+        name = self.routes[name][0]
+        model = self._active.get(name)
+        return model.version if model is not None else self._evicted_versions.get(name)
+
+    def resident(self):
+        """Nombres de los modelos cargados en memoria."""
+        return list(self._active)
+
+    def unload(self, name):
+        """
+        Descarga la versión activa del modelo. No espera a una carga en curso
+        del mismo modelo: devuelve False si la hay o si no estaba cargado.
+        """
+        lock = self._load_locks[name]
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            model = self._active.pop(name, None)
+            if model is None:
+                return False
+            self._evicted_versions[name] = model.version
+            status = dict(self.status[name])
+            status.update({"resident": False, "memory_bytes": 0})
+            self.status[name] = status
+            return True
+        finally:
+            lock.release()
+
+    def warmup_all(self):
+        """Carga y calienta todos los modelos que atienden peticiones y aún no estén activos."""
+        for name in self.serving():
+            model = self._active.get(name)
+            if model is None:
+                self.load(name, warmup=True, trigger="startup")
+            elif not self.status[name].get("warmed"):
+                # Cargado por una petición temprana: basta con calentarlo
+                status = self.status[name]
+                try:
+                    self._warmup(model, status)
+                    status["warmed"] = True
+                    self._warmed.add(name)
+                except Exception as e:
+                    print(f"Error calentando el modelo {name}: {e}")
+                    status["error"] = str(e)
+        return self.status
+
+    def ready(self):
+        # Un modelo descargado por la política de residencia sigue contando como
+        # listo: ya se cargó y calentó una vez y se recarga bajo demanda
+        return all(name in self._warmed for name in self.serving())
+
+    # --- Vigilancia de ficheros ---
+
+    def check_for_updates(self, previous=None):
+        """
+        Recarga los modelos cuyo fichero cambió y está estable desde la última
+        comprobación. `previous` es el dict nombre -> versión de fichero de la
+        comprobación anterior; devuelve el de esta.
+        """
+        self.check_routes()
+        previous = previous or {}
+        seen = {}
+        for name, spec in self.specs.items():
+            try:
+                seen[name] = file_version(spec.artifact_path)
+            except OSError:
+                continue
+            active = self._active.get(name)
+            if active is None or seen[name] == active.file_version:
+                continue
+            if seen[name] != previous.get(name) or seen[name] == self._failed_versions.get(name):
+                # Cambió desde la última comprobación (puede estar copiándose) o ya falló
+                continue
+            self.load(name, warmup=True, trigger="update")
+        return seen
+
+    def check_routes(self):
+        """
+        Comprueba el `validate` de cada modelo: retira los que ponen pegas
+        (sus cabezas pasan a los modelos por separado) y recupera los que ya
+        no las ponen. Descarga los modelos que se quedan sin rutas.
+        """
+        for name, spec in self.specs.items():
+            if spec.validate is None:
+                continue
+            problems = spec.validate()
+            if problems and name not in self._disabled:
+                print(f"Modelo {name} retirado ({'; '.join(problems)}): se usan los modelos por separado.")
+                self._disabled.add(name)
+                self.routes = self._build_routes()
+                for head in spec.heads:
+                    if head.name in self.specs:
+                        self.load(head.name, warmup=True, trigger="update")
+            elif not problems and name in self._disabled:
+                # Se activa solo si carga: hasta entonces siguen los modelos por separado
+                if self.load(name, warmup=True, trigger="update") is not None:
+                    print(f"Modelo {name} verificado: vuelve a atender {', '.join(h.name for h in spec.heads)}.")
+                    self._disabled.discard(name)
+                    self.routes = self._build_routes()
+        serving = self.serving()
+        for name in list(self._active):
+            if name not in serving:
+                # Con peticiones en curso no se descarga; se reintenta en la siguiente comprobación
+                self.residency.retire(name)
+
+    def start_watching(self, interval):
+        """Arranca el hilo que vigila los ficheros de los modelos cada `interval` segundos."""
+        if interval <= 0 or (self._watch_thread is not None and self._watch_thread.is_alive()):
+            return
+        self._stop.clear()
+
+        def _watch_loop():
+            seen = {}
+            while not self._stop.wait(interval):
+                try:
+                    seen = self.check_for_updates(seen)
+                except Exception as e:
+                    print(f"Error vigilando los ficheros de los modelos: {e}")
+
+        self._watch_thread = threading.Thread(target=_watch_loop, name="model-watch", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watch_thread is not None:
+            self._watch_thread.join(timeout=5)
+            self._watch_thread = None
+
+    # --- Inferencia ---
+
+    def _batch_predict_fn(self, name):
+        def _predict(batch):
+            # La versión se toma una vez por lote: una sustitución o descarga a
+            # mitad del forward pass no afecta a este lote
+            self.residency.begin(name, len(batch))
+            try:
+                model = self.get(name)
+                if model is None:
+                    raise RuntimeError(f"El modelo {name} no está cargado.")
+                return _VersionedOutput(model.predict(batch), model.version)
+            finally:
+                self.residency.end(name)
+        return _predict
+
+    @staticmethod
+    def _postprocess_fn(spec):
+        def _postprocess(item):
+            pred, version = item
+            if spec.output == "multihead":
+                return {head: (*result, version) for head, result in spec.postprocess(pred).items()}
+            pred_label, probabilities = spec.postprocess(pred)
+            return pred_label, probabilities, version
+        return _postprocess
+
+    def submit(self, names, img_array):
+        """
+        Encola un tensor (1, H, W, C) para varios modelos o cabezas. Devuelve
+        nombre -> Future de (etiqueta, probs, versión), con un único envío por
+        modelo del registro.
+        """
+        futures = {}
+        batches = {}
+        for name in names:
+            model, head = self.routes[name]
+            if model not in batches:
+                batches[model] = self.batchers[model].submit(img_array)
+            futures[name] = batches[model] if head is None else _HeadFuture(batches[model], head)
+        return futures
+
+    def predict_batch(self, name, batch):
+        """Forward pass directo de un lote (sin micro-batching). Devuelve [(etiqueta, probs, versión)]."""
+        rows = self.predict_many([name], batch)[name]
+        if isinstance(rows, Exception):
+            raise rows
+        return rows
+
+    def predict_many(self, names, batch):
+        """
+        Como `predict_batch` para varios modelos o cabezas, con un forward pass
+        por modelo del registro. Devuelve nombre -> filas, o la excepción si
+        ese modelo falló.
+        """
+        outputs = {}
+        results = {}
+        for name in names:
+            model, head = self.routes[name]
+            if model not in outputs:
+                batcher = self.batchers[model]
+                try:
+                    output = batcher.predict_fn(batch)
+                    outputs[model] = [batcher.postprocess_fn(output[i]) for i in range(len(batch))]
+                except Exception as e:
+                    outputs[model] = e
+            rows = outputs[model]
+            if isinstance(rows, Exception) or head is None:
+                results[name] = rows
+            else:
+                results[name] = [row[head] for row in rows]
+        return results
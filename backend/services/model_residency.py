@@ -0,0 +1,254 @@
+import gc
+import os
+import threading
+import time
+
+from backend.services.metrics import MODEL_RESIDENT, MODEL_MEMORY_BYTES, MODEL_EVICTIONS, MODEL_RELOAD_SECONDS
+
+# Días de histórico por hora usados para predecir la demanda
+_HISTORY_DAYS = 7
+
+
+class _DemandHistory:
+    """Peticiones por modelo y hora del día durante los últimos días."""
+
+    def __init__(self, days=_HISTORY_DAYS):
+        self.days = days
+        self._counts = {}  # modelo -> {(día, hora): peticiones}
+        self._first_day = {}
+
+    @staticmethod
+    def _slot(now):
+        t = time.localtime(now)
+        # Día en hora local, para que las horas de un mismo día no se partan a medianoche UTC
+        return int((now + t.tm_gmtoff) // 86400), t.tm_hour
+
+    def record(self, name, n, now):
+        day, hour = self._slot(now)
+        counts = self._counts.setdefault(name, {})
+        counts[(day, hour)] = counts.get((day, hour), 0) + n
+        self._first_day.setdefault(name, day)
+        for key in [k for k in counts if k[0] <= day - self.days]:
+            del counts[key]
+
+    def expected(self, name, now):
+        """Media de peticiones en esta misma hora en los días anteriores."""
+        day, hour = self._slot(now)
+        counts = self._counts.get(name)
+        if not counts:
+            return 0.0
+        days = min(self.days, day - self._first_day[name])
+        if days <= 0:
+            return 0.0
+        total = sum(counts.get((day - d, hour), 0) for d in range(1, days + 1))
+        return total / days
+
+
+class ResidencyManager:
+    """
+    Decide qué modelos de un `ModelRegistry` permanecen en memoria.
+
+    Cada versión cargada se mide con `memory_bytes()` de su backend (o el
+    tamaño del fichero si no lo implementa). Cuando la suma supera el
+    presupuesto se descargan los modelos ociosos (sin lotes en curso y sin uso
+    en `min_idle_seconds`) empezando por el menos usado recientemente. Con
+    `idle_seconds` se descargan además los que llevan ese tiempo sin uso. Un
+    modelo descargado se recarga bajo demanda en la siguiente petición, o
+    antes si la precarga predice tráfico para la hora actual.
+
+    Descargar solo suelta la referencia a la versión: los lotes en curso que
+    ya la tomaron terminan con ella y la memoria se libera al acabar.
+    """
+
+    def __init__(self, registry, budget_bytes=0, idle_seconds=0, min_idle_seconds=30, prewarm_min_requests=0):
+        self.registry = registry
+        self.budget_bytes = int(budget_bytes)
+        self.idle_seconds = float(idle_seconds)
+        self.min_idle_seconds = float(min_idle_seconds)
+        self.prewarm_min_requests = float(prewarm_min_requests)
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._last_used = {}
+        self._in_flight = {}
+        self._evicted = set()
+        self._evictions = {}
+        self._reloads = {}
+        self._demand = _DemandHistory()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.budget_bytes > 0 or self.idle_seconds > 0
+
+    # --- Uso de los modelos ---
+
+    def begin(self, name, n=1):
+        """Marca el inicio de un lote de `n` imágenes: el modelo no se descarga hasta `end`."""
+        now = time.time()
+        with self._lock:
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+            self._last_used[name] = now
+            self._demand.record(name, n, now)
+
+    def end(self, name):
+        with self._lock:
+            self._in_flight[name] -= 1
+
+    # --- Carga y descarga ---
+
+    def on_loaded(self, name, model, trigger="demand", seconds=None):
+        """Registra una versión recién activada y aplica el presupuesto al resto."""
+        try:
+            footprint = int(model.backend.memory_bytes())
+        except (AttributeError, TypeError, ValueError, RuntimeError) as e:
+            footprint = os.path.getsize(model.spec.artifact_path)
+            print(f"No se pudo medir la memoria del modelo {name} ({e}): se usa el tamaño del fichero ({footprint} bytes).")
+        with self._lock:
+            self._memory[name] = footprint
+            # La carga cuenta como uso: un modelo recién precargado no se descarga enseguida
+            self._last_used[name] = time.time()
+            reloaded = name in self._evicted
+            self._evicted.discard(name)
+            if reloaded:
+                self._reloads[name] = self._reloads.get(name, 0) + 1
+        if reloaded and seconds is not None:
+            MODEL_RELOAD_SECONDS.observe(seconds, model=name, trigger=trigger)
+        MODEL_RESIDENT.set(1, model=name)
+        MODEL_MEMORY_BYTES.set(footprint, model=name)
+        self.enforce_budget(keep=name)
+        return footprint
+
+    def _idle_candidates(self, now, min_idle, keep=None):
+        """Modelos cargados sin lotes en curso ni uso reciente, del menos al más usado recientemente."""
+        candidates = [
+            name for name in self.registry.resident()
+            if name != keep and not self._in_flight.get(name)
+            and now - self._last_used.get(name, 0) >= min_idle
+        ]
+        return sorted(candidates, key=lambda name: self._last_used.get(name, 0))
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(self._memory.get(name, 0) for name in self.registry.resident())
+
+    def enforce_budget(self, keep=None):
+        """Descarga modelos ociosos (LRU) hasta volver al presupuesto. Devuelve los descargados."""
+        if self.budget_bytes <= 0:
+            return []
+        evicted = []
+        with self._lock:
+            used = sum(self._memory.get(name, 0) for name in self.registry.resident())
+            if used <= self.budget_bytes:
+                return []
+            candidates = self._idle_candidates(time.time(), self.min_idle_seconds, keep)
+        for name in candidates:
+            if used <= self.budget_bytes:
+                break
+            if self._evict(name, "budget"):
+                used -= self._memory.get(name, 0)
+                evicted.append(name)
+        if used > self.budget_bytes:
+            print(f"Modelos por encima del presupuesto de memoria ({used} > {self.budget_bytes} bytes): "
+                  f"ningún otro modelo está ocioso.")
+        return evicted
+
+    def evict_idle(self):
+        """Descarga los modelos sin uso durante `idle_seconds`."""
+        if self.idle_seconds <= 0:
+            return []
+        with self._lock:
+            candidates = self._idle_candidates(time.time(), self.idle_seconds)
+        return [name for name in candidates if self._evict(name, "idle")]
+
+    def _evict(self, name, reason):
+        with self._lock:
+            if self._in_flight.get(name):
+                return False
+        if not self.registry.unload(name):
+            return False
+        with self._lock:
+            self._evicted.add(name)
+            self._evictions[name] = self._evictions.get(name, 0) + 1
+        MODEL_RESIDENT.set(0, model=name)
+        MODEL_MEMORY_BYTES.set(0, model=name)
+        MODEL_EVICTIONS.inc(model=name, reason=reason)
+        print(f"Modelo {name} descargado de memoria ({reason}).")
+        gc.collect()
+        return True
+
+    def retire(self, name):
+        """Descarga un modelo que ya no atiende peticiones; no se vuelve a precargar."""
+        if not self._evict(name, "retired"):
+            return False
+        with self._lock:
+            self._evicted.discard(name)
+        return True
+
+    def prewarm(self):
+        """Recarga los modelos descargados para los que se espera tráfico en la hora actual."""
+        if self.prewarm_min_requests <= 0:
+            return []
+        now = time.time()
+        with self._lock:
+            due = [name for name in self._evicted if self._demand.expected(name, now) >= self.prewarm_min_requests]
+        loaded = []
+        for name in due:
+            if self.registry.load(name, warmup=True, trigger="prewarm") is not None:
+                loaded.append(name)
+        return loaded
+
+    # --- Hilo de mantenimiento ---
+
+    def maintain(self):
+        self.evict_idle()
+        self.enforce_budget()
+        self.prewarm()
+
+    def start(self, interval):
+        """Arranca el hilo que aplica la política cada `interval` segundos (si hay alguna activa)."""
+        if interval <= 0 or not (self.enabled or self.prewarm_min_requests > 0):
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def _loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.maintain()
+                except Exception as e:
+                    print(f"Error gestionando la residencia de los modelos: {e}")
+
+        self._thread = threading.Thread(target=_loop, name="model-residency", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        now = time.time()
+        resident = set(self.registry.resident())
+        with self._lock:
+            models = {
+                name: {
+                    "resident": name in resident,
+                    "memory_bytes": self._memory.get(name, 0) if name in resident else 0,
+                    "in_flight": self._in_flight.get(name, 0),
+                    "idle_seconds": round(now - self._last_used[name], 1) if name in self._last_used else None,
+                    "evictions": self._evictions.get(name, 0),
+                    "reloads": self._reloads.get(name, 0),
+                    "expected_requests_this_hour": round(self._demand.expected(name, now), 2),
+                }
+                for name in self.registry.specs
+            }
+        return {
+            "budget_bytes": self.budget_bytes,
+            "resident_bytes": sum(m["memory_bytes"] for m in models.values()),
+            "idle_evict_seconds": self.idle_seconds,
+            "prewarm_min_requests": self.prewarm_min_requests,
+            "models": models,
+        }
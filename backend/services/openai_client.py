@@ -0,0 +1,187 @@
+import asyncio
+import json
+import random
+import re
+
+from backend.config.model_config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL, OPENAI_MAX_TOKENS,
+    OPENAI_TIMEOUT_SECONDS, OPENAI_CONNECT_TIMEOUT_SECONDS,
+    OPENAI_MAX_CONCURRENCY, OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_RETRIES, OPENAI_RETRY_BACKOFF_SECONDS,
+)
+from backend.services.metrics import OPENAI_REQUESTS
+
+# Tope de la espera entre reintentos, aunque OpenAI pida más con Retry-After
+_MAX_RETRY_DELAY_SECONDS = 10.0
+
+
+class OpenAIServiceError(Exception):
+    """Error de la llamada a OpenAI ya traducido a un código HTTP para el cliente."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class OpenAIClient:
+    """
+    Cliente asíncrono de OpenAI compartido por todo el proceso.
+
+    Mantiene un único AsyncOpenAI con un pool httpx de conexiones keep-alive,
+    timeouts por intento, un semáforo que limita las llamadas simultáneas y
+    reintentos acotados con backoff exponencial y jitter ante errores
+    transitorios. Los reintentos del SDK se desactivan para que el límite de
+    concurrencia cubra también las esperas entre intentos.
+
+    El SDK se importa en `start()` (lanzado en segundo plano desde el lifespan)
+    para no retrasar el arranque; `chat()` lo inicia si aún no está listo.
+    """
+
+    def __init__(self, api_key=None, base_url=None, model="gpt-4o", max_tokens=500,
+                 timeout=30.0, connect_timeout=5.0, max_concurrency=16, max_connections=16,
+                 max_retries=2, retry_backoff=0.5):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_connections = max(1, int(max_connections))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_backoff = retry_backoff
+        self._client = None
+        self._openai = None
+        self._start_lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+
+    async def start(self):
+        """Crea el cliente y su pool de conexiones (idempotente)."""
+        if self._client is not None:
+            return
+        async with self._start_lock:
+            if self._client is not None:
+                return
+            # Importación en un hilo: el SDK tarda en importarse y no debe bloquear el loop
+            openai, httpx = await asyncio.to_thread(_import_sdk)
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            )
+            self._openai = openai
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key or "sin-configurar",
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0,
+            )
+
+    async def close(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.close()
+
+    def _is_retryable(self, error):
+        openai = self._openai
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    def _retry_delay(self, error, attempt):
+        delay = self.retry_backoff * (2 ** attempt)
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return min(delay, _MAX_RETRY_DELAY_SECONDS) * random.uniform(0.8, 1.2)
+
+    def _to_service_error(self, error):
+        openai = self._openai
+        if isinstance(error, openai.APITimeoutError):
+            return OpenAIServiceError(504, "OpenAI no respondió a tiempo.")
+        if isinstance(error, openai.RateLimitError):
+            return OpenAIServiceError(503, "OpenAI está saturado, intenta nuevamente en unos segundos.")
+        if isinstance(error, openai.AuthenticationError):
+            return OpenAIServiceError(503, "El servicio de OpenAI no está configurado.")
+        return OpenAIServiceError(502, "Error al consultar OpenAI.")
+
+    async def chat(self, messages, max_tokens=None):
+        """Devuelve el texto de la primera respuesta de un chat completion."""
+        if not self.api_key:
+            raise OpenAIServiceError(503, "El servicio de OpenAI no está configurado.")
+        await self.start()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self._client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=max_tokens or self.max_tokens,
+                    )
+                except self._openai.OpenAIError as e:
+                    if attempt < self.max_retries and self._is_retryable(e):
+                        OPENAI_REQUESTS.inc(outcome="retry")
+                        delay = self._retry_delay(e, attempt)
+                        print(f"OpenAI: {type(e).__name__}, reintento {attempt + 1} en {delay:.2f}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    OPENAI_REQUESTS.inc(outcome="error")
+                    raise self._to_service_error(e) from e
+                OPENAI_REQUESTS.inc(outcome="ok")
+                return response.choices[0].message.content
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "started": self._client is not None,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+        }
+
+
+def parse_json_response(content):
+    """Extrae el JSON de la respuesta del modelo (quitando bloques ```json), o None si no es válido."""
+    content = re.sub(r"^```json|^```|```$", "", content.strip(), flags=re.MULTILINE).strip()
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+def _import_sdk():
+    import httpx
+    import openai
+    return openai, httpx
+
+
+# Cliente compartido por los endpoints de OpenAI
+openai_client = OpenAIClient(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    model=OPENAI_MODEL,
+    max_tokens=OPENAI_MAX_TOKENS,
+    timeout=OPENAI_TIMEOUT_SECONDS,
+    connect_timeout=OPENAI_CONNECT_TIMEOUT_SECONDS,
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    max_connections=OPENAI_MAX_CONNECTIONS,
+    max_retries=OPENAI_MAX_RETRIES,
+    retry_backoff=OPENAI_RETRY_BACKOFF_SECONDS,
+)
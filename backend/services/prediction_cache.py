@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from backend.config.model_config import (
+    PREDICTION_CACHE_BACKEND, PREDICTION_CACHE_PATH, PREDICTION_CACHE_MAX_ENTRIES,
+    PREDICTION_CACHE_MAX_BYTES, PREDICTION_CACHE_TTL_SECONDS,
+)
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """SHA-256 del contenido subido; se calcula una vez por petición."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def prediction_cache_key(model_name: str, model_version: str, digest: str) -> str:
+    return f"{model_name}:{model_version}:{digest}"
+
+
+def _encode(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _decode(raw: str):
+    value = json.loads(raw)
+    # Las predicciones se guardan como (etiqueta, probabilidades)
+    return tuple(value) if isinstance(value, list) else value
+
+
+class _CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def incr(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class MemoryPredictionCache:
+    """Caché LRU en memoria del proceso con TTL y presupuesto de entradas y bytes."""
+
+    backend = "memory"
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self._data = OrderedDict()  # key -> (expira, tamaño, valor)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = _CacheStats()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                self._remove(key)
+                self._stats.incr("expirations")
+                entry = None
+            if entry is None:
+                self._stats.incr("misses")
+                return None
+            self._data.move_to_end(key)
+        self._stats.incr("hits")
+        return entry[2]
+
+    def set(self, key, value):
+        size = len(_encode(value).encode("utf-8")) + len(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self._stats.incr("evictions")
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            entries, size = len(self._data), self._bytes
+        return {
+            "backend": self.backend,
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            **self._stats.as_dict(),
+        }
+
+
+class SQLitePredictionCache:
+    """
+    Caché en un fichero SQLite compartido por todos los workers de uvicorn del
+    mismo host. Usa modo WAL para que las lecturas no bloqueen a los escritores
+    y desaloja por último acceso (LRU) cuando se supera el presupuesto.
+
+    Los contadores de aciertos/fallos son locales a cada worker.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl_seconds=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self._local = threading.local()
+        self._stats = _CacheStats()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions(accessed)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires FROM predictions WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] <= now:
+            conn.execute("DELETE FROM predictions WHERE key = ?", (key,))
+            self._stats.incr("expirations")
+            row = None
+        if row is None:
+            self._stats.incr("misses")
+            return None
+        conn.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (now, key))
+        self._stats.incr("hits")
+        return _decode(row[0])
+
+    def set(self, key, value):
+        raw = _encode(value)
+        size = len(raw.encode("utf-8")) + len(key)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, size, now + self.ttl, now),
+            )
+            expired = conn.execute("DELETE FROM predictions WHERE expires <= ?", (now,)).rowcount
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions").fetchone()
+            evicted = 0
+            while entries > self.max_entries or total > self.max_bytes:
+                row = conn.execute("SELECT key, size FROM predictions ORDER BY accessed LIMIT 1").fetchone()
+                if row is None:
+                    break
+                conn.execute("DELETE FROM predictions WHERE key = ?", (row[0],))
+                entries -= 1
+                total -= row[1]
+                evicted += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if expired:
+            self._stats.incr("expirations", expired)
+        if evicted:
+            self._stats.incr("evictions", evicted)
+
+    def clear(self):
+        self._connect().execute("DELETE FROM predictions")
+
+    def stats(self):
+        entries, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM predictions"
+        ).fetchone()
+        return {
+            "backend": self.backend,
+            "path": self.path,
+            "entries": entries,
+            "bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            **self._stats.as_dict(),
+        }
+
+
+class NullPredictionCache:
+    """Caché desactivada (PREDICTION_CACHE_BACKEND=none)."""
+
+    backend = "none"
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.backend}
+
+
+def create_prediction_cache(backend=PREDICTION_CACHE_BACKEND):
+    if backend == "none":
+        return NullPredictionCache()
+    if backend == "sqlite":
+        return SQLitePredictionCache(
+            PREDICTION_CACHE_PATH, PREDICTION_CACHE_MAX_ENTRIES,
+            PREDICTION_CACHE_MAX_BYTES, PREDICTION_CACHE_TTL_SECONDS,
+        )
+    if backend == "memory":
+        return MemoryPredictionCache(
+            PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_MAX_BYTES, PREDICTION_CACHE_TTL_SECONDS,
+        )
+    raise ValueError(f"Backend de caché no soportado: {backend}")
+
+
+# Caché compartida por los tres modelos
+prediction_cache = create_prediction_cache()
@@ -0,0 +1,259 @@
+"""
+Perfilado bajo demanda de peticiones de análisis.
+
+Una petición se perfila si trae la cabecera `PROFILING_HEADER` junto con el
+token de administración (`X-Admin-Token`), o al azar según
+`PROFILING_SAMPLE_PERCENT`. La función de inferencia de esa petición se
+ejecuta bajo cProfile en el worker del executor y, mientras dura, el servicio
+de análisis evita la caché y hace el forward pass en el mismo hilo en lugar
+de en el batcher, para que el perfil lo incluya; con la traza de TensorFlow
+pedida ("X-Profile: tf") ese forward pass se registra también con el profiler
+de TensorFlow.
+
+Cada captura es un directorio en `PROFILING_DIR` con el perfil binario
+(perfil.prof, para snakeviz o pstats), un resumen en texto, la traza de
+TensorFlow si la hay y captura.json con los metadatos. Se conservan las
+`PROFILING_MAX_RETAINED` más recientes.
+
+cProfile y el profiler de TensorFlow son globales al proceso, así que solo se
+perfila una petición a la vez: si ya hay otra en curso, la petición se
+atiende sin perfilar.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from functools import partial
+
+from backend.config.model_config import (
+    get_tensorflow, PROFILING_ADMIN_TOKEN, PROFILING_HEADER, PROFILING_SAMPLE_PERCENT,
+    PROFILING_SAMPLED_TF_TRACE, PROFILING_DIR, PROFILING_MAX_RETAINED,
+)
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+_METADATA_FILE = "captura.json"
+_CAPTURE_ID = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{8}$")
+
+# Una sola captura a la vez por proceso (cProfile y el profiler de TF son globales)
+_ACTIVE_LOCK = threading.Lock()
+_PRUNE_LOCK = threading.Lock()
+_local = threading.local()
+
+
+class ProfileCapture:
+    """Una petición perfilada. Se envía al executor, así que solo guarda datos simples."""
+
+    def __init__(self, root, max_retained, endpoint, trigger, tf_trace):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.root = root
+        self.max_retained = max_retained
+        self.endpoint = endpoint
+        self.trigger = trigger
+        self.tf_trace = tf_trace
+        self.created_at = time.time()
+        # Detalles que añade el servicio de análisis (modelos, versiones...)
+        self.notes = {}
+
+    @property
+    def path(self):
+        return os.path.join(self.root, self.id)
+
+
+def current_capture():
+    """Captura activa en el hilo actual, o None si la petición no se está perfilando."""
+    return getattr(_local, "capture", None)
+
+
+@contextmanager
+def tf_trace(capture):
+    """Traza del profiler de TensorFlow del bloque si `capture` la pidió."""
+    if capture is None or not capture.tf_trace:
+        yield
+        return
+    tf = get_tensorflow()
+    started = False
+    try:
+        tf.profiler.experimental.start(os.path.join(capture.path, "tf"))
+        started = True
+    except Exception as e:
+        print(f"No se pudo iniciar la traza de TensorFlow: {e}")
+        capture.notes["tf_trace_error"] = str(e)
+    try:
+        yield
+    finally:
+        if started:
+            try:
+                tf.profiler.experimental.stop()
+                capture.notes["tf_trace"] = True
+            except Exception as e:
+                print(f"No se pudo guardar la traza de TensorFlow: {e}")
+                capture.notes["tf_trace_error"] = str(e)
+
+
+def run_profiled(capture, fn, *args):
+    """Ejecuta `fn(*args)` bajo cProfile y guarda la captura (en el worker del executor)."""
+    if not _ACTIVE_LOCK.acquire(blocking=False):
+        return fn(*args)
+    profile = cProfile.Profile()
+    error = None
+    start = time.perf_counter()
+    _local.capture = capture
+    try:
+        os.makedirs(capture.path, exist_ok=True)
+        profile.enable()
+        try:
+            return fn(*args)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            profile.disable()
+    finally:
+        _local.capture = None
+        _ACTIVE_LOCK.release()
+        try:
+            _save(capture, profile, time.perf_counter() - start, error)
+        except Exception as e:
+            print(f"Error guardando el perfil {capture.id}: {e}")
+
+
+def _save(capture, profile, seconds, error):
+    profile.dump_stats(os.path.join(capture.path, "perfil.prof"))
+    summary = io.StringIO()
+    stats = pstats.Stats(profile, stream=summary)
+    stats.sort_stats("cumulative").print_stats(60)
+    stats.sort_stats("tottime").print_stats(30)
+    with open(os.path.join(capture.path, "perfil.txt"), "w", encoding="utf-8") as f:
+        f.write(summary.getvalue())
+    metadata = {
+        "id": capture.id,
+        "endpoint": capture.endpoint,
+        "trigger": capture.trigger,
+        "created_at": capture.created_at,
+        "seconds": seconds,
+        "error": error,
+        **capture.notes,
+    }
+    # Los metadatos se escriben al final: un directorio sin ellos es una captura a medias
+    with open(os.path.join(capture.path, _METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    _prune(capture.root, capture.max_retained)
+
+
+def _prune(root, max_retained):
+    with _PRUNE_LOCK:
+        captures = sorted(
+            (entry for entry in os.scandir(root) if entry.is_dir() and _CAPTURE_ID.match(entry.name)),
+            key=lambda entry: entry.name, reverse=True,
+        )
+        for entry in captures[max(0, max_retained):]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class RequestProfiler:
+    """Decide qué peticiones se perfilan y da acceso a las capturas guardadas."""
+
+    def __init__(self, directory, max_retained=20, admin_token="", header="X-Profile",
+                 sample_percent=0.0, sampled_tf_trace=False):
+        self.directory = directory
+        self.max_retained = max_retained
+        self.admin_token = admin_token
+        self.header = header
+        self.sample_percent = sample_percent
+        self.sampled_tf_trace = sampled_tf_trace
+
+    def is_admin(self, request):
+        token = request.headers.get(ADMIN_TOKEN_HEADER, "")
+        return bool(self.admin_token) and hmac.compare_digest(token.encode("utf-8"), self.admin_token.encode("utf-8"))
+
+    def capture_for(self, request, endpoint):
+        """`ProfileCapture` si hay que perfilar la petición, o None."""
+        requested = request.headers.get(self.header)
+        if requested and self.is_admin(request):
+            trigger, with_tf = "admin", requested.strip().lower() == "tf"
+        elif self.sample_percent > 0 and random.random() * 100.0 < self.sample_percent:
+            trigger, with_tf = "sampled", self.sampled_tf_trace
+        else:
+            return None
+        capture = ProfileCapture(self.directory, self.max_retained, endpoint, trigger, with_tf)
+        # Id de la captura prevista: el middleware HTTP solo lo devuelve en la
+        # cabecera X-Profile-Id si la captura llegó a guardarse (no se guarda
+        # si había otra en curso o si la petición no llegó a inferir)
+        request.state.profile_id = capture.id
+        return capture
+
+    def wrap(self, request, fn, endpoint=None):
+        """`fn` tal cual o envuelta para perfilarse al ejecutarse en el executor."""
+        capture = self.capture_for(request, endpoint or request.url.path)
+        if capture is None:
+            return fn
+        return partial(run_profiled, capture, fn)
+
+    def list(self):
+        """Metadatos de las capturas guardadas, de la más reciente a la más antigua."""
+        captures = []
+        try:
+            entries = sorted(os.listdir(self.directory), reverse=True)
+        except OSError:
+            return captures
+        for name in entries:
+            if not _CAPTURE_ID.match(name):
+                continue
+            try:
+                with open(os.path.join(self.directory, name, _METADATA_FILE), encoding="utf-8") as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return captures
+
+    def _capture_path(self, capture_id):
+        if not _CAPTURE_ID.match(capture_id):
+            return None
+        path = os.path.join(self.directory, capture_id)
+        return path if os.path.exists(os.path.join(path, _METADATA_FILE)) else None
+
+    def exists(self, capture_id):
+        return self._capture_path(capture_id) is not None
+
+    def summary(self, capture_id):
+        """Resumen en texto del perfil, o None si no existe la captura."""
+        path = self._capture_path(capture_id)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, "perfil.txt"), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def archive(self, capture_id):
+        """Zip con todos los ficheros de la captura (perfil y traza de TF), o None si no existe."""
+        path = self._capture_path(capture_id)
+        if path is None:
+            return None
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for folder, _, files in os.walk(path):
+                for filename in files:
+                    full = os.path.join(folder, filename)
+                    archive.write(full, os.path.join(capture_id, os.path.relpath(full, path)))
+        return buffer.getvalue()
+
+
+# Perfilado de peticiones del proceso
+request_profiler = RequestProfiler(
+    PROFILING_DIR, max_retained=PROFILING_MAX_RETAINED, admin_token=PROFILING_ADMIN_TOKEN,
+    header=PROFILING_HEADER, sample_percent=PROFILING_SAMPLE_PERCENT,
+    sampled_tf_trace=PROFILING_SAMPLED_TF_TRACE,
+)
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from backend.config.model_config import (
+    RECOMMENDATION_CACHE_BACKEND, RECOMMENDATION_CACHE_PATH,
+    RECOMMENDATION_CACHE_TTL_SECONDS, RECOMMENDATION_CACHE_STALE_SECONDS,
+)
+from backend.services.openai_client import openai_client, parse_json_response
+from backend.services.skin_analysis_service import (
+    LUNARES_CLASS_LABELS, ACNE_CLASS_LABELS, ROSACEA_CLASS_LABELS,
+)
+
+# Subir la versión al cambiar el prompt para no servir respuestas del prompt anterior
+RECOMMENDATION_PROMPT_VERSION = "1"
+
+RECOMMENDATION_FALLBACK = {
+    "descripcion": "No se pudo generar la descripción.",
+    "recomendaciones": ["No se pudieron generar recomendaciones. Intenta nuevamente."]
+}
+
+
+def normalize_label(prediccion: str) -> str:
+    """Minúsculas, sin tildes y con los espacios colapsados: 'Con  Acné ' -> 'con acne'."""
+    text = unicodedata.normalize("NFKD", prediccion.strip().casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+# Etiquetas que devuelven los modelos; solo estas se guardan en la caché para
+# que texto libre enviado por clientes no la llene
+KNOWN_LABELS = {
+    normalize_label(label): label
+    for labels in (LUNARES_CLASS_LABELS, ACNE_CLASS_LABELS, ROSACEA_CLASS_LABELS)
+    for label in labels.values()
+}
+
+
+def recommendation_cache_key(prediccion: str) -> str:
+    return f"v{RECOMMENDATION_PROMPT_VERSION}:{normalize_label(prediccion)}"
+
+
+def build_recommendation_messages(prediccion: str):
+    prompt = (
+        f"Tengo un paciente con la siguiente condición dermatológica: '{prediccion}'. "
+        "Dame una breve descripción educativa de la condición detectada y 5 recomendaciones para el paciente. "
+        "Responde en formato JSON con los campos 'descripcion' (string) y 'recomendaciones' (lista de strings)."
+    )
+    return [
+        {"role": "system", "content": "Eres un dermatólogo experto."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+async def fetch_recommendations(prediccion: str):
+    """Pide las recomendaciones a OpenAI. Devuelve (resultado, se_puede_guardar)."""
+    content = await openai_client.chat(build_recommendation_messages(prediccion))
+    resultado = parse_json_response(content)
+    if not isinstance(resultado, dict):
+        return dict(RECOMMENDATION_FALLBACK), False
+    return resultado, True
+
+
+class RecommendationCache:
+    """
+    Caché persistente en SQLite de las recomendaciones de OpenAI por condición,
+    con clave versión del prompt + etiqueta normalizada.
+
+    - Antes del TTL la respuesta guardada se sirve directamente.
+    - Entre el TTL y TTL + `stale_seconds` se sirve la respuesta guardada y se
+      refresca en segundo plano (stale-while-revalidate).
+    - Después, o sin entrada, se consulta a OpenAI esperando la respuesta.
+
+    Las consultas concurrentes de una misma etiqueta comparten una única
+    llamada a OpenAI (single-flight) dentro de cada worker. La llamada está
+    protegida con `asyncio.shield`, así que si un cliente se desconecta los
+    demás siguen esperándola y el resultado se guarda igualmente.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, stale_seconds=30 * 24 * 3600, fetch=fetch_recommendations):
+        self.path = path
+        self.ttl = ttl_seconds
+        self.stale = stale_seconds
+        self._fetch = fetch
+        self._local = threading.local()
+        self._inflight = {}
+        self._stats_lock = threading.Lock()
+        self._counters = {"fresh_hits": 0, "stale_hits": 0, "misses": 0, "uncached": 0,
+                          "upstream_calls": 0, "coalesced": 0, "refresh_errors": 0}
+        # El directorio y la tabla se crean en la primera conexión, no al importar
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _ensure_schema(self):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS recommendations ("
+                    " key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+                )
+            finally:
+                conn.close()
+            self._schema_ready = True
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not self._schema_ready:
+                self._ensure_schema()
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _incr(self, field):
+        with self._stats_lock:
+            self._counters[field] += 1
+
+    def _read(self, key):
+        row = self._connect().execute(
+            "SELECT value, created FROM recommendations WHERE key = ?", (key,)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def _write(self, key, value):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO recommendations (key, value, created) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+
+    async def _fetch_and_store(self, key, prediccion):
+        self._incr("upstream_calls")
+        resultado, cacheable = await self._fetch(prediccion)
+        if cacheable:
+            await asyncio.to_thread(self._write, key, resultado)
+        return resultado
+
+    def _single_flight(self, key, prediccion):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(key, prediccion))
+            self._inflight[key] = task
+
+            def _done(task):
+                self._inflight.pop(key, None)
+                # Marcar el error como recuperado aunque todos los que esperaban se hayan ido
+                if not task.cancelled():
+                    task.exception()
+
+            task.add_done_callback(_done)
+        else:
+            self._incr("coalesced")
+        return task
+
+    def _refresh_in_background(self, key, prediccion):
+        if key in self._inflight:
+            return
+
+        def _log_error(task):
+            if not task.cancelled() and task.exception() is not None:
+                self._incr("refresh_errors")
+                print(f"Error al refrescar las recomendaciones de '{prediccion}': {task.exception()}")
+
+        self._single_flight(key, prediccion).add_done_callback(_log_error)
+
+    async def get(self, prediccion: str):
+        """Recomendaciones para `prediccion`, desde la caché o desde OpenAI."""
+        label = KNOWN_LABELS.get(normalize_label(prediccion))
+        if label is None:
+            self._incr("uncached")
+            resultado, _ = await self._fetch(prediccion)
+            return resultado
+        # Preguntar siempre con la etiqueta canónica: la respuesta se comparte entre variantes
+        prediccion = label
+        key = recommendation_cache_key(prediccion)
+        entry = await asyncio.to_thread(self._read, key)
+        if entry is not None:
+            resultado, created = entry
+            age = time.time() - created
+            if age < self.ttl:
+                self._incr("fresh_hits")
+                return resultado
+            if age < self.ttl + self.stale:
+                self._incr("stale_hits")
+                self._refresh_in_background(key, prediccion)
+                return resultado
+        self._incr("misses")
+        return await asyncio.shield(self._single_flight(key, prediccion))
+
+    async def refresh(self, prediccion: str):
+        """
+        Consulta OpenAI y reemplaza la entrada, aunque siga vigente
+        (pre-calentamiento). Solo admite etiquetas de los modelos, como `get`.
+        """
+        label = KNOWN_LABELS.get(normalize_label(prediccion))
+        if label is None:
+            raise ValueError(f"Etiqueta desconocida: {prediccion}")
+        prediccion = label
+        return await asyncio.shield(self._single_flight(recommendation_cache_key(prediccion), prediccion))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM recommendations")
+
+    def stats(self):
+        now = time.time()
+        total, fresh = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(created > ?), 0) FROM recommendations WHERE key LIKE ?",
+            (now - self.ttl, f"v{RECOMMENDATION_PROMPT_VERSION}:%"),
+        ).fetchone()
+        with self._stats_lock:
+            counters = dict(self._counters)
+        return {
+            "backend": self.backend,
+            "path": self.path,
+            "prompt_version": RECOMMENDATION_PROMPT_VERSION,
+            "entries": total,
+            "fresh_entries": fresh,
+            "known_labels": len(KNOWN_LABELS),
+            "ttl_seconds": self.ttl,
+            "stale_seconds": self.stale,
+            "inflight": len(self._inflight),
+            **counters,
+        }
+
+
+class NullRecommendationCache:
+    """Caché desactivada (RECOMMENDATION_CACHE_BACKEND=none): siempre consulta a OpenAI."""
+
+    backend = "none"
+
+    def __init__(self, fetch=fetch_recommendations):
+        self._fetch = fetch
+
+    async def get(self, prediccion: str):
+        resultado, _ = await self._fetch(prediccion)
+        return resultado
+
+    async def refresh(self, prediccion: str):
+        return await self.get(prediccion)
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.backend, "prompt_version": RECOMMENDATION_PROMPT_VERSION}
+
+
+def create_recommendation_cache(backend=RECOMMENDATION_CACHE_BACKEND):
+    if backend == "none":
+        return NullRecommendationCache()
+    if backend == "sqlite":
+        return RecommendationCache(
+            RECOMMENDATION_CACHE_PATH, RECOMMENDATION_CACHE_TTL_SECONDS, RECOMMENDATION_CACHE_STALE_SECONDS,
+        )
+    raise ValueError(f"Backend de caché de recomendaciones no soportado: {backend}")
+
+
+recommendation_cache = create_recommendation_cache()
+
+
+async def get_recommendations(prediccion: str):
+    return await recommendation_cache.get(prediccion)
@@ -0,0 +1,248 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from backend.config.model_config import (
+    RESULT_STORE_BACKEND, RESULT_STORE_PATH, RESULT_STORE_MAX_ENTRIES,
+    RESULT_STORE_TTL_SECONDS, RESULT_STORE_EXPIRY_INTERVAL_SECONDS,
+)
+
+
+def encode_record(record) -> bytes:
+    """JSON compacto comprimido con zlib; las etiquetas de probabilidades se repiten mucho."""
+    raw = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6)
+
+
+def decode_record(blob: bytes):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class _ResultStoreBase:
+    """Interfaz común: `put` devuelve un id, `get` lo resuelve o devuelve None."""
+
+    def __init__(self, ttl_seconds, expiry_interval):
+        self.ttl = ttl_seconds
+        self.expiry_interval = expiry_interval
+        self._expiry_thread = None
+        self._stop = threading.Event()
+
+    def new_id(self):
+        return str(uuid.uuid4())
+
+    def start_expiry(self):
+        """Arranca el hilo que purga periódicamente los resultados caducados."""
+        if self._expiry_thread is not None and self._expiry_thread.is_alive():
+            return
+        self._stop.clear()
+        self._expiry_thread = threading.Thread(
+            target=self._expiry_loop, name=f"result-store-expiry-{self.backend}", daemon=True
+        )
+        self._expiry_thread.start()
+
+    def stop_expiry(self):
+        self._stop.set()
+        if self._expiry_thread is not None:
+            self._expiry_thread.join(timeout=self.expiry_interval + 1)
+            self._expiry_thread = None
+
+    def _expiry_loop(self):
+        while not self._stop.wait(self.expiry_interval):
+            try:
+                self.purge_expired()
+            except Exception as e:
+                print(f"Error purgando resultados caducados: {e}")
+
+
+class MemoryResultStore(_ResultStoreBase):
+    """Almacén en memoria con tope de capacidad (desaloja los más antiguos) y TTL."""
+
+    backend = "memory"
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600, expiry_interval=60):
+        super().__init__(ttl_seconds, expiry_interval)
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # id -> (expira, registro codificado)
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._expirations = 0
+
+    def put(self, record, result_id=None):
+        result_id = result_id or self.new_id()
+        entry = (time.monotonic() + self.ttl, encode_record(record))
+        with self._lock:
+            self._data[result_id] = entry
+            self._data.move_to_end(result_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self._evictions += 1
+        return result_id
+
+    def get(self, result_id):
+        with self._lock:
+            entry = self._data.get(result_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[result_id]
+                self._expirations += 1
+                return None
+        return decode_record(entry[1])
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            # Las entradas se insertan en orden de caducidad, basta con mirar el principio
+            expired = 0
+            while self._data:
+                result_id, (expires, _) = next(iter(self._data.items()))
+                if expires > now:
+                    break
+                del self._data[result_id]
+                expired += 1
+            self._expirations += expired
+        return expired
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "entries": len(self._data),
+                "bytes": sum(len(blob) for _, blob in self._data.values()),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+class SQLiteResultStore(_ResultStoreBase):
+    """
+    Almacén en un fichero SQLite compartido por todos los workers de uvicorn,
+    de modo que `GET /api/analyze-lunares/{id}` funciona sin importar qué
+    worker atendió el POST. Modo WAL para lecturas concurrentes; los ids se
+    guardan como UUID de 16 bytes y los registros como JSON comprimido.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, max_entries=100000, ttl_seconds=3600, expiry_interval=60):
+        super().__init__(ttl_seconds, expiry_interval)
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._evictions = 0
+        self._expirations = 0
+        self._stats_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " id BLOB PRIMARY KEY, record BLOB NOT NULL, expires REAL NOT NULL) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_expires ON results(expires)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(result_id):
+        try:
+            return uuid.UUID(result_id).bytes
+        except (ValueError, AttributeError, TypeError):
+            return None
+
+    def put(self, record, result_id=None):
+        result_id = result_id or self.new_id()
+        blob = encode_record(record)
+        conn = self._connect()
+        # Inserción y tope de capacidad en una transacción: con varios workers
+        # escribiendo a la vez, cada uno ve el recuento ya con su fila
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (id, record, expires) VALUES (?, ?, ?)",
+                (self._key(result_id), blob, time.time() + self.ttl),
+            )
+            evicted = self._evict_overflow(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if evicted:
+            with self._stats_lock:
+                self._evictions += evicted
+        return result_id
+
+    def _evict_overflow(self, conn):
+        """Elimina los que caducan antes hasta quedar en `max_entries` (el recuento usa el índice)."""
+        overflow = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+        if overflow <= 0:
+            return 0
+        return conn.execute(
+            "DELETE FROM results WHERE id IN (SELECT id FROM results ORDER BY expires LIMIT ?)",
+            (overflow,),
+        ).rowcount
+
+    def get(self, result_id):
+        key = self._key(result_id)
+        if key is None:
+            return None
+        row = self._connect().execute(
+            "SELECT record FROM results WHERE id = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return decode_record(row[0]) if row else None
+
+    def purge_expired(self):
+        conn = self._connect()
+        expired = conn.execute("DELETE FROM results WHERE expires <= ?", (time.time(),)).rowcount
+        # El tope ya se aplica en cada `put`; esto cubre un cambio de `max_entries`
+        evicted = self._evict_overflow(conn)
+        with self._stats_lock:
+            self._expirations += expired
+            self._evictions += evicted
+        return expired
+
+    def stats(self):
+        entries, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(record)), 0) FROM results"
+        ).fetchone()
+        with self._stats_lock:
+            return {
+                "backend": self.backend,
+                "path": self.path,
+                "entries": entries,
+                "bytes": size,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+def create_result_store(backend=RESULT_STORE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteResultStore(
+            RESULT_STORE_PATH, RESULT_STORE_MAX_ENTRIES,
+            RESULT_STORE_TTL_SECONDS, RESULT_STORE_EXPIRY_INTERVAL_SECONDS,
+        )
+    if backend == "memory":
+        return MemoryResultStore(
+            RESULT_STORE_MAX_ENTRIES, RESULT_STORE_TTL_SECONDS, RESULT_STORE_EXPIRY_INTERVAL_SECONDS,
+        )
+    raise ValueError(f"Backend de resultados no soportado: {backend}")
+
+
+# Almacén de resultados de análisis compartido por todos los endpoints
+result_store = create_result_store()
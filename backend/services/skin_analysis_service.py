@@ -1,11 +1,37 @@
-from PIL import Image
-from io import BytesIO
-import tensorflow as tf
-from tensorflow.keras.preprocessing.image import img_to_array
-from backend.config.model_config import LUNARES_MODEL_PATH, ACNE_MODEL_PATH, ROSACEA_MODEL_PATH
-
-# --- INICIO: Funciones para modelo lunares.keras ---
-LUNARES_MODEL = None
+import numpy as np
+from backend.config.model_config import (
+    LUNARES_MODEL_PATH, ACNE_MODEL_PATH, ROSACEA_MODEL_PATH,
+    LUNARES_BATCH_MAX_SIZE, LUNARES_BATCH_MAX_WAIT_MS,
+    ACNE_BATCH_MAX_SIZE, ACNE_BATCH_MAX_WAIT_MS,
+    ROSACEA_BATCH_MAX_SIZE, ROSACEA_BATCH_MAX_WAIT_MS,
+    INFERENCE_USE_TF_FUNCTION, WARMUP_BATCH_SIZES,
+    LUNARES_INFERENCE_BACKEND, LUNARES_TFLITE_PATH,
+    ACNE_INFERENCE_BACKEND, ACNE_TFLITE_PATH,
+    ROSACEA_INFERENCE_BACKEND, ROSACEA_TFLITE_PATH,
+    TFLITE_NUM_THREADS, INFERENCE_SERVER_MODE, ensure_model_dirs,
+    MODEL_MEMORY_BUDGET_BYTES, MODEL_IDLE_EVICT_SECONDS, MODEL_EVICT_MIN_IDLE_SECONDS,
+    MODEL_PREWARM_MIN_REQUESTS,
+    FUSED_MODEL_MODE, FUSED_MODEL_PATH, FUSED_MODEL_METADATA_PATH,
+    FUSED_BATCH_MAX_SIZE, FUSED_BATCH_MAX_WAIT_MS,
+)
+from backend.services.model_registry import ModelRegistry, ModelSpec
+from backend.services.fused_model import fused_model_spec
+from backend.services.inference_server import InferenceClient, InferenceServerUnavailable
+from backend.services.image_preprocessing import preprocess_image
+from backend.services.prediction_cache import prediction_cache, prediction_cache_key, image_digest
+from backend.services.metrics import observe_preprocessing
+from backend.services.profiling import current_capture, tf_trace
+
+def _preprocess_image(image_bytes: bytes, model: str, out=None, target_size=(224, 224)):
+    """Decodifica la imagen y la convierte en un tensor (1, H, W, 3) normalizado."""
+    # El buffer del hilo es seguro aquí: el llamador espera al resultado del
+    # batcher, que copia el tensor al lote, antes de preprocesar otra imagen
+    timings = {}
+    img_array = preprocess_image(image_bytes, target_size, out=out, reuse_buffer=out is None, timings=timings)
+    observe_preprocessing(model, timings)
+    return img_array
+
+# --- INICIO: Especificación de los modelos ---
 LUNARES_CLASS_NAMES = ['akiec', 'bcc', 'bkl', 'df', 'mel', 'nv', 'vasc']
 LUNARES_CLASS_LABELS = {
     'akiec': 'Queratosis Actínica',
@@ -17,133 +43,313 @@ LUNARES_CLASS_LABELS = {
     'vasc': 'Lesión Vascular'
 }
 
-def load_lunares_model():
-    global LUNARES_MODEL
-    if LUNARES_MODEL is None:
-        try:
-            print(f"Cargando modelo lunares.keras desde {LUNARES_MODEL_PATH}...")
-            LUNARES_MODEL = tf.keras.models.load_model(LUNARES_MODEL_PATH)
-            print("Modelo lunares.keras cargado exitosamente.")
-        except Exception as e:
-            print(f"Error cargando el modelo lunares.keras: {e}")
-            LUNARES_MODEL = None
-    return LUNARES_MODEL
-
-def predict_lunares_class(image_bytes: bytes):
-    model = load_lunares_model()
-    if model is None:
-        print("El modelo lunares.keras no está cargado.")
-        return None, None
-    try:
-        img = Image.open(BytesIO(image_bytes))
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img_resized = img.resize((224, 224))
-        img_array = img_to_array(img_resized)
-        img_array = img_array / 255.0
-        img_array = img_array.reshape((1, 224, 224, 3))
-        preds = model.predict(img_array)
-        pred_idx = preds.argmax(axis=1)[0]
-        pred_class = LUNARES_CLASS_NAMES[pred_idx]
-        pred_label = LUNARES_CLASS_LABELS[pred_class]
-        probabilities = {LUNARES_CLASS_LABELS[LUNARES_CLASS_NAMES[i]]: float(preds[0][i]) for i in range(len(LUNARES_CLASS_NAMES))}
-        return pred_label, probabilities
-    except Exception as e:
-        print(f"Error al predecir con lunares.keras: {e}")
-        return None, None
-# --- FIN: Funciones para modelo lunares.keras --- 
-
-# --- INICIO: Funciones para modelo acne.keras ---
 ACNE_CLASS_NAMES = ['acne', 'no_acne']
 ACNE_CLASS_LABELS = {
     'acne': 'Con acné',
     'no_acne': 'Sin acné'
 }
-ACNE_MODEL = None
-
-def load_acne_model():
-    global ACNE_MODEL
-    if ACNE_MODEL is None:
-        try:
-            print(f"Cargando modelo acne.keras desde {ACNE_MODEL_PATH}...")
-            ACNE_MODEL = tf.keras.models.load_model(ACNE_MODEL_PATH)
-            print("Modelo acne.keras cargado exitosamente.")
-        except Exception as e:
-            print(f"Error cargando el modelo acne.keras: {e}")
-            ACNE_MODEL = None
-    return ACNE_MODEL
-
-def predict_acne_class(image_bytes: bytes):
-    model = load_acne_model()
-    if model is None:
-        print("El modelo acne.keras no está cargado.")
-        return None, None
-    try:
-        img = Image.open(BytesIO(image_bytes))
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img_resized = img.resize((224, 224))
-        img_array = img_to_array(img_resized)
-        img_array = img_array / 255.0
-        img_array = img_array.reshape((1, 224, 224, 3))
-        preds = model.predict(img_array)
-        # Como es binario, salida sigmoid: 0 = no_acne, 1 = acne
-        pred_idx = int(preds[0][0] > 0.5)
-        pred_class = ACNE_CLASS_NAMES[pred_idx]
-        pred_label = ACNE_CLASS_LABELS[pred_class]
-        probabilities = {
-            ACNE_CLASS_LABELS[ACNE_CLASS_NAMES[1]]: float(preds[0][0]),
-            ACNE_CLASS_LABELS[ACNE_CLASS_NAMES[0]]: float(1 - preds[0][0])
-        }
-        return pred_label, probabilities
-    except Exception as e:
-        print(f"Error al predecir con acne.keras: {e}")
-        return None, None
-# --- FIN: Funciones para modelo acne.keras ---
 
-# --- INICIO: Funciones para modelo rosacea.keras ---
 ROSACEA_CLASS_NAMES = ['rosacea', 'no_rosacea']
 ROSACEA_CLASS_LABELS = {
     'rosacea': 'Con rosácea',
     'no_rosacea': 'Sin rosácea'
 }
-ROSACEA_MODEL = None
 
-def load_rosacea_model():
-    global ROSACEA_MODEL
-    if ROSACEA_MODEL is None:
+MODEL_SPECS = [
+    # Salida softmax sobre las 7 clases de HAM10000
+    ModelSpec(
+        "lunares", LUNARES_MODEL_PATH, LUNARES_CLASS_NAMES, LUNARES_CLASS_LABELS, output="softmax",
+        backend=LUNARES_INFERENCE_BACKEND, tflite_path=LUNARES_TFLITE_PATH,
+        batch_max_size=LUNARES_BATCH_MAX_SIZE, batch_max_wait_ms=LUNARES_BATCH_MAX_WAIT_MS,
+    ),
+    # Salidas sigmoid binarias: probabilidad de la segunda clase ("no_acne", "no_rosacea")
+    ModelSpec(
+        "acne", ACNE_MODEL_PATH, ACNE_CLASS_NAMES, ACNE_CLASS_LABELS, output="sigmoid",
+        backend=ACNE_INFERENCE_BACKEND, tflite_path=ACNE_TFLITE_PATH,
+        batch_max_size=ACNE_BATCH_MAX_SIZE, batch_max_wait_ms=ACNE_BATCH_MAX_WAIT_MS,
+    ),
+    ModelSpec(
+        "rosacea", ROSACEA_MODEL_PATH, ROSACEA_CLASS_NAMES, ROSACEA_CLASS_LABELS, output="sigmoid",
+        backend=ROSACEA_INFERENCE_BACKEND, tflite_path=ROSACEA_TFLITE_PATH,
+        batch_max_size=ROSACEA_BATCH_MAX_SIZE, batch_max_wait_ms=ROSACEA_BATCH_MAX_WAIT_MS,
+    ),
+]
+
+# Con FUSED_MODEL_MODE=on, un único modelo con backbone compartido calcula
+# las tres cabezas en un forward pass (None si no es utilizable)
+FUSED_MODEL_SPEC = fused_model_spec(
+    FUSED_MODEL_PATH, FUSED_MODEL_METADATA_PATH, MODEL_SPECS,
+    batch_max_size=FUSED_BATCH_MAX_SIZE, batch_max_wait_ms=FUSED_BATCH_MAX_WAIT_MS,
+) if FUSED_MODEL_MODE == "on" else None
+
+# Registro con la versión activa de cada modelo, su micro-batcher y la
+# política de residencia en memoria. Con el modelo fusionado, los modelos por
+# separado solo se cargan si deja de ser válido (p. ej. al reentrenar uno)
+model_registry = ModelRegistry(
+    MODEL_SPECS + ([FUSED_MODEL_SPEC] if FUSED_MODEL_SPEC is not None else []), num_threads=TFLITE_NUM_THREADS,
+    use_tf_function=INFERENCE_USE_TF_FUNCTION, warmup_batch_sizes=WARMUP_BATCH_SIZES,
+    memory_budget_bytes=MODEL_MEMORY_BUDGET_BYTES, idle_evict_seconds=MODEL_IDLE_EVICT_SECONDS,
+    evict_min_idle_seconds=MODEL_EVICT_MIN_IDLE_SECONDS, prewarm_min_requests=MODEL_PREWARM_MIN_REQUESTS,
+)
+
+# Modelos disponibles para el análisis: nombre -> especificación
+ANALYSIS_MODELS = {spec.name: spec for spec in MODEL_SPECS}
+
+# Estado de carga y calentamiento de cada modelo (en este proceso)
+MODEL_STATUS = model_registry.status
+
+# Cliente del servidor de inferencia compartido (INFERENCE_SERVER_MODE=client)
+inference_client = InferenceClient() if INFERENCE_SERVER_MODE == "client" else None
+# --- FIN: Especificación de los modelos ---
+
+# --- INICIO: Inferencia en proceso o en el servidor de inferencia ---
+def _use_server():
+    return inference_client is not None and inference_client.available()
+
+def _active_version(name):
+    """Versión con la que se consulta la caché antes de inferir (None si aún no se conoce)."""
+    if _use_server():
+        return inference_client.versions.get(name)
+    # Un modelo descargado de memoria conserva su versión: un acierto de caché no lo recarga.
+    # Sin versión conocida (aún no se cargó) no se consulta la caché; la carga
+    # la hace una sola vez `_infer_local`
+    return model_registry.version(name)
+
+def _infer_local(names, image_bytes):
+    results = {name: (None, None, None) for name in names}
+    loaded = []
+    for name in names:
+        if model_registry.get(name) is None:
+            print(f"El modelo {name} no está cargado.")
+        else:
+            loaded.append(name)
+    if not loaded:
+        return results
+    try:
+        img_array = _preprocess_image(image_bytes, loaded[0] if len(loaded) == 1 else "shared")
+    except Exception as e:
+        print(f"Error al preprocesar la imagen: {e}")
+        return results
+    capture = current_capture()
+    if capture is not None:
+        # Petición perfilada: forward pass en este hilo, fuera del batcher,
+        # para que cProfile (y la traza de TensorFlow) lo incluyan
+        with tf_trace(capture):
+            outputs = model_registry.predict_many(loaded, img_array)
+        for name, rows in outputs.items():
+            if isinstance(rows, Exception):
+                print(f"Error al predecir con {name}: {rows}")
+            else:
+                results[name] = rows[0]
+        return results
+    # Cada batcher tiene su propio hilo, así que encolar en todos antes de
+    # esperar ejecuta los modelos de forma concurrente sobre el mismo tensor
+    futures = model_registry.submit(loaded, img_array)
+    for name, future in futures.items():
         try:
-            print(f"Cargando modelo rosacea.keras desde {ROSACEA_MODEL_PATH}...")
-            ROSACEA_MODEL = tf.keras.models.load_model(ROSACEA_MODEL_PATH)
-            print("Modelo rosacea.keras cargado exitosamente.")
+            results[name] = future.result()
         except Exception as e:
-            print(f"Error cargando el modelo rosacea.keras: {e}")
-            ROSACEA_MODEL = None
-    return ROSACEA_MODEL
+            print(f"Error al predecir con {name}: {e}")
+    return results
 
-def predict_rosacea_class(image_bytes: bytes):
-    model = load_rosacea_model()
-    if model is None:
-        print("El modelo rosacea.keras no está cargado.")
-        return None, None
+def _infer_remote(names, image_bytes):
+    spec = ANALYSIS_MODELS[names[0]]
+    buffer = inference_client.input_buffer((1, *spec.input_shape))
     try:
-        img = Image.open(BytesIO(image_bytes))
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img_resized = img.resize((224, 224))
-        img_array = img_to_array(img_resized)
-        img_array = img_array / 255.0
-        img_array = img_array.reshape((1, 224, 224, 3))
-        preds = model.predict(img_array)
-        pred_idx = int(preds[0][0] > 0.5)
-        pred_class = ROSACEA_CLASS_NAMES[pred_idx]
-        pred_label = ROSACEA_CLASS_LABELS[pred_class]
-        probabilities = {
-            ROSACEA_CLASS_LABELS[ROSACEA_CLASS_NAMES[1]]: float(preds[0][0]),
-            ROSACEA_CLASS_LABELS[ROSACEA_CLASS_NAMES[0]]: float(1 - preds[0][0])
-        }
-        return pred_label, probabilities
+        _preprocess_image(image_bytes, names[0] if len(names) == 1 else "shared", out=buffer, target_size=spec.input_size)
     except Exception as e:
-        print(f"Error al predecir con rosacea.keras: {e}")
-        return None, None
-# --- FIN: Funciones para modelo rosacea.keras --- 
\ No newline at end of file
+        print(f"Error al preprocesar la imagen: {e}")
+        return {name: (None, None, None) for name in names}
+    replies = inference_client.predict(names, buffer)
+    results = {}
+    for name in names:
+        reply = replies.get(name, {"error": "sin respuesta"})
+        if "error" in reply:
+            print(f"Error al predecir con {name} en el servidor de inferencia: {reply['error']}")
+            results[name] = (None, None, None)
+        else:
+            results[name] = tuple(reply["rows"][0])
+    return results
+
+def _infer(names, image_bytes):
+    """Devuelve nombre -> (etiqueta, probabilidades, versión), con Nones si el modelo no pudo predecir."""
+    if _use_server():
+        capture = current_capture()
+        if capture is not None:
+            # El forward pass ocurre en el servidor de inferencia: el perfil solo cubre este proceso
+            capture.notes["servidor_inferencia"] = True
+        try:
+            return _infer_remote(names, image_bytes)
+        except InferenceServerUnavailable:
+            pass
+    return _infer_local(names, image_bytes)
+# --- FIN: Inferencia en proceso o en el servidor de inferencia ---
+
+# --- INICIO: Análisis combinado con un único preprocesado ---
+def analyze_all(image_bytes: bytes, models=None):
+    """
+    Decodifica y preprocesa la imagen una sola vez y la evalúa con varios modelos.
+
+    `models` es una lista opcional de nombres de `ANALYSIS_MODELS`; por defecto se
+    usan todos. Devuelve un dict nombre -> (etiqueta, probabilidades, versión),
+    con (None, None, None) para los modelos que no pudieron predecir. La caché
+    se consulta antes de decodificar: un acierto evita decodificación e inferencia.
+    """
+    selected = list(models) if models else list(ANALYSIS_MODELS)
+    unknown = [name for name in selected if name not in ANALYSIS_MODELS]
+    if unknown:
+        raise ValueError(f"Modelos desconocidos: {', '.join(unknown)}")
+    results = {}
+    digest = image_digest(image_bytes)
+    pending = []
+    # Una petición perfilada no usa la caché: se quiere el perfil de la inferencia
+    capture = current_capture()
+    for name in selected:
+        version = _active_version(name)
+        cached = prediction_cache.get(prediction_cache_key(name, version, digest)) if version and capture is None else None
+        if cached is not None:
+            results[name] = (*cached, version)
+        else:
+            pending.append(name)
+    if pending:
+        for name, result in _infer(pending, image_bytes).items():
+            results[name] = result
+            if result[0] is not None:
+                # Se guarda con la versión que predijo, aunque se haya sustituido entretanto
+                prediction_cache.set(prediction_cache_key(name, result[2], digest), result[:2])
+    if capture is not None:
+        capture.notes["modelos"] = selected
+        capture.notes["versiones"] = {name: results[name][2] for name in selected}
+        capture.notes["image_bytes"] = len(image_bytes)
+    return {name: results[name] for name in selected}
+
+def analyze_all_resultados(image_bytes: bytes, models=None):
+    """
+    `analyze_all` con el formato de "resultados" de la API: nombre de modelo ->
+    {"prediccion", "probabilidades", "version_modelo"} o {"error"}.
+    """
+    resultados = {}
+    for name, (pred_label, probabilities, version) in analyze_all(image_bytes, models).items():
+        if pred_label is None:
+            resultados[name] = {"error": "No se pudo predecir la clase para la imagen."}
+        else:
+            resultados[name] = {"prediccion": pred_label, "probabilidades": probabilities, "version_modelo": version}
+    return resultados
+
+def predict_model(name: str, image_bytes: bytes):
+    """Predicción de un solo modelo: (etiqueta, probabilidades, versión) o (None, None, None)."""
+    return analyze_all(image_bytes, [name])[name]
+
+def predict_lunares_class(image_bytes: bytes):
+    return predict_model("lunares", image_bytes)
+
+def predict_acne_class(image_bytes: bytes):
+    return predict_model("acne", image_bytes)
+
+def predict_rosacea_class(image_bytes: bytes):
+    return predict_model("rosacea", image_bytes)
+# --- FIN: Análisis combinado con un único preprocesado ---
+
+# --- INICIO: Análisis por lotes grandes ---
+def analyze_batch(images, models=None):
+    """
+    Analiza un bloque de imágenes con un único forward pass por modelo.
+
+    `images` es una lista de (nombre, bytes). Las imágenes que no se pueden
+    decodificar se reportan individualmente sin abortar el resto del bloque.
+    Devuelve una lista, en el mismo orden, de dicts con "filename" y
+    "resultados" (nombre de modelo -> {"prediccion", "probabilidades",
+    "version_modelo"}) o "error".
+    """
+    selected = list(models) if models else list(ANALYSIS_MODELS)
+    unknown = [name for name in selected if name not in ANALYSIS_MODELS]
+    if unknown:
+        raise ValueError(f"Modelos desconocidos: {', '.join(unknown)}")
+    results = [{"filename": filename} for filename, _ in images]
+    spec = ANALYSIS_MODELS[selected[0]]
+    shape = (len(images), *spec.input_shape)
+    # Las imágenes válidas se escriben de forma contigua en el buffer del lote,
+    # en memoria compartida si se usa el servidor de inferencia
+    remote = _use_server()
+    batch = inference_client.input_buffer(shape) if remote else np.empty(shape, dtype=np.float32)
+    decoded = []
+    for i, (_, image_bytes) in enumerate(images):
+        try:
+            _preprocess_image(image_bytes, "batch", out=batch[len(decoded):len(decoded) + 1], target_size=spec.input_size)
+            decoded.append(i)
+        except Exception as e:
+            results[i]["error"] = f"No se pudo decodificar la imagen: {e}"
+    if not decoded:
+        return results
+    batch = batch[:len(decoded)]
+    replies = None
+    if remote:
+        try:
+            replies = inference_client.predict(selected, batch)
+        except InferenceServerUnavailable:
+            pass
+    if replies is None:
+        # Un forward pass por modelo del registro (uno solo con el modelo fusionado)
+        replies = {
+            name: {"error": str(rows)} if isinstance(rows, Exception) else {"rows": rows}
+            for name, rows in model_registry.predict_many(selected, batch).items()
+        }
+    for i in decoded:
+        results[i]["resultados"] = {}
+    for name in selected:
+        try:
+            if "error" in replies[name]:
+                raise RuntimeError(replies[name]["error"])
+            rows = replies[name]["rows"]
+            for (pred_label, probabilities, version), i in zip(rows, decoded):
+                results[i]["resultados"][name] = {
+                    "prediccion": pred_label, "probabilidades": probabilities, "version_modelo": version
+                }
+        except Exception as e:
+            print(f"Error al predecir el lote con {name}: {e}")
+            for i in decoded:
+                results[i]["resultados"][name] = {"error": "No se pudo predecir la clase para la imagen."}
+    return results
+# --- FIN: Análisis por lotes grandes ---
+
+# --- INICIO: Carga y calentamiento al arranque ---
+def warmup_models(batch_sizes=None):
+    """
+    Carga todos los modelos y ejecuta pasadas de calentamiento a varios tamaños
+    de lote, para que ninguna petición pague la carga del .keras ni el trazado
+    del grafo. Con el servidor de inferencia disponible no se carga nada en
+    este proceso (los modelos solo se cargan aquí si hay que recurrir a la
+    inferencia en proceso). Devuelve el estado de los modelos.
+    """
+    if inference_client is not None:
+        try:
+            return inference_client.status()["models"]
+        except InferenceServerUnavailable:
+            print("Servidor de inferencia no disponible: se cargan los modelos en proceso.")
+    if batch_sizes:
+        model_registry.warmup_batch_sizes = list(batch_sizes)
+    ensure_model_dirs()
+    return model_registry.warmup_all()
+
+def get_model_status():
+    """Estado de los modelos que atienden las peticiones: (listos, estado por modelo)."""
+    if inference_client is not None:
+        try:
+            status = inference_client.status()
+            return status["ready"], status["models"]
+        except InferenceServerUnavailable:
+            pass
+    return model_registry.ready(), MODEL_STATUS
+
+def models_ready():
+    """True si todos los modelos están cargados y calentados."""
+    return get_model_status()[0]
+# --- FIN: Carga y calentamiento al arranque ---
+
+def get_residency_stats():
+    """Modelos en memoria en este proceso, su huella, descargas y recargas."""
+    return model_registry.residency.stats()
+
+def get_batching_stats():
+    """Estadísticas de llenado de lotes de los modelos de este proceso."""
+    return {name: batcher.stats() for name, batcher in model_registry.batchers.items()}
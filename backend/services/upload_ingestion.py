@@ -0,0 +1,121 @@
+import asyncio
+
+from PIL import Image, UnidentifiedImageError
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import JSONResponse
+
+from backend.config.model_config import UPLOAD_MAX_BYTES, UPLOAD_MAX_PIXELS
+
+# Formatos que aceptan los modelos (MPO es el JPEG multi-imagen de algunas cámaras)
+ALLOWED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP", "BMP", "GIF", "TIFF"}
+
+
+class UploadRejected(Exception):
+    """Subida rechazada antes de decodificarla; `reason` se usa como etiqueta de métricas."""
+
+    def __init__(self, status_code, detail, reason):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+
+
+def probe_image(fileobj, max_pixels=UPLOAD_MAX_PIXELS):
+    """
+    Lee solo la cabecera de la imagen (PIL no decodifica los píxeles hasta
+    `load()`) y rechaza lo que no sea una imagen soportada o declare más de
+    `max_pixels` píxeles. Deja el archivo en la posición en que estaba.
+    Devuelve (formato, ancho, alto).
+    """
+    position = fileobj.tell()
+    try:
+        with Image.open(fileobj) as img:
+            fmt, (width, height) = img.format, img.size
+    except Image.DecompressionBombError:
+        raise UploadRejected(413, "La imagen tiene demasiados píxeles.", "pixels")
+    except (UnidentifiedImageError, OSError, ValueError, SyntaxError):
+        raise UploadRejected(415, "El archivo no es una imagen válida.", "not_image")
+    finally:
+        fileobj.seek(position)
+    if fmt not in ALLOWED_FORMATS:
+        raise UploadRejected(415, f"Formato de imagen no soportado: {fmt}.", "format")
+    if width * height > max_pixels:
+        raise UploadRejected(413, "La imagen tiene demasiados píxeles.", "pixels")
+    return fmt, width, height
+
+
+def read_limited(fileobj, max_bytes):
+    """Lee como mucho `max_bytes` del archivo; si hay más, rechaza la subida sin leer el resto."""
+    data = fileobj.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise UploadRejected(413, "La imagen supera el tamaño máximo permitido.", "bytes")
+    return data
+
+
+async def read_image_upload(file, max_bytes=UPLOAD_MAX_BYTES, max_pixels=UPLOAD_MAX_PIXELS) -> bytes:
+    """
+    Valida y lee una imagen subida.
+
+    El tamaño declarado por el multipart se comprueba antes de tocar los datos;
+    la cabecera se inspecciona sobre el propio archivo temporal de la subida, y
+    solo si es una imagen aceptable se lee el contenido, una única vez y sin
+    superar `max_bytes`. El decodificador recibe esos bytes envueltos en un
+    BytesIO, que comparte el buffer en lugar de copiarlo.
+    """
+    size = getattr(file, "size", None)
+    if size is not None and size > max_bytes:
+        raise UploadRejected(413, "La imagen supera el tamaño máximo permitido.", "bytes")
+
+    def _read():
+        fileobj = file.file
+        fileobj.seek(0)
+        probe_image(fileobj, max_pixels)
+        return read_limited(fileobj, max_bytes)
+
+    return await asyncio.to_thread(_read)
+
+
+class _BodyTooLarge(StarletteHTTPException):
+    def __init__(self):
+        super().__init__(status_code=413, detail="La petición supera el tamaño máximo permitido.")
+
+
+class BodySizeLimitMiddleware:
+    """
+    Middleware ASGI que limita el tamaño del cuerpo de las peticiones mientras
+    llega, antes de que el parser del multipart lo vuelque a disco.
+
+    Con Content-Length se responde 413 sin leer el cuerpo; con transferencia
+    chunked se cuentan los bytes recibidos y se corta en cuanto se supera el
+    límite (FastAPI convierte la excepción en la respuesta 413). `path_limits`
+    permite límites mayores por ruta, como el del endpoint por lotes.
+    """
+
+    def __init__(self, app, max_body_bytes, path_limits=None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.path_limits = dict(path_limits or {})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+        limit = self.path_limits.get(scope["path"], self.max_body_bytes)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": "La petición supera el tamaño máximo permitido."}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _BodyTooLarge()
+            return message
+
+        await self.app(scope, limited_receive, send)
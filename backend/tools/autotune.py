@@ -0,0 +1,195 @@
+"""
+Autotuning de hilos de TensorFlow, workers de uvicorn y tamaño de lote.
+
+Detecta las CPUs realmente disponibles (afinidad y cuota de cgroup del
+contenedor) y mide los modelos reales con varias combinaciones de hilos
+intra-op/inter-op, número de procesos worker en paralelo y tamaño de lote.
+Cada combinación lanza tantos subprocesos como workers, que arrancan a la
+vez para reproducir la contención real entre workers de uvicorn.
+
+La mejor combinación (máximo throughput, opcionalmente con un límite de p95)
+se escribe en TUNING_CONFIG_PATH (backend/config/tuning.json), que el backend
+lee al arrancar. Las variables de entorno siguen teniendo prioridad.
+
+Uso:
+    python -m backend.tools.autotune --duration 5
+    python -m backend.tools.autotune --workers 1 2 4 --batch-sizes 1 8 16 --max-p95-ms 250
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from backend.config.cpu_topology import available_cpus, cpu_quota
+from backend.config.model_config import (
+    TUNING_CONFIG_PATH,
+    LUNARES_MODEL_PATH, ACNE_MODEL_PATH, ROSACEA_MODEL_PATH,
+    LUNARES_INFERENCE_BACKEND, ACNE_INFERENCE_BACKEND, ROSACEA_INFERENCE_BACKEND,
+    LUNARES_TFLITE_PATH, ACNE_TFLITE_PATH, ROSACEA_TFLITE_PATH,
+)
+
+# Modelo -> (backend, ruta .keras, ruta .tflite)
+MODELS = {
+    "lunares": (LUNARES_INFERENCE_BACKEND, LUNARES_MODEL_PATH, LUNARES_TFLITE_PATH),
+    "acne": (ACNE_INFERENCE_BACKEND, ACNE_MODEL_PATH, ACNE_TFLITE_PATH),
+    "rosacea": (ROSACEA_INFERENCE_BACKEND, ROSACEA_MODEL_PATH, ROSACEA_TFLITE_PATH),
+}
+
+
+# --- Proceso worker ---
+
+def run_worker(models, batch_size, duration):
+    """
+    Carga los modelos con la configuración de hilos del entorno, avisa de que
+    está listo, espera la señal de inicio por stdin y ejecuta forward passes
+    durante `duration` segundos. Imprime un JSON con los resultados.
+    """
+    from backend.config.model_config import TFLITE_NUM_THREADS
+    from backend.services.inference_backends import load_backend
+
+    backends = [
+        load_backend(kind, keras_path, tflite_path, num_threads=TFLITE_NUM_THREADS)
+        for kind, keras_path, tflite_path in (MODELS[name] for name in models)
+    ]
+    batch = np.random.default_rng(0).random((batch_size, 224, 224, 3), dtype=np.float32)
+    for backend in backends:
+        backend.predict(batch)  # calentamiento
+    print("READY", flush=True)
+    sys.stdin.readline()
+
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        for backend in backends:
+            backend.predict(batch)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    print(json.dumps({"batches": len(latencies), "images": len(latencies) * batch_size, "latencies_ms": latencies}), flush=True)
+
+
+# --- Orquestación ---
+
+def measure(combo, models, duration):
+    workers, intra, inter, batch_size = combo
+    env = {
+        **os.environ,
+        "TF_INTRA_OP_THREADS": str(intra),
+        "TF_INTER_OP_THREADS": str(inter),
+        "WEB_CONCURRENCY": str(workers),
+        "TF_CPP_MIN_LOG_LEVEL": "2",
+    }
+    cmd = [sys.executable, "-m", "backend.tools.autotune", "--worker",
+           "--models", *models, "--batch-sizes", str(batch_size), "--duration", str(duration)]
+    procs = [subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+             for _ in range(workers)]
+    try:
+        for proc in procs:
+            line = proc.stdout.readline()
+            if not line.startswith("READY"):
+                raise RuntimeError(f"El worker no arrancó (código {proc.wait()})")
+        started = time.perf_counter()
+        for proc in procs:
+            proc.stdin.write("\n")
+            proc.stdin.flush()
+        outputs = [json.loads(proc.stdout.readline()) for proc in procs]
+        elapsed = time.perf_counter() - started
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+    latencies = [lat for out in outputs for lat in out["latencies_ms"]]
+    images = sum(out["images"] for out in outputs)
+    return {
+        "workers": workers,
+        "intra_op_threads": intra,
+        "inter_op_threads": inter,
+        "batch_size": batch_size,
+        "images_per_s": images / elapsed,
+        "batch_p50_ms": float(np.percentile(latencies, 50)) if latencies else None,
+        "batch_p95_ms": float(np.percentile(latencies, 95)) if latencies else None,
+    }
+
+
+def candidate_grid(cpus, workers_list, intra_list, inter_list, batch_sizes):
+    workers_list = workers_list or sorted({1, 2, max(1, cpus // 2), cpus})
+    combos = []
+    for workers in workers_list:
+        if workers > cpus:
+            continue
+        # Por defecto, repartir todas las CPUs entre los workers o la mitad de ellas
+        intras = intra_list or sorted({max(1, cpus // workers), max(1, cpus // (2 * workers))})
+        for intra, inter, batch_size in itertools.product(intras, inter_list, batch_sizes):
+            combos.append((workers, intra, inter, batch_size))
+    return combos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--workers", nargs="+", type=int, help="Workers a probar (por defecto según las CPUs)")
+    parser.add_argument("--intra", nargs="+", type=int, help="Hilos intra-op a probar (por defecto según workers)")
+    parser.add_argument("--inter", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 16])
+    parser.add_argument("--duration", type=float, default=5.0, help="Segundos de medición por combinación")
+    parser.add_argument("--max-p95-ms", type=float, help="Descartar combinaciones con p95 por lote superior")
+    parser.add_argument("--output", default=TUNING_CONFIG_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="No escribir el fichero de configuración")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.models, args.batch_sizes[0], args.duration)
+        return
+
+    missing = [name for name in args.models if not os.path.exists(MODELS[name][2 if MODELS[name][0] == "tflite" else 1])]
+    if missing:
+        raise SystemExit(f"Faltan los modelos: {', '.join(missing)}")
+
+    cpus = available_cpus()
+    quota = cpu_quota()
+    print(f"CPUs disponibles: {cpus} (os.cpu_count={os.cpu_count()}, cuota cgroup={quota if quota else 'sin límite'})")
+    combos = candidate_grid(cpus, args.workers, args.intra, args.inter, args.batch_sizes)
+    print(f"Probando {len(combos)} combinaciones de {args.duration:.0f}s con modelos {', '.join(args.models)}\n")
+    print(f"{'workers':>8}{'intra':>7}{'inter':>7}{'lote':>6}{'img/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+
+    results = []
+    for combo in combos:
+        try:
+            result = measure(combo, args.models, args.duration)
+        except Exception as e:
+            print(f"{combo}: error {e}")
+            continue
+        results.append(result)
+        print(f"{result['workers']:>8}{result['intra_op_threads']:>7}{result['inter_op_threads']:>7}{result['batch_size']:>6}"
+              f"{result['images_per_s']:>10.1f}{result['batch_p50_ms']:>10.1f}{result['batch_p95_ms']:>10.1f}")
+
+    eligible = [r for r in results if args.max_p95_ms is None or r["batch_p95_ms"] <= args.max_p95_ms]
+    if not eligible:
+        raise SystemExit("Ninguna combinación cumple las restricciones.")
+    best = max(eligible, key=lambda r: r["images_per_s"])
+    recommended = {k: best[k] for k in ("workers", "intra_op_threads", "inter_op_threads", "batch_size")}
+    print(f"\nRecomendado: {recommended} ({best['images_per_s']:.1f} img/s, p95 {best['batch_p95_ms']:.1f} ms)")
+
+    if not args.dry_run:
+        report = {
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": {"available_cpus": cpus, "cpu_count": os.cpu_count(), "cgroup_quota": quota},
+            "models": args.models,
+            "max_p95_ms": args.max_p95_ms,
+            "recommended": recommended,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Configuración guardada en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Convierte los modelos .keras a TFLite cuantizado para el backend "tflite".
+
+Modos de cuantización:
+  dynamic  pesos int8 y activaciones float (no necesita calibración)
+  int8     pesos y activaciones int8, calibrados con un conjunto representativo
+  float16  pesos float16
+
+Uso:
+    python -m backend.tools.convert_tflite --models lunares acne rosacea --mode int8 \\
+        --calibration-dir datos/calibracion --calibration-samples 200
+
+Después, activar el backend por modelo, por ejemplo LUNARES_INFERENCE_BACKEND=tflite.
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from backend.config.model_config import (
+    get_tensorflow,
+    LUNARES_MODEL_PATH, ACNE_MODEL_PATH, ROSACEA_MODEL_PATH,
+    LUNARES_TFLITE_PATH, ACNE_TFLITE_PATH, ROSACEA_TFLITE_PATH,
+)
+from backend.services.image_preprocessing import preprocess_image
+
+tf = get_tensorflow()
+
+# Modelo -> (ruta .keras, ruta .tflite)
+MODEL_PATHS = {
+    "lunares": (LUNARES_MODEL_PATH, LUNARES_TFLITE_PATH),
+    "acne": (ACNE_MODEL_PATH, ACNE_TFLITE_PATH),
+    "rosacea": (ROSACEA_MODEL_PATH, ROSACEA_TFLITE_PATH),
+}
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.webp")
+
+
+def find_images(directory, limit=None):
+    paths = []
+    for pattern in IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+        paths.extend(glob.glob(os.path.join(directory, "**", pattern.upper()), recursive=True))
+    paths = sorted(set(paths))
+    return paths[:limit] if limit else paths
+
+
+def representative_dataset(calibration_dir, samples, seed=0):
+    """
+    Conjunto representativo para calibrar los rangos de activación. Usa
+    imágenes reales preprocesadas igual que en producción; sin directorio,
+    recurre a ruido uniforme (solo útil para pruebas, no para producción).
+    """
+    paths = find_images(calibration_dir, samples) if calibration_dir else []
+    if calibration_dir and not paths:
+        raise SystemExit(f"No se encontraron imágenes de calibración en {calibration_dir}")
+    if not paths:
+        print("Aviso: sin --calibration-dir, se calibra con ruido aleatorio.")
+
+    def _generator():
+        if paths:
+            for path in paths:
+                with open(path, "rb") as f:
+                    yield [preprocess_image(f.read())]
+        else:
+            rng = np.random.default_rng(seed)
+            for _ in range(samples):
+                yield [rng.random((1, 224, 224, 3), dtype=np.float32)]
+    return _generator
+
+
+def convert(keras_path, mode, calibration_dir=None, samples=100, int8_io=False):
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        converter.representative_dataset = representative_dataset(calibration_dir, samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        if int8_io:
+            # Entrada y salida int8: el backend cuantiza/decuantiza con la escala del modelo
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+    elif mode != "dynamic":
+        raise ValueError(f"Modo de cuantización no soportado: {mode}")
+    return converter.convert()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=list(MODEL_PATHS), default=list(MODEL_PATHS))
+    parser.add_argument("--mode", choices=["dynamic", "int8", "float16"], default="dynamic")
+    parser.add_argument("--calibration-dir", help="Directorio con imágenes representativas (modo int8)")
+    parser.add_argument("--calibration-samples", type=int, default=100)
+    parser.add_argument("--int8-io", action="store_true", help="Usar entrada/salida int8 en modo int8")
+    parser.add_argument("--output-dir", help="Directorio de salida (por defecto, la ruta *_TFLITE_PATH de cada modelo)")
+    args = parser.parse_args()
+
+    for name in args.models:
+        keras_path, tflite_path = MODEL_PATHS[name]
+        if args.output_dir:
+            tflite_path = os.path.join(args.output_dir, os.path.basename(tflite_path))
+        if not os.path.exists(keras_path):
+            print(f"[{name}] No existe {keras_path}, se omite.")
+            continue
+        print(f"[{name}] Convirtiendo {keras_path} (modo {args.mode})...")
+        tflite_model = convert(keras_path, args.mode, args.calibration_dir, args.calibration_samples, args.int8_io)
+        os.makedirs(os.path.dirname(os.path.abspath(tflite_path)), exist_ok=True)
+        with open(tflite_path, "wb") as f:
+            f.write(tflite_model)
+        original = os.path.getsize(keras_path)
+        print(f"[{name}] {tflite_path}: {len(tflite_model) / 1e6:.2f} MB (original {original / 1e6:.2f} MB)")
+
+
+if __name__ == "__main__":
+    main()
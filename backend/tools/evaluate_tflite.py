@@ -0,0 +1,137 @@
+"""
+Compara el backend TFLite cuantizado con el modelo .keras original.
+
+Informa, por modelo:
+  - latencia p50/p95 por imagen y por lote en cada backend
+  - memoria residente añadida al cargar cada backend
+  - acuerdo top-1 y diferencia absoluta media/máxima de probabilidades
+
+Uso:
+    python -m backend.tools.evaluate_tflite --models lunares --images-dir datos/validacion --batch-size 8
+    python -m backend.tools.evaluate_tflite --json informe.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import time
+
+import numpy as np
+
+from backend.services.image_preprocessing import preprocess_batch
+from backend.services.inference_backends import KerasBackend, TFLiteBackend
+from backend.tools.convert_tflite import MODEL_PATHS, find_images
+
+
+def rss_mb():
+    """Memoria residente actual en MB (Linux); cae a ru_maxrss en otros sistemas."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def top1(preds):
+    # Salida softmax (varias clases) o sigmoid (una neurona, umbral 0.5)
+    if preds.shape[-1] == 1:
+        return (preds[:, 0] > 0.5).astype(np.int64)
+    return preds.argmax(axis=1)
+
+
+def load_inputs(images_dir, samples, seed=0):
+    if images_dir:
+        paths = find_images(images_dir, samples)
+        if not paths:
+            raise SystemExit(f"No se encontraron imágenes en {images_dir}")
+        sources = []
+        for path in paths:
+            with open(path, "rb") as f:
+                sources.append(f.read())
+        return preprocess_batch(sources)
+    print("Aviso: sin --images-dir, se evalúa con ruido aleatorio.")
+    return np.random.default_rng(seed).random((samples, 224, 224, 3), dtype=np.float32)
+
+
+def run(backend, inputs, batch_size, repeat):
+    # Calentamiento
+    backend.predict(inputs[:1])
+    backend.predict(inputs[:batch_size])
+    single = []
+    for _ in range(repeat):
+        for i in range(len(inputs)):
+            start = time.perf_counter()
+            backend.predict(inputs[i:i + 1])
+            single.append((time.perf_counter() - start) * 1000.0)
+    batched = []
+    outputs = []
+    for i in range(0, len(inputs), batch_size):
+        start = time.perf_counter()
+        outputs.append(backend.predict(inputs[i:i + batch_size]))
+        batched.append((time.perf_counter() - start) * 1000.0)
+    return np.concatenate(outputs), {
+        "single_p50_ms": statistics.median(single),
+        "single_p95_ms": float(np.percentile(single, 95)),
+        "batch_p50_ms": statistics.median(batched),
+        "batch_ms_per_image": sum(batched) / len(inputs),
+    }
+
+
+def evaluate(name, inputs, batch_size, repeat, num_threads):
+    keras_path, tflite_path = MODEL_PATHS[name]
+    report = {"model": name}
+
+    before = rss_mb()
+    keras_backend = KerasBackend.load(keras_path)
+    report["keras_load_rss_mb"] = rss_mb() - before
+    keras_preds, report["keras"] = run(keras_backend, inputs, batch_size, repeat)
+
+    before = rss_mb()
+    tflite_backend = TFLiteBackend.load(tflite_path, num_threads=num_threads)
+    report["tflite_load_rss_mb"] = rss_mb() - before
+    report["tflite_input_dtype"] = np.dtype(tflite_backend.input_dtype).name
+    tflite_preds, report["tflite"] = run(tflite_backend, inputs, batch_size, repeat)
+
+    diff = np.abs(keras_preds - tflite_preds)
+    report["top1_agreement"] = float((top1(keras_preds) == top1(tflite_preds)).mean())
+    report["prob_abs_diff_mean"] = float(diff.mean())
+    report["prob_abs_diff_max"] = float(diff.max())
+    report["speedup_single"] = report["keras"]["single_p50_ms"] / report["tflite"]["single_p50_ms"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", choices=list(MODEL_PATHS), default=list(MODEL_PATHS))
+    parser.add_argument("--images-dir", help="Imágenes de evaluación (por defecto, ruido aleatorio)")
+    parser.add_argument("--samples", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--json", help="Guardar el informe en este fichero JSON")
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.images_dir, args.samples)
+    reports = []
+    for name in args.models:
+        keras_path, tflite_path = MODEL_PATHS[name]
+        if not (os.path.exists(keras_path) and os.path.exists(tflite_path)):
+            print(f"[{name}] Faltan {keras_path} o {tflite_path}, se omite.")
+            continue
+        report = evaluate(name, inputs, args.batch_size, args.repeat, args.num_threads)
+        reports.append(report)
+        print(
+            f"[{name}] keras p50 {report['keras']['single_p50_ms']:.1f} ms | "
+            f"tflite ({report['tflite_input_dtype']}) p50 {report['tflite']['single_p50_ms']:.1f} ms | "
+            f"x{report['speedup_single']:.2f} | RSS {report['keras_load_rss_mb']:.0f} -> {report['tflite_load_rss_mb']:.0f} MB | "
+            f"top-1 {report['top1_agreement'] * 100:.1f}% | |Δp| medio {report['prob_abs_diff_mean']:.4f} máx {report['prob_abs_diff_max']:.4f}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"Informe guardado en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
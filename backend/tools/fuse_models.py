@@ -0,0 +1,192 @@
+"""
+Fusiona los modelos de lunares, acné y rosácea en un único modelo multihead
+cuando comparten el mismo backbone.
+
+Compara las capas de los tres .keras desde la entrada y toma como backbone el
+prefijo común más largo: mismas clases de capa y pesos idénticos (por ejemplo
+una base ImageNet congelada). El modelo fusionado calcula ese backbone una vez
+y aplica encima las capas restantes de cada modelo (las cabezas softmax de
+lunares y sigmoid de acné/rosácea), concatenando sus salidas en el orden
+lunares, acne, rosacea. Las capas de cada modelo se encadenan en orden, como
+en un modelo secuencial; si un modelo tiene otra topología, la verificación
+lo detecta y el modelo fusionado no se guarda.
+
+Antes de guardarlo se verifica que sus salidas coinciden con las de los
+modelos por separado dentro de la tolerancia; si no, no se guarda. Junto al
+modelo se escribe un JSON con las cabezas, el SHA-256 de los .keras de
+origen y el resultado de la verificación, que el servicio comprueba antes de
+servirlo (FUSED_MODEL_MODE=on).
+
+Uso:
+    python -m backend.tools.fuse_models --images-dir datos/validacion
+    python -m backend.tools.fuse_models --verify-only --images-dir datos/validacion
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from backend.config.model_config import get_tensorflow, FUSED_MODEL_PATH, FUSED_MODEL_METADATA_PATH
+from backend.services.fused_model import read_fused_metadata, source_digest
+from backend.services.skin_analysis_service import MODEL_SPECS
+from backend.tools.evaluate_tflite import load_inputs, top1
+
+tf = get_tensorflow()
+keras = tf.keras
+
+
+def chain_layers(model):
+    """Capas del modelo en orden, sin la capa de entrada."""
+    return [layer for layer in model.layers if not isinstance(layer, keras.layers.InputLayer)]
+
+
+def same_layer(a, b, atol=0.0):
+    if type(a) is not type(b):
+        return False
+    wa, wb = a.get_weights(), b.get_weights()
+    if len(wa) != len(wb):
+        return False
+    return all(x.shape == y.shape and np.allclose(x, y, rtol=0.0, atol=atol) for x, y in zip(wa, wb))
+
+
+def shared_prefix(models, atol=0.0):
+    """Número de capas iniciales idénticas en todos los modelos."""
+    chains = [chain_layers(model) for model in models.values()]
+    n = 0
+    for layers in zip(*chains):
+        if not all(same_layer(layers[0], other, atol) for other in layers[1:]):
+            break
+        n += 1
+    # Al menos una capa propia por modelo para la cabeza
+    return min(n, min(len(chain) for chain in chains) - 1)
+
+
+def clone_layer(layer, prefix):
+    config = layer.get_config()
+    config["name"] = f"{prefix}_{layer.name}"
+    return layer.__class__.from_config(config)
+
+
+def build_fused(models, n_shared):
+    """
+    Modelo con el backbone compartido (las `n_shared` primeras capas del
+    primer modelo) y una rama por modelo con copias de sus capas restantes.
+    """
+    first = next(iter(models.values()))
+    inputs = keras.Input(shape=first.input_shape[1:], name="imagen")
+    x = inputs
+    for layer in chain_layers(first)[:n_shared]:
+        x = layer(x)
+    outputs = []
+    for name, model in models.items():
+        h = x
+        for layer in chain_layers(model)[n_shared:]:
+            clone = clone_layer(layer, name)
+            h = clone(h)
+            clone.set_weights(layer.get_weights())
+        outputs.append(h)
+    return keras.Model(inputs, keras.layers.Concatenate(axis=-1, name="cabezas")(outputs), name="piel_multihead")
+
+
+def verify(fused, models, widths, inputs, atol, batch_size=16):
+    """Compara las salidas del modelo fusionado con las de cada modelo por separado."""
+    fused_preds = np.concatenate([
+        fused(inputs[i:i + batch_size], training=False).numpy() for i in range(0, len(inputs), batch_size)
+    ])
+    report = {"atol": atol, "samples": len(inputs), "heads": {}}
+    offset = 0
+    for name, model in models.items():
+        expected = np.concatenate([
+            model(inputs[i:i + batch_size], training=False).numpy() for i in range(0, len(inputs), batch_size)
+        ])
+        got = fused_preds[:, offset:offset + widths[name]]
+        offset += widths[name]
+        report["heads"][name] = {
+            "max_abs_diff": float(np.abs(expected - got).max()),
+            "top1_agreement": float((top1(expected) == top1(got)).mean()),
+        }
+    report["passed"] = all(head["max_abs_diff"] <= atol for head in report["heads"].values())
+    return report
+
+
+def print_report(report):
+    for name, head in report["heads"].items():
+        print(f"[{name}] |Δp| máx {head['max_abs_diff']:.2e} | top-1 {head['top1_agreement'] * 100:.1f}%")
+    print(f"Verificación {'correcta' if report['passed'] else 'FALLIDA'} (tolerancia {report['atol']:.0e}, "
+          f"{report['samples']} imágenes).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=FUSED_MODEL_PATH)
+    parser.add_argument("--metadata", default=FUSED_MODEL_METADATA_PATH)
+    parser.add_argument("--images-dir", help="Imágenes para la verificación (por defecto, ruido aleatorio)")
+    parser.add_argument("--samples", type=int, default=32)
+    parser.add_argument("--atol", type=float, default=1e-4, help="Diferencia absoluta máxima admitida por probabilidad")
+    parser.add_argument("--weight-atol", type=float, default=0.0,
+                        help="Tolerancia al comparar los pesos del backbone entre modelos")
+    parser.add_argument("--verify-only", action="store_true",
+                        help="Verificar el modelo fusionado existente contra los .keras actuales y actualizar sus metadatos")
+    args = parser.parse_args()
+
+    specs = {spec.name: spec for spec in MODEL_SPECS}
+    models = {}
+    for name, spec in specs.items():
+        if not os.path.exists(spec.path):
+            raise SystemExit(f"No existe {spec.path}")
+        print(f"Cargando {name} desde {spec.path}...")
+        models[name] = keras.models.load_model(spec.path)
+    widths = {name: spec.output_width for name, spec in specs.items()}
+    for name, model in models.items():
+        if model.output_shape[-1] != widths[name]:
+            raise SystemExit(f"[{name}] la salida tiene {model.output_shape[-1]} columnas y se esperaban {widths[name]}")
+    inputs = load_inputs(args.images_dir, args.samples)
+
+    if args.verify_only:
+        metadata = read_fused_metadata(args.metadata)
+        if metadata is None or not os.path.exists(args.output):
+            raise SystemExit(f"No hay modelo fusionado en {args.output} con metadatos en {args.metadata}")
+        fused = keras.models.load_model(args.output)
+        report = verify(fused, models, widths, inputs, args.atol)
+        print_report(report)
+        if report["passed"]:
+            metadata["sources"] = {name: source_digest(spec.path) for name, spec in specs.items()}
+        metadata["verification"] = report
+        with open(args.metadata, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        sys.exit(0 if report["passed"] else 1)
+
+    n_shared = shared_prefix(models, args.weight_atol)
+    if n_shared <= 0:
+        raise SystemExit("Los modelos no comparten backbone: no hay nada que fusionar.")
+    backbone = [layer.name for layer in chain_layers(next(iter(models.values())))[:n_shared]]
+    print(f"Backbone compartido: {n_shared} capas ({', '.join(backbone)})")
+    fused = build_fused(models, n_shared)
+    report = verify(fused, models, widths, inputs, args.atol)
+    print_report(report)
+    if not report["passed"]:
+        raise SystemExit("El modelo fusionado no reproduce los modelos por separado: no se guarda.")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    # Guardar con un rename atómico para que la recarga en caliente no lea un fichero a medias
+    tmp_path = f"{args.output}.tmp.keras"
+    fused.save(tmp_path)
+    os.replace(tmp_path, args.output)
+    metadata = {
+        "heads": [{"name": name, "width": widths[name]} for name in specs],
+        "backbone_layers": backbone,
+        "sources": {name: source_digest(spec.path) for name, spec in specs.items()},
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "verification": report,
+    }
+    with open(args.metadata, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    print(f"Modelo fusionado guardado en {args.output} (metadatos en {args.metadata}).")
+    print("Para servirlo: FUSED_MODEL_MODE=on")
+
+
+if __name__ == "__main__":
+    main()
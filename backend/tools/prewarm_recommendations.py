@@ -0,0 +1,67 @@
+"""
+Pre-calienta la caché persistente de recomendaciones de OpenAI.
+
+Consulta las recomendaciones de todas las etiquetas que pueden devolver los
+modelos (lunares, acné y rosácea) y las guarda en RECOMMENDATION_CACHE_PATH,
+de modo que /skin/openai-recomendaciones responda desde la caché desde la
+primera petición. Por defecto solo consulta las etiquetas sin entrada vigente;
+con --force las renueva todas (por ejemplo, tras cambiar el prompt).
+
+Uso:
+    python -m backend.tools.prewarm_recommendations
+    python -m backend.tools.prewarm_recommendations --force --labels "Melanoma" "Con acné"
+"""
+import argparse
+import asyncio
+import time
+
+from backend.services.openai_client import openai_client
+from backend.services.recommendations import KNOWN_LABELS, normalize_label, recommendation_cache
+
+
+async def prewarm(labels, force=False, concurrency=4):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(label):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if force:
+                    await recommendation_cache.refresh(label)
+                else:
+                    await recommendation_cache.get(label)
+            except Exception as e:
+                print(f"  {label}: error {e}")
+                return False
+            print(f"  {label}: {time.perf_counter() - start:.2f}s")
+            return True
+
+    try:
+        results = await asyncio.gather(*(_one(label) for label in labels))
+    finally:
+        await openai_client.close()
+    return sum(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", nargs="+", help="Etiquetas a pre-calentar (por defecto, todas las de los modelos)")
+    parser.add_argument("--force", action="store_true", help="Renovar también las entradas vigentes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Consultas simultáneas a OpenAI")
+    args = parser.parse_args()
+
+    if recommendation_cache.backend == "none":
+        raise SystemExit("La caché de recomendaciones está desactivada (RECOMMENDATION_CACHE_BACKEND=none).")
+    labels = args.labels or sorted(KNOWN_LABELS.values())
+    unknown = [label for label in labels if normalize_label(label) not in KNOWN_LABELS]
+    if unknown:
+        raise SystemExit(f"Etiquetas desconocidas (no las devuelve ningún modelo): {', '.join(unknown)}")
+    print(f"Pre-calentando {len(labels)} etiquetas en {recommendation_cache.path}")
+    ok = asyncio.run(prewarm(labels, args.force, args.concurrency))
+    stats = recommendation_cache.stats()
+    print(f"{ok}/{len(labels)} etiquetas listas; {stats['upstream_calls']} llamadas a OpenAI, "
+          f"{stats['fresh_hits']} ya estaban vigentes.")
+
+
+if __name__ == "__main__":
+    main()
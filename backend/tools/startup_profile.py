@@ -0,0 +1,148 @@
+"""
+Perfil del tiempo de arranque del backend.
+
+Importa `backend.main` en un subproceso limpio con `python -X importtime` y
+muestra dónde se va el tiempo de importación (acumulado por paquete de primer
+nivel y los módulos más costosos por tiempo propio). Comprueba además que
+TensorFlow no se importa en el camino de arranque.
+
+Con --serve arranca uvicorn y mide el tiempo hasta la primera respuesta de una
+ruta sin inferencia (/skin/api/condition/acne) y hasta /health/ready.
+
+Uso:
+    python -m backend.tools.startup_profile --top 15
+    python -m backend.tools.startup_profile --serve --json arranque.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_IMPORT_SNIPPET = (
+    "import time; _t = time.perf_counter(); import backend.main; "
+    "print('__WALL__', time.perf_counter() - _t)"
+)
+
+
+def profile_imports(module_snippet=_IMPORT_SNIPPET):
+    """Devuelve (segundos de pared, [(módulo, propio_us, acumulado_us, profundidad)])."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", module_snippet],
+        cwd=ROOT_DIR, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"Falló la importación de backend.main:\n{proc.stderr[-2000:]}")
+    wall = next(float(line.split()[1]) for line in proc.stdout.splitlines() if line.startswith("__WALL__"))
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return wall, entries
+
+
+def summarize(entries, top):
+    # Tiempo acumulado de los módulos importados directamente (profundidad mínima)
+    min_depth = min(depth for *_, depth in entries) if entries else 0
+    by_package = {}
+    for name, _, cumulative, depth in entries:
+        if depth == min_depth:
+            package = name.split(".")[0]
+            by_package[package] = by_package.get(package, 0) + cumulative
+    packages = sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    modules = sorted(entries, key=lambda e: e[1], reverse=True)[:top]
+    return packages, modules
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url, deadline, accept=(200,)):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status in accept:
+                    return True
+        except urllib.error.HTTPError as e:
+            if e.code in accept:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.05)
+    return False
+
+
+def profile_serving(timeout):
+    """Mide el tiempo hasta servir una ruta sin inferencia y hasta /health/ready."""
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT_DIR,
+    )
+    try:
+        deadline = started + timeout
+        first = _wait_for(f"{base}/skin/api/condition/acne", deadline)
+        first_at = time.perf_counter() - started if first else None
+        ready = _wait_for(f"{base}/health/ready", deadline)
+        ready_at = time.perf_counter() - started if ready else None
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {"first_response_s": first_at, "ready_s": ready_at}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--serve", action="store_true", help="Medir también el arranque con uvicorn")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", help="Guardar el informe en este fichero JSON")
+    args = parser.parse_args()
+
+    wall, entries = profile_imports()
+    packages, modules = summarize(entries, args.top)
+    tensorflow_imported = any(name == "tensorflow" for name, *_ in entries)
+
+    print(f"import backend.main: {wall:.3f} s")
+    print(f"TensorFlow importado al arrancar: {'SÍ' if tensorflow_imported else 'no'}")
+    print(f"\n{'paquete':<40}{'acumulado ms':>14}")
+    for package, cumulative in packages:
+        print(f"{package:<40}{cumulative / 1000:>14.1f}")
+    print(f"\n{'módulo':<56}{'propio ms':>12}{'acumulado ms':>14}")
+    for name, self_us, cumulative, _ in modules:
+        print(f"{name:<56}{self_us / 1000:>12.1f}{cumulative / 1000:>14.1f}")
+
+    report = {
+        "import_wall_s": wall,
+        "tensorflow_imported": tensorflow_imported,
+        "packages_ms": {p: c / 1000 for p, c in packages},
+        "modules_ms": [{"module": n, "self_ms": s / 1000, "cumulative_ms": c / 1000} for n, s, c, _ in modules],
+    }
+    if args.serve:
+        serving = profile_serving(args.timeout)
+        report.update(serving)
+        print(f"\nPrimera respuesta sin inferencia: {serving['first_response_s']} s")
+        print(f"Modelos listos (/health/ready): {serving['ready_s']} s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Informe guardado en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import backend.services.admission as adm
+from backend.services.disconnect import ClientDisconnected
+
+
+async def _in_thread(fn, *args):
+    return await asyncio.to_thread(fn, *args)
+
+
+@pytest.fixture(autouse=True)
+def thread_inference(monkeypatch):
+    # Sin TensorFlow ni el executor compartido: la "inferencia" corre en un hilo
+    monkeypatch.setattr(adm, "run_inference", _in_thread)
+
+
+class FakeRequest:
+    def __init__(self, deadline_ms=None, disconnected=False):
+        self.headers = {} if deadline_ms is None else {"X-Request-Deadline-Ms": str(deadline_ms)}
+        self.state = SimpleNamespace(received_at=time.monotonic())
+        self.disconnected = disconnected
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def _controller(limit=1):
+    return adm.AdmissionController(default_limit=limit, default_deadline_ms=5000, max_deadline_ms=10000)
+
+
+async def _occupy(controller, model, gate):
+    """Ocupa el único hueco de `model` hasta que se abra `gate`."""
+    task = asyncio.create_task(controller.run(FakeRequest(), model, gate.wait, 5))
+    while controller._gate(model).active == 0:
+        await asyncio.sleep(0.01)
+    return task
+
+
+def test_runs_fn_and_records_duration():
+    controller = _controller()
+    result = asyncio.run(controller.run(FakeRequest(), "m", lambda x: x * 2, 21))
+    assert result == 42
+    stats = controller.stats()["m"]
+    assert stats["admitted"] == 1 and stats["active"] == 0
+    assert stats["avg_inference_ms"] >= 0
+
+
+def test_limit_caps_concurrent_inference():
+    controller = _controller(limit=2)
+    lock = threading.Lock()
+    current = peak = 0
+
+    def work():
+        nonlocal current, peak
+        with lock:
+            current += 1
+            peak = max(peak, current)
+        time.sleep(0.05)
+        with lock:
+            current -= 1
+
+    async def scenario():
+        await asyncio.gather(*(controller.run(FakeRequest(), "m", work) for _ in range(6)))
+
+    asyncio.run(scenario())
+    assert peak == 2
+    assert controller.stats()["m"]["admitted"] == 6
+
+
+def test_sheds_when_estimated_wait_exceeds_deadline():
+    controller = _controller()
+    gate = threading.Event()
+
+    async def scenario():
+        occupant = await _occupy(controller, "m", gate)
+        # Con 3 s de media por inferencia no cabe en un plazo de 100 ms
+        controller._gate("m").observe(3.0)
+        try:
+            with pytest.raises(adm.Overloaded) as excinfo:
+                await controller.run(FakeRequest(deadline_ms=100), "m", lambda: None)
+        finally:
+            gate.set()
+            await occupant
+        return excinfo.value
+
+    error = asyncio.run(scenario())
+    assert error.retry_after >= 3
+    assert controller.stats()["m"]["rejected"] == 1
+
+
+def test_deadline_expires_while_waiting_for_a_slot():
+    controller = _controller()
+    gate = threading.Event()
+    calls = []
+
+    async def scenario():
+        # Sin media conocida la espera estimada es 0: se admite a esperar
+        occupant = await _occupy(controller, "m", gate)
+        try:
+            with pytest.raises(adm.DeadlineExceeded):
+                await controller.run(FakeRequest(deadline_ms=100), "m", calls.append, 1)
+        finally:
+            gate.set()
+            await occupant
+
+    asyncio.run(scenario())
+    assert calls == []
+    stats = controller.stats()["m"]
+    assert stats["expired"] == 1 and stats["waiting"] == 0 and stats["active"] == 0
+
+
+def test_deadline_expires_during_slow_inference():
+    controller = _controller()
+    with pytest.raises(adm.DeadlineExceeded):
+        asyncio.run(controller.run(FakeRequest(deadline_ms=100), "m", time.sleep, 0.5))
+    assert controller.stats()["m"]["active"] == 0
+
+
+def test_disconnect_while_queued_cancels_before_inference():
+    controller = _controller()
+    gate = threading.Event()
+    calls = []
+
+    async def scenario():
+        occupant = await _occupy(controller, "m", gate)
+        try:
+            with pytest.raises(ClientDisconnected):
+                await controller.run(FakeRequest(disconnected=True), "m", calls.append, 1)
+            # La tarea cancelada sale de la cola del semáforo en la siguiente vuelta del loop
+            await asyncio.sleep(0.05)
+            waiting = controller.stats()["m"]["waiting"]
+        finally:
+            gate.set()
+            await occupant
+        return waiting
+
+    assert asyncio.run(scenario()) == 0
+    assert calls == []
+    assert controller.stats()["m"]["disconnected"] == 1
+
+
+def test_deadline_header_is_clamped():
+    controller = _controller()
+    request = FakeRequest(deadline_ms=10 ** 9)
+    assert request.state.received_at + 10.0 == pytest.approx(controller.deadline_for(request))
+    request = FakeRequest(deadline_ms="abc")
+    assert request.state.received_at + 5.0 == pytest.approx(controller.deadline_for(request))
+
+
+def test_gate_hands_slots_over_in_arrival_order():
+    async def scenario():
+        gate = adm._ModelGate(1)
+        await gate.acquire(1)
+        order = []
+
+        async def waiter(name):
+            await gate.acquire(1)
+            order.append(name)
+            gate.release()
+
+        tasks = []
+        for name in ("a", "b", "c"):
+            tasks.append(asyncio.create_task(waiter(name)))
+            await asyncio.sleep(0)
+        gate.release()
+        await asyncio.gather(*tasks)
+        return order, gate.active
+
+    assert asyncio.run(scenario()) == (["a", "b", "c"], 0)
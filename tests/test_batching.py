@@ -0,0 +1,72 @@
+import threading
+
+import numpy as np
+import pytest
+
+from backend.services.batching import MicroBatcher
+
+
+def _image(value):
+    return np.full((1, 2, 2, 3), value, dtype=np.float32)
+
+
+class FakeModel:
+    """Devuelve por fila el valor de su primer píxel y anota el tamaño de cada lote."""
+
+    def __init__(self, fail=False):
+        self.batch_sizes = []
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            self.batch_sizes.append(len(batch))
+        if self.fail:
+            raise RuntimeError("forward roto")
+        return batch[:, 0, 0, 0]
+
+
+def test_concurrent_submits_share_one_forward_pass():
+    model = FakeModel()
+    batcher = MicroBatcher("test", model, float, max_batch_size=4, max_wait_ms=500)
+    futures = [batcher.submit(_image(i)) for i in range(4)]
+    assert [f.result(timeout=5) for f in futures] == [0.0, 1.0, 2.0, 3.0]
+    assert model.batch_sizes == [4]
+    stats = batcher.stats()
+    assert stats["batches"] == 1 and stats["full_batches"] == 1
+
+
+def test_batches_never_exceed_max_size():
+    model = FakeModel()
+    batcher = MicroBatcher("test", model, float, max_batch_size=2, max_wait_ms=50)
+    futures = [batcher.submit(_image(i)) for i in range(5)]
+    assert [f.result(timeout=5) for f in futures] == [float(i) for i in range(5)]
+    assert max(model.batch_sizes) <= 2
+    assert sum(model.batch_sizes) == 5
+
+
+def test_single_request_is_not_held_past_max_wait():
+    batcher = MicroBatcher("test", FakeModel(), float, max_batch_size=16, max_wait_ms=1)
+    assert batcher.predict(_image(7), timeout=5) == 7.0
+
+
+def test_forward_error_reaches_every_caller_in_the_batch():
+    batcher = MicroBatcher("test", FakeModel(fail=True), float, max_batch_size=4, max_wait_ms=200)
+    futures = [batcher.submit(_image(i)) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="forward roto"):
+            future.result(timeout=5)
+
+
+def test_postprocess_error_only_affects_its_row():
+    def postprocess(row):
+        if row == 1.0:
+            raise ValueError("fila mala")
+        return float(row)
+
+    batcher = MicroBatcher("test", FakeModel(), postprocess, max_batch_size=3, max_wait_ms=200)
+    futures = [batcher.submit(_image(i)) for i in range(3)]
+    assert futures[0].result(timeout=5) == 0.0
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 2.0
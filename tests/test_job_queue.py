@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import backend.services.job_queue as jq
+from backend.services.result_store import MemoryResultStore
+
+
+async def _in_thread(fn, *args):
+    return await asyncio.to_thread(fn, *args)
+
+
+class SlowFirstWriteStore(MemoryResultStore):
+    """Almacén cuya primera escritura tarda: una escritura posterior no debe adelantarla."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+        self._first = True
+
+    def put(self, record, result_id=None):
+        if self._first:
+            self._first = False
+            time.sleep(0.2)
+        self.writes.append(record["estado"])
+        return super().put(record, result_id)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryResultStore()
+    monkeypatch.setattr(jq, "result_store", store)
+    # Sin TensorFlow ni el executor compartido: la "inferencia" corre en un hilo
+    monkeypatch.setattr(jq, "run_inference", _in_thread)
+    return store
+
+
+async def _wait_finished(queue, job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while job.state not in jq.FINAL_STATES:
+        assert time.monotonic() < deadline, "el trabajo no terminó a tiempo"
+        await queue.wait_for_change(job.id, 0.5)
+
+
+def test_jobs_run_in_priority_order(store):
+    async def scenario():
+        queue = jq.JobQueue(max_size=8, workers=1)
+        await queue.start()
+        gate = threading.Event()
+        order = []
+
+        def blocker(image_bytes, models):
+            gate.wait(5)
+            return {}
+
+        def record(image_bytes, models):
+            order.append(models[0])
+            return {}
+
+        try:
+            first = await queue.submit(blocker, b"", ["bloqueo"])
+            while first.state != jq.RUNNING:
+                await asyncio.sleep(0.01)
+            jobs = [
+                await queue.submit(record, b"", [name], priority=name)
+                for name in ("low", "normal", "high")
+            ]
+            assert [queue.position(job.id) for job in jobs] == [2, 1, 0]
+            gate.set()
+            for job in jobs:
+                await _wait_finished(queue, job)
+        finally:
+            gate.set()
+            await queue.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ["high", "normal", "low"]
+
+
+def test_full_queue_rejects_with_retry_after(store):
+    async def scenario():
+        queue = jq.JobQueue(max_size=2, workers=1)
+        await queue.start()
+        gate = threading.Event()
+
+        def blocker(image_bytes, models):
+            gate.wait(5)
+            return {}
+
+        try:
+            running = await queue.submit(blocker, b"", ["m"])
+            while running.state != jq.RUNNING:
+                await asyncio.sleep(0.01)
+            await queue.submit(blocker, b"", ["m"])
+            await queue.submit(blocker, b"", ["m"])
+            with pytest.raises(jq.JobQueueFull) as excinfo:
+                await queue.submit(blocker, b"", ["m"])
+            stats = queue.stats()
+        finally:
+            gate.set()
+            await queue.stop()
+        return excinfo.value, stats
+
+    error, stats = asyncio.run(scenario())
+    assert error.retry_after >= 1
+    assert stats["rejected"] == 1 and stats["queued"] == 2
+
+
+def test_last_persisted_state_is_the_final_one(monkeypatch):
+    store = SlowFirstWriteStore()
+    monkeypatch.setattr(jq, "result_store", store)
+    monkeypatch.setattr(jq, "run_inference", _in_thread)
+
+    async def scenario():
+        queue = jq.JobQueue(max_size=4, workers=1)
+        await queue.start()
+        try:
+            job = await queue.submit(lambda image_bytes, models: {"m": 0.5}, b"img", ["m"])
+            await _wait_finished(queue, job)
+            # Dar tiempo a la última escritura, que sigue a la notificación
+            for _ in range(100):
+                if store.writes[-1:] == [jq.DONE]:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert store.writes == [jq.QUEUED, jq.RUNNING, jq.DONE]
+    assert store.get(job.id)["estado"] == jq.DONE
+    assert job.image_bytes is None
+
+
+def test_failed_job_is_reported_and_served_from_store(store):
+    def broken(image_bytes, models):
+        raise ValueError("imagen corrupta")
+
+    async def scenario():
+        queue = jq.JobQueue(max_size=4, workers=1)
+        await queue.start()
+        try:
+            job = await queue.submit(broken, b"img", ["m"], filename="lunar.jpg")
+            await _wait_finished(queue, job)
+            await asyncio.sleep(0.05)
+            local = await queue.get(job.id)
+            # Como lo vería otro worker de uvicorn, que no tiene el trabajo en memoria
+            queue._jobs.clear()
+            stored = await queue.get(job.id)
+            stats = queue.stats()
+        finally:
+            await queue.stop()
+        return local, stored, stats
+
+    local, stored, stats = asyncio.run(scenario())
+    assert local["estado"] == jq.FAILED and "imagen corrupta" in local["error"]
+    assert stored["estado"] == jq.FAILED and stored["filename"] == "lunar.jpg"
+    assert "modelo" not in stored
+    assert stats["failed"] == 1
+
+
+def test_get_ignores_records_that_are_not_jobs(store):
+    async def scenario():
+        queue = jq.JobQueue()
+        result_id = store.put({"modelo": "lunares", "estado": jq.DONE})
+        return await queue.get(result_id), await queue.get("no-existe")
+
+    assert asyncio.run(scenario()) == (None, None)
@@ -0,0 +1,83 @@
+import threading
+import uuid
+
+import pytest
+
+from backend.services.result_store import MemoryResultStore, SQLiteResultStore
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    return SQLiteResultStore(str(tmp_path / "resultados.db"), max_entries=5, ttl_seconds=3600)
+
+
+def test_memory_store_evicts_oldest_over_cap():
+    store = MemoryResultStore(max_entries=2)
+    ids = [store.put({"n": i}) for i in range(3)]
+    assert store.get(ids[0]) is None
+    assert store.get(ids[2]) == {"n": 2}
+    assert store.stats()["evictions"] == 1
+
+
+def test_sqlite_round_trip_is_visible_from_another_worker(tmp_path):
+    path = str(tmp_path / "resultados.db")
+    record = {"modelo": "lunares", "probabilidades": {"benigno": 0.9, "maligno": 0.1}}
+    result_id = SQLiteResultStore(path).put(record)
+    uuid.UUID(result_id)
+    # Otra instancia sobre el mismo fichero, como haría otro worker de uvicorn
+    assert SQLiteResultStore(path).get(result_id) == record
+
+
+def test_sqlite_put_keeps_given_id(sqlite_store):
+    result_id = str(uuid.uuid4())
+    assert sqlite_store.put({"estado": "en_cola"}, result_id) == result_id
+    sqlite_store.put({"estado": "completado"}, result_id)
+    assert sqlite_store.get(result_id) == {"estado": "completado"}
+    assert sqlite_store.stats()["entries"] == 1
+
+
+@pytest.mark.parametrize("result_id", ["no-es-un-uuid", "", None, str(uuid.uuid4())])
+def test_sqlite_unknown_ids_return_none(sqlite_store, result_id):
+    assert sqlite_store.get(result_id) is None
+
+
+def test_sqlite_cap_is_enforced_on_every_put(sqlite_store):
+    ids = [sqlite_store.put({"n": i}) for i in range(8)]
+    stats = sqlite_store.stats()
+    assert stats["entries"] == 5
+    assert stats["evictions"] == 3
+    # Se desalojan los que caducan antes, es decir, los más antiguos
+    assert [sqlite_store.get(i) for i in ids[:3]] == [None, None, None]
+    assert sqlite_store.get(ids[-1]) == {"n": 7}
+
+
+def test_sqlite_expired_entries_are_hidden_and_purged(tmp_path):
+    store = SQLiteResultStore(str(tmp_path / "resultados.db"), ttl_seconds=0)
+    result_id = store.put({"n": 1})
+    assert store.get(result_id) is None
+    assert store.purge_expired() == 1
+    stats = store.stats()
+    assert stats["entries"] == 0 and stats["expirations"] == 1
+
+
+def test_sqlite_concurrent_puts_stay_within_cap(tmp_path):
+    path = str(tmp_path / "resultados.db")
+    # Una instancia por hilo con su propia conexión, igual que varios procesos
+    stores = [SQLiteResultStore(path, max_entries=10) for _ in range(4)]
+    errors = []
+
+    def writer(store):
+        try:
+            for i in range(25):
+                store.put({"n": i})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert stores[0].stats()["entries"] == 10
+    assert sum(store.stats()["evictions"] for store in stores) == 90